@@ -0,0 +1,60 @@
+"""
+Micro-benchmark for spotting scanner message headers, comparing the compiled
+matcher with the original per-header check it replaced.
+
+Usage: PYTHONPATH=. python benchmarks/header_match.py
+"""
+import random
+import timeit
+from typing import Set
+
+from signal_scanner_bot.messages import HeaderMatcher
+
+
+NEIGHBORHOODS = [
+    "BALLARD", "BEACON HILL", "BELLTOWN", "CAPITOL HILL", "CENTRAL DISTRICT",
+    "CHINATOWN", "COLUMBIA CITY", "DELRIDGE", "EASTLAKE", "FREMONT",
+    "GEORGETOWN", "GREENWOOD", "INTERBAY", "LAKE CITY", "MADISON PARK",
+    "MAGNOLIA", "MONTLAKE", "NORTHGATE", "PIONEER SQUARE", "QUEEN ANNE",
+    "RAINIER BEACH", "RAVENNA", "SODO", "SOUTH PARK", "UNIVERSITY DISTRICT",
+    "WALLINGFORD", "WEST SEATTLE", "WHITE CENTER",
+]  # fmt: skip
+HEADERS = {
+    f"{kind} {hood}" for kind in ["DISPATCH", "RESPONSE"] for hood in NEIGHBORHOODS
+} | {"GENERIC MESSAGE"}
+
+
+def legacy_is_scanner_message(message: str, headers: Set[str]) -> bool:
+    """Run the original check, kept here to benchmark against."""
+    return any([message.upper().startswith(header) for header in headers])
+
+
+def main() -> None:
+    rng = random.Random(0)
+    body = "Units staging at 5th & Pine, avoid the area " * 3
+    headers = sorted(HEADERS)
+    # Most traffic in a busy group chat doesn't carry a header at all
+    messages = [
+        f"{rng.choice(headers).lower()}: {body}" if rng.random() < 0.3 else body
+        for _ in range(1000)
+    ]
+    matcher = HeaderMatcher(HEADERS)
+    for message in messages:
+        assert (matcher.match(message) is not None) == legacy_is_scanner_message(
+            message, HEADERS
+        )
+
+    print(f"{len(HEADERS)} headers, {len(messages)} messages per run")
+    for name, check in [
+        ("legacy", lambda m: legacy_is_scanner_message(m, HEADERS)),
+        ("compiled", matcher.match),
+    ]:
+        runs = timeit.repeat(
+            lambda: [check(message) for message in messages], number=20, repeat=5
+        )
+        per_message = min(runs) / (20 * len(messages)) * 1e6
+        print(f"{name:>10}: {per_message:.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+End-to-end benchmark of the bot's pipelines, run entirely offline.
+
+The real transport coroutines are run against local stand-ins:
+  * signal-cli is tests/fake_signal_cli.py in `jsonRpc` mode, pushing scanner
+    messages at a fixed rate and acknowledging sends
+  * Twitter is a fake Peony client whose stream yields tweets at a fixed rate
+    and whose status updates are recorded as they're posted
+  * OpenMHz, RadioChaser and the call audio are served by aiohttp from a
+    separate process
+
+For each pipeline it reports throughput, p50/p99 end-to-end latency and the
+CPU time the bot's process spent per message. The fakes that run in their own
+processes aren't counted towards CPU time.
+
+Usage: PYTHONPATH=. python benchmarks/pipeline.py [--messages N] [--rate R]
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List
+
+
+_TEMP_DIR = tempfile.mkdtemp(prefix="signal-scanner-bot-benchmark-")
+os.environ.update(
+    {
+        "BOT_NUMBER": "+15555550100",
+        "ADMIN_CONTACT": "+15555550101",
+        "LISTEN_CONTACT": "",
+        "SIGNAL_MESSAGE_HEADERS": "DISPATCH",
+        "SEND_HASHTAGS": "#Bench",
+        "TRUSTED_TWEETERS": "1234",
+        "RECEIVE_HASHTAGS": "bench",
+        "AUTOSCAN_STATE_FILE_PATH": str(Path(_TEMP_DIR) / "autoscan-state"),
+        "RADIO_MONITOR_UNITS": "SWAT",
+        "RADIO_MONITOR_CONTACT": "+15555550104",
+        "RADIO_AUDIO_DIR": _TEMP_DIR,
+        "TWEET_THREAD_MAX": "100",
+    }
+)
+
+from signal_scanner_bot import (  # noqa: E402
+    env,
+    messages,
+    radio_monitor_alert,
+    signal,
+    signal_daemon,
+    transport,
+    twitter,
+)
+
+
+FAKE_SIGNAL_CLI = [
+    sys.executable,
+    str(Path(__file__).parent.parent / "tests" / "fake_signal_cli.py"),
+]
+# Messages carry the float epoch time they were created at as their last word
+SENT_AT = re.compile(r"(?:DISPATCH|BENCH) \d+ (\d+\.\d+)")
+TIMEOUT = 120
+# Daemon -> the task running it, see _start_daemon
+_DAEMON_RUNNERS: Dict[signal_daemon.SignalDaemon, asyncio.Task] = {}
+
+
+################################################################################
+# Results
+################################################################################
+class Result:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.elapsed = 0.0
+        self.cpu = 0.0
+
+    def record(self, text: str) -> None:
+        now = time.time()
+        self.latencies.extend(now - float(sent) for sent in SENT_AT.findall(text))
+
+    def report(self) -> str:
+        count = len(self.latencies)
+        if count < 2:
+            return f"{self.name:<18} {count:>8} (not enough messages made it through)"
+        quantiles = statistics.quantiles(self.latencies, n=100)
+        return (
+            f"{self.name:<18} {count:>8} {count / self.elapsed:>9.1f}"
+            f" {quantiles[49] * 1000:>9.1f} {quantiles[98] * 1000:>9.1f}"
+            f" {self.cpu / count * 1000:>11.3f}"
+        )
+
+
+@contextlib.contextmanager
+def _measure(result: Result):
+    started, cpu_started = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        result.elapsed = time.perf_counter() - started
+        result.cpu = time.process_time() - cpu_started
+
+
+async def _wait_for(result: Result, count: int) -> None:
+    deadline = time.monotonic() + TIMEOUT
+    while len(result.latencies) < count and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def _start_daemon(*args: str) -> signal_daemon.SignalDaemon:
+    # Swap a fresh daemon in wherever the shared one is used
+    daemon = signal_daemon.SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc", *args])
+    signal_daemon.DAEMON = daemon
+    _DAEMON_RUNNERS[daemon] = asyncio.create_task(daemon.run())
+    assert await daemon.wait_ready(10), "fake signal-cli didn't start"
+    return daemon
+
+
+async def _stop_daemon(daemon: signal_daemon.SignalDaemon) -> None:
+    await daemon.stop()
+    await _DAEMON_RUNNERS.pop(daemon)
+
+
+def _record_signal_sends(result: Result) -> None:
+    async def send(message: str, recipient: str, attachment=None) -> None:
+        await deliver(message, recipient, attachment)
+        result.record(message)
+
+    deliver = signal._deliver_message
+    signal.DISPATCHER._send = send
+
+
+################################################################################
+# Fake Twitter
+################################################################################
+class FakeTwitter:
+    """
+    Just enough of PeonyClient for the bot: a filter stream, timelines and
+    posting.
+    """
+
+    def __init__(self, result: Result, count: int = 0, rate: float = 1):
+        self.result = result
+        self.count = count
+        self.rate = rate
+        self._ids = itertools.count(1)
+        self.api = SimpleNamespace(
+            statuses=SimpleNamespace(
+                update=SimpleNamespace(post=self._post),
+                user_timeline=SimpleNamespace(get=self._timeline),
+            )
+        )
+        self.stream = SimpleNamespace(
+            statuses=SimpleNamespace(filter=SimpleNamespace(post=self._filter))
+        )
+
+    async def _post(self, status: str, **params) -> SimpleNamespace:
+        self.result.record(status)
+        return SimpleNamespace(id=next(self._ids))
+
+    async def _timeline(self, **params) -> List:
+        # The stream never drops, so there's never anything to catch up on
+        return []
+
+    @contextlib.asynccontextmanager
+    async def _filter(self, **params):
+        yield self._tweets()
+
+    async def _tweets(self):
+        started = time.monotonic()
+        for index in range(self.count):
+            await asyncio.sleep(max(started + index / self.rate - time.monotonic(), 0))
+            yield {
+                "id": index,
+                "text": f"BENCH {index} {time.time():.6f} #Bench",
+                "user": {"id_str": "1234"},
+                "entities": {"hashtags": [{"text": "Bench"}]},
+            }
+
+
+################################################################################
+# Fake OpenMHz & RadioChaser
+################################################################################
+def _serve_radio(port: int, calls_per_poll: int, audio_size: int) -> None:
+    from aiohttp import web
+
+    ids = itertools.count()
+    audio = os.urandom(audio_size)
+
+    async def openmhz(request: web.Request) -> web.Response:
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        calls = []
+        for _ in range(calls_per_poll):
+            call_id = next(ids)
+            calls.append(
+                {
+                    "_id": str(call_id),
+                    "time": now,
+                    "url": f"http://127.0.0.1:{port}/audio/{call_id}.m4a",
+                    # A pool of 500 radios, so the officer cache gets some use
+                    "srcList": [{"src": (call_id * 7 + n) % 500} for n in range(3)],
+                }
+            )
+        return web.json_response({"calls": calls})
+
+    async def radio_chaser(request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                radio: {
+                    "full_name": f"Officer {radio}",
+                    "badge": radio,
+                    # One in five radios belongs to a monitored unit
+                    "unit_description": "SWAT" if int(radio) % 5 == 0 else "PATROL",
+                }
+                for radio in request.query.getall("radio")
+            }
+        )
+
+    async def audio_file(request: web.Request) -> web.Response:
+        return web.Response(body=audio)
+
+    app = web.Application()
+    app.router.add_get("/openmhz", openmhz)
+    app.router.add_get("/radiochaser", radio_chaser)
+    app.router.add_get("/audio/{name}", audio_file)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_for_port(port: int) -> None:
+    for _ in range(200):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.05)
+        else:
+            writer.close()
+            return
+    raise RuntimeError("fake OpenMHz/RadioChaser didn't start")
+
+
+################################################################################
+# Scenarios
+################################################################################
+async def signal_to_twitter(count: int, rate: float) -> Result:
+    """Scanner messages from signal-cli to tweets."""
+    result = Result("signal->twitter")
+    env.LISTEN_CONTACT = ""
+    env.CLIENT = FakeTwitter(result)
+    daemon = await _start_daemon(
+        "--receive-count",
+        str(count),
+        "--receive-rate",
+        str(rate),
+        "--receive-message",
+        "DISPATCH",
+    )
+    with _measure(result):
+        task = asyncio.create_task(transport.signal_to_twitter())
+        await _wait_for(result, count)
+    task.cancel()
+    await _stop_daemon(daemon)
+    return result
+
+
+async def twitter_to_signal(count: int, rate: float) -> Result:
+    """Tweets from the stream to (coalesced) Signal messages."""
+    result = Result("twitter->signal")
+    env.LISTEN_CONTACT = "+15555550103"
+    env.STATE.LISTENING = True
+    env.CLIENT = FakeTwitter(result, count, rate)
+    daemon = await _start_daemon()
+    _record_signal_sends(result)
+    with _measure(result):
+        task = asyncio.create_task(transport.twitter_to_queue())
+        await _wait_for(result, count)
+    task.cancel()
+    await _stop_daemon(daemon)
+    return result
+
+
+async def radio_alerts(
+    polls: int, calls_per_poll: int, audio_size: int, feeds: int
+) -> Result:
+    """
+    Run OpenMHz calls through to Signal alerts with audio, from `feeds` feeds
+    polled at the same time over the one shared session. The transport loop
+    waits seconds between polls, so this runs its body back to back instead.
+    Latency is measured from the call's time to its poll's alerts being sent.
+    """
+    result = Result("radio->signal")
+    port = _free_port()
+    server = multiprocessing.Process(
+        target=_serve_radio, args=(port, calls_per_poll, audio_size), daemon=True
+    )
+    server.start()
+    env.RADIO_CHASER_URL = f"http://127.0.0.1:{port}/radiochaser"
+    units = radio_monitor_alert.UnitMatcher(env.RADIO_MONITOR_UNITS)
+    radio_feeds = [
+        radio_monitor_alert.RadioFeed(
+            str(index),
+            url=f"http://127.0.0.1:{port}/openmhz?feed={index}",
+            units=units,
+            contact=env.RADIO_MONITOR_CONTACT,
+            interval=45,
+            active_interval=45,
+            quiet_interval=45,
+        )
+        for index in range(feeds)
+    ]
+
+    async def poll(feed, session) -> None:
+        for _ in range(polls):
+            poll = await radio_monitor_alert.check_radio_calls(session, feed)
+            if poll.alerts:
+                await messages.send_radio_monitor_alerts(
+                    poll.alerts, session, feed.contact
+                )
+                sent = time.time()
+                result.latencies.extend(
+                    sent - call_time.timestamp() for _, _, call_time in poll.alerts
+                )
+            poll.done()
+
+    try:
+        await _wait_for_port(port)
+        daemon = await _start_daemon()
+        with _measure(result):
+            async with radio_monitor_alert.create_session(feeds) as session:
+                await asyncio.gather(*(poll(feed, session) for feed in radio_feeds))
+        await _stop_daemon(daemon)
+    finally:
+        server.terminate()
+    return result
+
+
+################################################################################
+# Main
+################################################################################
+async def run(args: argparse.Namespace) -> List[Result]:
+    if args.batch_window is not None:
+        signal.DISPATCHER.coalesce_window = args.batch_window
+    if args.tweet_window is not None:
+        twitter.COALESCER.window = args.tweet_window
+    results = []
+    scenarios: Dict = {
+        "signal": lambda: signal_to_twitter(args.messages, args.rate),
+        "twitter": lambda: twitter_to_signal(args.messages, args.rate),
+        "radio": lambda: radio_alerts(
+            args.polls, args.calls, args.audio_size, args.feeds
+        ),
+    }
+    for name in args.scenario or scenarios:
+        results.append(await scenarios[name]())
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=200, help="messages/second")
+    parser.add_argument("--polls", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=50, help="calls per poll")
+    parser.add_argument("--audio-size", type=int, default=64 * 1024)
+    parser.add_argument("--feeds", type=int, default=1, help="OpenMHz feeds")
+    parser.add_argument(
+        "--batch-window",
+        type=float,
+        help="override TWITTER_TO_SIGNAL_BATCH_WINDOW",
+    )
+    parser.add_argument(
+        "--tweet-window", type=float, help="override TWEET_COALESCE_WINDOW"
+    )
+    parser.add_argument(
+        "--scenario", action="append", choices=["signal", "twitter", "radio"]
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(_TEMP_DIR, ignore_errors=True)
+    print(
+        f"{'pipeline':<18} {'messages':>8} {'msg/s':>9} {'p50 ms':>9}"
+        f" {'p99 ms':>9} {'CPU ms/msg':>11}"
+    )
+    for result in results:
+        print(result.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Measure how long the bot's entry points take to import, each in a fresh
+interpreter, along with the import time of the settings module on its own.
+
+Usage: PYTHONPATH=. python benchmarks/startup.py
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+RUNS = 10
+# Only what the entry points need to import; notably no Twitter credentials
+ENVIRONMENT = {
+    **os.environ,
+    "BOT_NUMBER": "+15555550100",
+    "ADMIN_CONTACT": "+15555550101",
+}
+MODULES = [
+    ("signal_scanner_bot.env", "settings"),
+    ("signal_scanner_bot.bin.verify", "signal-scanner-bot-verify"),
+    ("signal_scanner_bot.bin.run", "signal-scanner-bot"),
+]
+
+
+def _time_import(module: str, environment: dict) -> float:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", f"import {module}"],
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return elapsed
+
+
+def main() -> None:
+    baseline = statistics.median(_time_import("sys", ENVIRONMENT) for _ in range(RUNS))
+    print(f"{'bare interpreter':>28}: {baseline * 1000:7.1f} ms")
+    for module, name in MODULES:
+        for label, environment in [
+            ("", ENVIRONMENT),
+            (
+                " (with Twitter keys)",
+                {
+                    **ENVIRONMENT,
+                    **dict.fromkeys(
+                        [
+                            "TWITTER_API_KEY",
+                            "TWITTER_API_SECRET",
+                            "TWITTER_ACCESS_TOKEN",
+                            "TWITTER_TOKEN_SECRET",
+                        ],
+                        "test",
+                    ),
+                },
+            ),
+        ]:
+            try:
+                elapsed = statistics.median(
+                    _time_import(module, environment) for _ in range(RUNS)
+                )
+            except RuntimeError as err:
+                print(f"{name + label:>48}: failed ({err})")
+                continue
+            print(f"{name + label:>48}: {(elapsed - baseline) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
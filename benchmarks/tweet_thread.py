@@ -0,0 +1,75 @@
+"""
+Micro-benchmark for splitting long messages into tweet threads, comparing
+the current splitter with the original one it replaced.
+
+Usage: PYTHONPATH=. python benchmarks/tweet_thread.py
+"""
+import timeit
+from typing import List
+
+from signal_scanner_bot import twitter
+
+
+HASHTAGS = "#ScannerBot #Seattle"
+
+
+def legacy_create_tweet_thread(message: str, hashtags: str) -> List[str]:
+    """Split with the original quadratic splitter, kept to benchmark against."""
+    # Split tweet into word list, create empty list to store serialized tweets
+    # index to track last position
+    tweet_word_list = message.split(" ")
+    tweet_list: List[str] = []
+    base_index = 0
+
+    # For loop through word list and enumerate the index because we'll need
+    # it but don't actually care about the list value so send to null
+    for index in range(len(tweet_word_list)):
+
+        # Check if it is the first tweet, which will contain hashtags and
+        # timestamp. If not first it will only contain the text plus ellipses
+        # and for the final one drop the ellipses
+        if len(tweet_list) == 0:
+            sub_tweet = " ".join(tweet_word_list[base_index:index]) + " ..." + hashtags
+        elif index < len(tweet_word_list):
+            sub_tweet = " ".join(tweet_word_list[base_index:index]) + " ..."
+        elif index == len(tweet_word_list):
+            sub_tweet = " ".join(tweet_word_list[base_index:index])
+
+        # When length of tweet reaches >280 chars save to list and set
+        # base index for next tweet
+        # noinspection PyUnboundLocalVariable
+        if len(sub_tweet) > twitter.TWEET_MAX_SIZE - twitter.TWEET_PADDING:
+            last_index = index - 1
+            tweet_list.append(" ".join(tweet_word_list[base_index:last_index]) + " ...")
+            base_index = index - 1
+
+    # Save the last tweet
+    tweet_list.append(" ".join(tweet_word_list[base_index:]))
+
+    # Append the tweet number / tweet thread length to end of tweet. Again
+    # don't actually care about the list value so sending to null.
+    for index in range(len(tweet_list)):
+        tweet_list[index] += f" {index + 1}/{len(tweet_list)}"
+
+    return tweet_list
+
+
+def main():
+    print(f"{'words':>8} {'legacy (ms)':>12} {'current (ms)':>13} {'speedup':>8}")
+    for words in [50, 200, 1000, 5000]:
+        message = " ".join(f"word{i}" for i in range(words))
+        runs = max(1, 2000 // words)
+        legacy = timeit.timeit(
+            lambda: legacy_create_tweet_thread(message, HASHTAGS), number=runs
+        )
+        current = timeit.timeit(
+            lambda: twitter._create_tweet_thread(message, HASHTAGS), number=runs
+        )
+        print(
+            f"{words:>8} {legacy / runs * 1000:>12.3f} {current / runs * 1000:>13.3f}"
+            f" {legacy / current:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
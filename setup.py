@@ -22,6 +22,7 @@ setup_requirements = [
 ]
 
 test_requirements = [
+    "hypothesis>=6",
     "pytest>=3",
 ]
 
@@ -45,6 +46,7 @@ setup(
         "console_scripts": [
             "signal-scanner-bot=signal_scanner_bot.bin.run:cli",
             "signal-scanner-bot-verify=signal_scanner_bot.bin.verify:main",
+            "signal-scanner-bot-replay=signal_scanner_bot.bin.replay:cli",
         ],
     },
     install_requires=requirements,
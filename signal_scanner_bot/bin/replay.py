@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import click
+
+from signal_scanner_bot import env, recorder, signal, transport, twitter
+from signal_scanner_bot.dispatcher import SignalDispatcher
+
+
+log = logging.getLogger("replay")
+
+logging.basicConfig(
+    format="[%(asctime)s - %(name)s - %(lineno)3d][%(levelname)s] %(message)s",
+    level=logging.INFO,
+)
+
+
+################################################################################
+# Dry run stand-ins
+################################################################################
+class _DryRunTwitter:
+    """Logs the tweets that would have been sent."""
+
+    def __init__(self):
+        self._id = 0
+        self.api = SimpleNamespace(
+            statuses=SimpleNamespace(update=SimpleNamespace(post=self._post))
+        )
+
+    async def _post(self, status: str, **params) -> SimpleNamespace:
+        self._id += 1
+        log.info(f"Would tweet: {status!r}")
+        return SimpleNamespace(id=self._id)
+
+
+async def _dry_run_send(message: str, recipient: str, attachment=None) -> None:
+    log.info(f"Would send to {recipient}: {message!r}")
+
+
+################################################################################
+# Replay
+################################################################################
+async def replay(path: Path, speed: float) -> None:
+    counts = {"signal": 0, "twitter": 0, "errors": 0}
+    started = time.monotonic()
+    first = None
+    for record in recorder.read_recording(path):
+        if first is None:
+            first = record.time
+        if speed:
+            delay = started + (record.time - first) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        try:
+            if record.source == "signal":
+                await transport.process_signal_blob(
+                    recorder.retime_signal_blob(record.data, time.time() - record.time)
+                )
+            elif record.source == "twitter":
+                await transport.process_twitter_data(record.data)
+            else:
+                log.warning(f"Skipping record from unknown source {record.source}")
+                continue
+            counts[record.source] += 1
+        except Exception as err:
+            counts["errors"] += 1
+            log.exception(f"Error replaying {record}: {err!r}")
+    # Bursts still being coalesced aren't queued yet, so send them on now
+    twitter.COALESCER.flush_all()
+    await twitter.SCHEDULER.drain()
+    await signal.DISPATCHER.drain()
+
+    elapsed = time.monotonic() - started
+    total = counts["signal"] + counts["twitter"]
+    log.info(
+        f"Replayed {total} records ({counts['signal']} Signal, {counts['twitter']}"
+        f" Twitter, {counts['errors']} errors) in {elapsed:.2f}s,"
+        f" {total / elapsed if elapsed else 0:.1f} records/s"
+    )
+
+
+@click.command()
+@click.argument("recording", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--speed",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Playback speed relative to the recording, 0 for as fast as possible.",
+)
+@click.option(
+    "--live",
+    is_flag=True,
+    help="Actually send the tweets and Signal messages instead of logging them.",
+)
+@click.option(
+    "--listening/--not-listening",
+    default=True,
+    help="Whether Twitter-to-Signal starts out listening.",
+)
+@click.option("-d", "--debug", is_flag=True)
+def cli(recording: str, speed: float, live: bool, listening: bool, debug: bool):
+    """Replay a recording made with RECORD_FILE through the bot."""
+    if debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    else:
+        # Don't drown out the dry run output with every message's details
+        logging.getLogger("signal_scanner_bot").setLevel(logging.WARNING)
+
+    # Keep the replay from touching the bot's real autoscan state or adding
+    # to a recording
+    state_file = Path(tempfile.mkdtemp()) / "autoscan-state"
+    if listening:
+        state_file.touch()
+    os.environ["AUTOSCAN_STATE_FILE_PATH"] = str(state_file)
+    recorder.RECORDER = recorder.Recorder()
+
+    if not live:
+        env.CLIENT = _DryRunTwitter()
+        signal.DISPATCHER = SignalDispatcher(
+            _dry_run_send,
+            coalesce_window=env.TWITTER_TO_SIGNAL_BATCH_WINDOW,
+            coalesce_max=env.TWITTER_TO_SIGNAL_BATCH_SIZE,
+        )
+    asyncio.run(replay(Path(recording), speed))
+
+
+if __name__ == "__main__":
+    cli()
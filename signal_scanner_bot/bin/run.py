@@ -4,10 +4,10 @@ import logging
 
 import click
 
-from signal_scanner_bot import env
+from signal_scanner_bot import env, radio_monitor_alert, recorder, signal, signal_daemon
 from signal_scanner_bot.transport import (
     comradely_reminder,
-    queue_to_signal,
+    metrics_endpoint,
     radio_monitor_alert_transport,
     signal_to_twitter,
     twitter_to_queue,
@@ -25,6 +25,9 @@ logging.basicConfig(
 @click.command()
 @click.option("-d", "--debug", is_flag=True)
 def cli(debug: bool = False) -> None:
+    # Settings are otherwise read on first use, make sure a bad one stops us
+    # here rather than hours later
+    env.load_all()
     if debug or env.DEBUG:
         logging.getLogger().setLevel(logging.DEBUG)
         env.log_vars()
@@ -39,16 +42,25 @@ def cli(debug: bool = False) -> None:
     log.info("Listening...")
 
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(
-        asyncio.gather(
-            signal_to_twitter(),
-            queue_to_signal(),
-            twitter_to_queue(),
-            comradely_reminder(),
-            radio_monitor_alert_transport(),
-            return_exceptions=True,
+    try:
+        loop.run_until_complete(
+            asyncio.gather(
+                signal_daemon.DAEMON.run(),
+                signal.DISPATCHER.start(),
+                signal_to_twitter(),
+                twitter_to_queue(),
+                comradely_reminder(),
+                radio_monitor_alert_transport(),
+                metrics_endpoint(),
+                return_exceptions=True,
+            )
         )
-    )
+    finally:
+        recorder.RECORDER.close()
+        radio_monitor_alert.OFFICER_CACHE.close()
+        radio_monitor_alert.close_cursors()
+        if signal.DISPATCHER.outbox is not None:
+            signal.DISPATCHER.outbox.close()
 
 
 if __name__ == "__main__":
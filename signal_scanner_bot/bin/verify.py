@@ -1,9 +1,8 @@
 #!/usr/bin/env python
+import asyncio
 import logging
-import re
-from typing import List, Tuple
 
-from signal_scanner_bot import signal
+from signal_scanner_bot import signal, signal_daemon
 
 
 # Logging
@@ -14,34 +13,35 @@ logging.basicConfig(
 )
 
 # Constants
-UNTRUSTED_REGEX = re.compile(
-    r"^(?P<phone_number>\+[1-9]\d{10}): UNTRUSTED .* Safety Number: (?P<safety_number>[0-9 ]*)"
-)
-
-
-def _find_unverified_numbers() -> List[Tuple[str, str]]:
-    all_identities = signal.list_identities()
-    unverified_numbers = []
-    for identity in all_identities:
-        if match := re.search(UNTRUSTED_REGEX, identity):
-            unverified_numbers.append(
-                (match.group("phone_number"), match.group("safety_number"))
-            )
-    return unverified_numbers
-
-
-def trust_everyone() -> None:
-    to_verify = _find_unverified_numbers()
-    if not to_verify:
+DAEMON_START_TIMEOUT = 60
+
+
+async def trust_everyone() -> None:
+    # Trust everyone over a single signal-cli session instead of starting
+    # signal-cli for every number, falling back to that if the daemon's off
+    daemon = signal_daemon.DAEMON
+    runner = asyncio.create_task(daemon.run())
+    await daemon.wait_ready(DAEMON_START_TIMEOUT)
+    try:
+        results = await signal.trust_untrusted()
+    finally:
+        await daemon.stop()
+        await runner
+
+    if not results:
         log.info("No numbers to verify!")
-    for phone_number, safety_number in to_verify:
-        logging.debug("trusting " + phone_number)
-        signal.trust_identity(phone_number, safety_number)
+    for phone_number, trusted in sorted(results.items()):
+        if trusted:
+            log.info(f"Trusted {phone_number}")
+        else:
+            log.error(f"Unable to trust {phone_number}")
+    if results:
+        log.info(f"Trusted {sum(results.values())} of {len(results)} number(s)")
 
 
 def main():
     log.info("Running verification utility")
-    trust_everyone()
+    asyncio.run(trust_everyone())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import ujson
+
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    A least-recently-used cache whose entries also expire after a set time.
+
+    Entries are stamped with wall clock time rather than a monotonic clock so
+    the cache can be saved to disk and picked back up after a restart. Saves
+    asked for with `schedule_save` are batched up and written at most every
+    `save_interval` seconds, off the event loop.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        path: Optional[Path] = None,
+        save_interval: float = 60,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._dirty = False
+        self._saver: Optional[asyncio.Task] = None
+        if self.path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._expired(entry[0])
+
+    def _expired(self, stored: float) -> bool:
+        return time.time() - stored > self.ttl
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict, List]:
+        """
+        Look up a number of keys at once, returning a dict of the fresh
+        entries found and a list of the keys that are missing or stale.
+        """
+        found, missing = {}, []
+        for key in keys:
+            entry = self._data.get(key)
+            if entry is None or self._expired(entry[0]):
+                self.misses += 1
+                missing.append(key)
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+                found[key] = entry[1]
+        return found, missing
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.time(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def update(self, values: Dict) -> None:
+        for key, value in values.items():
+            self.set(key, value)
+
+    def load(self) -> None:
+        """Load any unexpired entries saved by a previous run."""
+        if not (self.path and self.path.is_file()):
+            return
+        try:
+            entries = ujson.loads(self.path.read_text())
+            # Anything but a list of [key, stored, value] fails in here
+            loaded = {
+                key: (stored, value)
+                for key, stored, value in entries
+                if not self._expired(stored)
+            }
+        except (TypeError, ValueError) as err:
+            log.warning(f"Ignoring unreadable cache file {self.path}: {err}")
+            return
+        self._data.update(loaded)
+        log.info(f"Loaded {len(self._data)} cached entries from {self.path}")
+
+    def schedule_save(self) -> None:
+        """Have the cache written to disk with the next batch of changes."""
+        if not self.path:
+            return
+        self._dirty = True
+        if self._saver is None or self._saver.done():
+            self._saver = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def _save_later(self) -> None:
+        # Give the rest of this burst of lookups a chance to join the save
+        await asyncio.sleep(self.save_interval)
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, self._entries())
+        except OSError as err:
+            log.error(f"Unable to save cache to {self.path}: {err}")
+
+    def save(self) -> None:
+        """Write the cache to disk now, replacing the previous file in one go."""
+        if not self.path:
+            return
+        self._dirty = False
+        self._write(self._entries())
+
+    def close(self) -> None:
+        """Write out any changes still waiting to be saved."""
+        if self._saver is not None:
+            self._saver.cancel()
+            self._saver = None
+        if self._dirty:
+            self.save()
+
+    def _entries(self) -> List[List]:
+        return [[key, stored, value] for key, (stored, value) in self._data.items()]
+
+    def _write(self, entries: List[List]) -> None:
+        assert self.path is not None
+        temp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        temp_path.write_text(ujson.dumps(entries))
+        os.replace(temp_path, self.path)
@@ -0,0 +1,390 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from .outbox import Outbox
+
+
+log = logging.getLogger(__name__)
+
+
+################################################################################
+# Enums & Exceptions
+################################################################################
+class Priority(enum.IntEnum):
+    """Lower values are sent first."""
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class OverflowPolicy(str, enum.Enum):
+    """What to do when a message is sent while the dispatcher is full."""
+
+    # Drop the oldest of the lowest priority messages waiting to be sent
+    DROP_OLDEST = "drop_oldest"
+    # Refuse the new message
+    DROP_NEWEST = "drop_newest"
+    # Make the sender wait until there's room
+    BLOCK = "block"
+
+
+class DispatcherOverflow(Exception):
+    """Raised for messages dropped because the dispatcher was full."""
+
+
+################################################################################
+# Classes
+################################################################################
+class OutboundMessage(NamedTuple):
+    message: str
+    recipient: str
+    attachment: Optional[str]
+    coalesce: bool
+    enqueued: float
+    future: Optional[asyncio.Future]
+    outbox_id: Optional[int] = None
+
+
+_Entry = Tuple[int, int, OutboundMessage]
+
+
+class _PrioritySlots:
+    """A semaphore that hands free slots to the highest priority waiter first."""
+
+    def __init__(self, size: int):
+        self._free = size
+        self._seq = itertools.count()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+
+    async def acquire(self, priority: int) -> None:
+        if self._free and not self._waiters:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # We were handed the slot just as we were cancelled, pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+
+class SignalDispatcher:
+    """
+    Owns all outbound Signal traffic.
+
+    Each recipient has its own queue and only one send in flight at a time,
+    so messages to a recipient are delivered in the order they were sent
+    (higher priority messages excepted, which jump ahead). Sends to different
+    recipients run concurrently up to `concurrency` at once.
+
+    Messages marked `coalesce` that arrive within `coalesce_window` seconds of
+    each other for the same recipient are joined into a single message, up to
+    `coalesce_max` at a time.
+
+    A send that fails is tried again up to `retries` times, waiting
+    `retry_delay` seconds and doubling that each time. The recipient's later
+    messages wait behind it so they stay in order.
+
+    With an `outbox`, every queued message is recorded there until it's been
+    sent (or dropped), and `start` queues up whatever the last run didn't get
+    to send, including messages that failed every retry.
+    """
+
+    def __init__(
+        self,
+        send: Callable[..., Awaitable[None]],
+        max_pending: int = 1000,
+        concurrency: int = 2,
+        overflow: str = OverflowPolicy.DROP_OLDEST,
+        coalesce_window: float = 0,
+        coalesce_max: int = 1,
+        outbox: Optional[Outbox] = None,
+        retries: int = 0,
+        retry_delay: float = 5,
+    ):
+        self._send = send
+        self.outbox = outbox
+        self.max_pending = max_pending
+        self.overflow = OverflowPolicy(overflow)
+        self.coalesce_window = coalesce_window
+        self.coalesce_max = coalesce_max
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self._queues: Dict[str, List[_Entry]] = defaultdict(list)
+        self._arrivals: Dict[str, asyncio.Event] = defaultdict(asyncio.Event)
+        self._busy: Set[str] = set()
+        self._pending = 0
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+        self._space = asyncio.Event()
+        self._slots = _PrioritySlots(concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._worker: Optional[asyncio.Task] = None
+
+    def qsize(self, recipient: Optional[str] = None) -> int:
+        """Return how many messages are waiting, overall or for one recipient."""
+        if recipient is None:
+            return self._pending
+        return len(self._queues.get(recipient, []))
+
+    async def send(
+        self,
+        message: str,
+        recipient: str,
+        attachment=None,
+        priority: Priority = Priority.NORMAL,
+        coalesce: bool = False,
+        wait: bool = True,
+    ) -> None:
+        """
+        Queue a message for sending. With `wait` this returns once the message
+        has actually been sent, and raises if sending it failed every retry.
+        """
+        self._ensure_worker()
+        if not await self._make_room(priority):
+            self.dropped += 1
+            log.warning(f"Dispatcher full, dropping new message to {recipient}")
+            if wait:
+                raise DispatcherOverflow("Signal dispatcher is full")
+            return
+
+        future = asyncio.get_running_loop().create_future() if wait else None
+        outbox_id = None
+        if self.outbox is not None:
+            outbox_id = self.outbox.add(
+                "signal",
+                {
+                    "message": message,
+                    "recipient": recipient,
+                    "attachment": str(attachment) if attachment else None,
+                    "priority": int(priority),
+                    "coalesce": coalesce,
+                },
+            )
+        self._push(
+            priority,
+            OutboundMessage(
+                message,
+                recipient,
+                attachment,
+                coalesce,
+                time.monotonic(),
+                future,
+                outbox_id,
+            ),
+        )
+        if future is not None:
+            await future
+
+    async def start(self) -> None:
+        """Queue up the messages left in the outbox by the last run."""
+        self._ensure_worker()
+        if self.outbox is None:
+            return
+        await self.outbox.open()
+        recovered = self.outbox.recover("signal")
+        for outbox_id, saved in recovered:
+            attachment = saved["attachment"]
+            if attachment and not os.path.exists(attachment):
+                log.warning(f"Attachment {attachment} is gone, sending without it")
+                attachment = None
+            self._push(
+                Priority(saved["priority"]),
+                OutboundMessage(
+                    saved["message"],
+                    saved["recipient"],
+                    attachment,
+                    saved["coalesce"],
+                    time.monotonic(),
+                    None,
+                    outbox_id,
+                ),
+            )
+        if recovered:
+            log.info(f"Resending {len(recovered)} message(s) left unsent")
+
+    async def drain(self) -> None:
+        """Wait until every queued message has been sent (or has failed)."""
+        while self._pending or self._busy:
+            await asyncio.sleep(0.01)
+
+    async def run(self) -> None:
+        """Hand queued messages off to be sent as their recipients free up."""
+        while True:
+            recipient = self._next_recipient()
+            if recipient is None:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+            self._busy.add(recipient)
+            task = asyncio.create_task(self._deliver(recipient))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _push(self, priority: int, entry: OutboundMessage) -> None:
+        heapq.heappush(
+            self._queues[entry.recipient], (priority, next(self._seq), entry)
+        )
+        self._pending += 1
+        self._arrivals[entry.recipient].set()
+        self._changed.set()
+
+    def _ack(self, entries: List[OutboundMessage]) -> None:
+        if self.outbox is None:
+            return
+        for entry in entries:
+            if entry.outbox_id is not None:
+                self.outbox.ack(entry.outbox_id)
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and not self._worker.done():
+            return
+        if self._worker is not None and not self._worker.cancelled():
+            log.error(f"Signal dispatcher stopped: {self._worker.exception()!r}")
+        self._worker = asyncio.create_task(self.run())
+
+    def _next_recipient(self) -> Optional[str]:
+        # The idle recipient whose next message is the most urgent (and then
+        # the oldest) goes first
+        best: Optional[Tuple[int, int]] = None
+        best_recipient = None
+        for recipient, queue in self._queues.items():
+            if queue and recipient not in self._busy:
+                head = queue[0][:2]
+                if best is None or head < best:
+                    best, best_recipient = head, recipient
+        return best_recipient
+
+    async def _make_room(self, priority: int) -> bool:
+        """Apply the overflow policy, returning whether the new message fits."""
+        while self._pending >= self.max_pending:
+            if self.overflow is OverflowPolicy.BLOCK:
+                self._space.clear()
+                await self._space.wait()
+            elif self.overflow is OverflowPolicy.DROP_NEWEST:
+                return False
+            elif not self._drop_oldest(priority):
+                return False
+        return True
+
+    def _drop_oldest(self, priority: int) -> bool:
+        # Find the oldest of the least urgent messages, as long as it's no more
+        # urgent than the one we're trying to make room for
+        victim: Optional[_Entry] = None
+        for queue in self._queues.values():
+            for entry in queue:
+                if victim is None or (-entry[0], entry[1]) < (-victim[0], victim[1]):
+                    victim = entry
+        if victim is None or victim[0] < priority:
+            return False
+
+        queue = self._queues[victim[2].recipient]
+        queue.remove(victim)
+        heapq.heapify(queue)
+        self._pending -= 1
+        self.dropped += 1
+        self._ack([victim[2]])
+        log.warning(
+            f"Dispatcher full, dropping oldest message to {victim[2].recipient}"
+        )
+        if victim[2].future is not None and not victim[2].future.done():
+            victim[2].future.set_exception(
+                DispatcherOverflow("Dropped to make room for newer messages")
+            )
+        return True
+
+    def _coalescible(self, queue: List[_Entry]) -> int:
+        return sum(1 for entry in queue if entry[2].coalesce)
+
+    async def _wait_for_batch(self, recipient: str, first: OutboundMessage) -> None:
+        queue = self._queues[recipient]
+        deadline = first.enqueued + self.coalesce_window
+        while self._coalescible(queue) < self.coalesce_max:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            arrivals = self._arrivals[recipient]
+            arrivals.clear()
+            try:
+                await asyncio.wait_for(arrivals.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    async def _deliver(self, recipient: str) -> None:
+        queue = self._queues[recipient]
+        try:
+            if queue and queue[0][2].coalesce and self.coalesce_max > 1:
+                await self._wait_for_batch(recipient, queue[0][2])
+            # Messages may have been dropped while we were waiting
+            if not queue:
+                return
+            priority, _, first = heapq.heappop(queue)
+            batch = [first]
+            while (
+                first.coalesce
+                and queue
+                and queue[0][2].coalesce
+                and len(batch) < self.coalesce_max
+            ):
+                batch.append(heapq.heappop(queue)[2])
+            self._pending -= len(batch)
+            self._space.set()
+
+            message = "\n\n".join(entry.message for entry in batch)
+            for attempt in itertools.count():
+                await self._slots.acquire(priority)
+                try:
+                    await self._send(message, recipient, first.attachment)
+                except Exception as err:
+                    error = err
+                else:
+                    break
+                finally:
+                    self._slots.release()
+                if attempt >= self.retries:
+                    self.failed += len(batch)
+                    # Left in the outbox, if there is one, for the next run
+                    log.error(f"Failed to send message to {recipient}: {error!r}")
+                    for entry in batch:
+                        if entry.future is not None and not entry.future.done():
+                            entry.future.set_exception(error)
+                    return
+                delay = self.retry_delay * 2**attempt
+                self.retried += len(batch)
+                log.warning(
+                    f"Failed to send message to {recipient}: {error!r},"
+                    f" trying again in {delay}s"
+                )
+                await asyncio.sleep(delay)
+
+            self.sent += len(batch)
+            self._ack(batch)
+            for entry in batch:
+                if entry.future is not None and not entry.future.done():
+                    entry.future.set_result(None)
+        finally:
+            self._busy.discard(recipient)
+            self._changed.set()
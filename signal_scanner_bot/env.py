@@ -1,15 +1,17 @@
 import logging
 import os
-from asyncio import Queue
 from datetime import time, tzinfo
 from pathlib import Path
-from typing import Any, Callable, List, Optional, Set
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set
 
-import peony
 import pytz
 from dotenv import load_dotenv
 
 
+if TYPE_CHECKING:
+    import peony
+
+
 log = logging.getLogger(__name__)
 
 
@@ -22,6 +24,9 @@ if Path("./.env").is_file():
 # Constants
 ################################################################################
 _VARS = []
+# Setting/resource name -> function that loads it, see _load
+_SETTINGS: Dict[str, Callable[[], Any]] = {}
+_RESOURCES: Dict[str, Callable[[], Any]] = {}
 START_LISTENING = "AUTOSCANON"
 STOP_LISTENING = "AUTOSCANOFF"
 START_LISTENING_NOTIFICATION = "==Auto Scanning Activated=="
@@ -51,8 +56,63 @@ def _env(
     return value
 
 
+def _setting(
+    name: str,
+    key: Optional[str] = None,
+    convert: Callable[[str], Any] = str,
+    fail: bool = True,
+    default: Any = None,
+) -> None:
+    """Register an environment variable to be read the first time it's used."""
+    _SETTINGS[name] = lambda: _env(key or name, convert, fail, default)
+
+
+def _load(name: str) -> Any:
+    # Once loaded a value is stored as a regular module global, so the module
+    # __getattr__ below is only ever hit on first use
+    if name not in globals():
+        loader = _SETTINGS.get(name) or _RESOURCES[name]
+        globals()[name] = loader()
+    return globals()[name]
+
+
+def __getattr__(name: str) -> Any:
+    """Read settings and create shared resources on first access."""
+    if name in _SETTINGS or name in _RESOURCES:
+        return _load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def lazy_resources(
+    module_globals: Dict[str, Any], **loaders: Callable[[], Any]
+) -> Callable[[str], Any]:
+    """
+    Have a module create its shared objects on first use, like the resources
+    here, so importing it doesn't read any settings. Returns a function that
+    loads one by name, for the module's __getattr__ and for the module itself,
+    since its own bare global lookups don't go through __getattr__.
+    """
+
+    def load(name: str) -> Any:
+        if name not in module_globals:
+            if name not in loaders:
+                module = module_globals["__name__"]
+                raise AttributeError(f"module {module!r} has no attribute {name!r}")
+            module_globals[name] = loaders[name]()
+        return module_globals[name]
+
+    return load
+
+
+def load_all() -> None:
+    """Read and validate every setting now rather than on first use."""
+    for name in _SETTINGS:
+        _load(name)
+
+
 def log_vars() -> None:
     """Log all environment variables in any part of the application."""
+    load_all()
     log.debug("Input environment variables")
     for key, value in _VARS:
         log.debug(f"{key}={value}")
@@ -127,10 +187,18 @@ def _cast_to_int(to_cast: str) -> int:
     return int(to_cast)
 
 
+def _cast_to_float(to_cast: str) -> float:
+    return float(to_cast)
+
+
 def _cast_to_path(to_cast: str) -> Path:
     return Path(to_cast)
 
 
+def _cast_to_optional_path(to_cast: str) -> Optional[Path]:
+    return Path(to_cast) if to_cast else None
+
+
 def _cast_to_time(to_cast: str) -> time:
     return time.fromisoformat(to_cast)
 
@@ -139,6 +207,39 @@ def _cast_to_tzinfo(to_cast: str) -> tzinfo:
     return pytz.timezone(to_cast)
 
 
+def _cast_to_header_hashtags(to_cast: str) -> Dict[str, List[str]]:
+    # HEADER ONE=#TagOne,#TagTwo;HEADER TWO=#TagThree
+    header_hashtags = {}
+    for entry in filter(None, to_cast.split(";")):
+        header, _, hashtags = entry.partition("=")
+        header_hashtags[header.strip().upper()] = _cast_to_list(hashtags)
+    return header_hashtags
+
+
+def _cast_to_lookback(to_cast: str) -> int:
+    # Check to make sure the lookback interval is greater than or equal to 45 seconds
+    lookback = _cast_to_int(to_cast)
+    if lookback < 45:
+        log.warning(
+            f"The minimum value for the lookback time is 45 seconds. Time of {lookback}"
+            " second(s) is less than 45 seconds and will be set to 45 seconds automatically."
+        )
+        lookback = 45
+    return lookback
+
+
+def _cast_to_user_ids(to_cast: str) -> Set[str]:
+    # Checking to ensure user ids are in the proper format, raise error if not.
+    tweeters = _cast_to_set(to_cast)
+    for tweeter in tweeters:
+        if tweeter[0] == "@":
+            raise ValueError(
+                "TRUSTER_TWEETERS must be user IDs and not handles. Please visit http://gettwitterid.com/"
+                " to find the user ID of a user's handle."
+            )
+    return tweeters
+
+
 def _format_hashtags(to_cast: str) -> List[str]:
     hashtags = _cast_to_list(to_cast)
     if any("#" in hashtag for hashtag in hashtags):
@@ -157,38 +258,111 @@ def _format_hashtags(to_cast: str) -> List[str]:
 # Because sometimes I get zero width unicode characters in my copy/pastes that
 # I don't notice I'm doing a bit of an "inelegant" fix to make sure it doesn't
 # matter.
-BOT_NUMBER = _env("BOT_NUMBER", convert=_cast_to_ascii)
-DEFAULT_TZ = _env(
-    "DEFAULT_TZ", convert=_cast_to_tzinfo, fail=False, default="US/Pacific"
+BOT_NUMBER: str
+_setting("BOT_NUMBER", convert=_cast_to_ascii)
+DEFAULT_TZ: tzinfo
+_setting("DEFAULT_TZ", convert=_cast_to_tzinfo, fail=False, default="US/Pacific")
+TESTING: bool
+_setting("TESTING", convert=_cast_to_bool, default=False)
+DEBUG: bool
+_SETTINGS["DEBUG"] = lambda: _load("TESTING") or _env(
+    "DEBUG", convert=_cast_to_bool, default=False
+)
+ADMIN_CONTACT: str
+_setting("ADMIN_CONTACT", convert=_cast_to_string)
+LISTEN_CONTACT: str
+_setting("LISTEN_CONTACT", convert=_cast_to_string, fail=False)
+SIGNAL_TIMEOUT: int
+_setting("SIGNAL_TIMEOUT", convert=_cast_to_int, fail=False, default=10)
+SIGNAL_DAEMON: bool
+_setting("SIGNAL_DAEMON", convert=_cast_to_bool, fail=False, default=True)
+SIGNAL_DAEMON_TIMEOUT: float
+_setting("SIGNAL_DAEMON_TIMEOUT", convert=_cast_to_float, fail=False, default=60)
+SIGNAL_QUEUE_SIZE: int
+_setting("SIGNAL_QUEUE_SIZE", convert=_cast_to_int, fail=False, default=1000)
+SIGNAL_QUEUE_OVERFLOW: str
+_setting(
+    "SIGNAL_QUEUE_OVERFLOW", convert=_cast_to_string, fail=False, default="drop_oldest"
+)
+SIGNAL_SEND_CONCURRENCY: int
+_setting("SIGNAL_SEND_CONCURRENCY", convert=_cast_to_int, fail=False, default=2)
+SIGNAL_SEND_RETRIES: int
+_setting("SIGNAL_SEND_RETRIES", convert=_cast_to_int, fail=False, default=3)
+SIGNAL_SEND_RETRY_DELAY: float
+_setting("SIGNAL_SEND_RETRY_DELAY", convert=_cast_to_float, fail=False, default=5)
+OUTBOX_FILE: Optional[Path]
+_setting("OUTBOX_FILE", convert=_cast_to_optional_path, fail=False, default="")
+OUTBOX_COMMIT_INTERVAL: float
+_setting("OUTBOX_COMMIT_INTERVAL", convert=_cast_to_float, fail=False, default=0.1)
+OUTBOX_MAX_MESSAGES: int
+_setting("OUTBOX_MAX_MESSAGES", convert=_cast_to_int, fail=False, default=10000)
+TWITTER_API_KEY: str
+_setting("TWITTER_API_KEY", convert=_cast_to_string)
+TWITTER_API_SECRET: str
+_setting("TWITTER_API_SECRET", convert=_cast_to_string)
+TWITTER_ACCESS_TOKEN: str
+_setting("TWITTER_ACCESS_TOKEN", convert=_cast_to_string)
+TWITTER_TOKEN_SECRET: str
+_setting("TWITTER_TOKEN_SECRET", convert=_cast_to_string)
+TWEET_THREAD_MAX: int
+_setting("TWEET_THREAD_MAX", convert=_cast_to_int, default=9)
+TWEET_QUEUE_SIZE: int
+_setting("TWEET_QUEUE_SIZE", convert=_cast_to_int, fail=False, default=100)
+TWEET_RETRIES: int
+_setting("TWEET_RETRIES", convert=_cast_to_int, fail=False, default=5)
+TWEET_RATE_LIMIT_WAIT: int
+_setting("TWEET_RATE_LIMIT_WAIT", convert=_cast_to_int, fail=False, default=900)
+TWEET_COALESCE_WINDOW: float
+_setting("TWEET_COALESCE_WINDOW", convert=_cast_to_float, fail=False, default=0)
+TWEET_COALESCE_MAX: int
+_setting("TWEET_COALESCE_MAX", convert=_cast_to_int, fail=False, default=5)
+TWEET_REPLY_WINDOW: float
+_setting("TWEET_REPLY_WINDOW", convert=_cast_to_float, fail=False, default=0)
+TWEET_REPLY_MAX: int
+_setting("TWEET_REPLY_MAX", convert=_cast_to_int, fail=False, default=25)
+TRUSTED_TWEETERS: Set[str]
+_setting("TRUSTED_TWEETERS", convert=_cast_to_user_ids, default={})
+TWITTER_STREAM_STALL_TIMEOUT: int
+_setting("TWITTER_STREAM_STALL_TIMEOUT", convert=_cast_to_int, fail=False, default=900)
+SEND_HASHTAGS: List[str]
+_setting("SEND_HASHTAGS", convert=_cast_to_list, default=[])
+RECEIVE_HASHTAGS: List[str]
+_setting("RECEIVE_HASHTAGS", convert=_format_hashtags, default=[])
+SIGNAL_MESSAGE_HEADERS: Set[str]
+_setting("SIGNAL_MESSAGE_HEADERS", convert=_cast_to_set, default={})
+SIGNAL_HEADER_HASHTAGS: Dict[str, List[str]]
+_setting(
+    "SIGNAL_HEADER_HASHTAGS", convert=_cast_to_header_hashtags, fail=False, default=""
 )
-TESTING = _env("TESTING", convert=_cast_to_bool, default=False)
-DEBUG = TESTING or _env("DEBUG", convert=_cast_to_bool, default=False)
-ADMIN_CONTACT = _env("ADMIN_CONTACT", convert=_cast_to_string)
-LISTEN_CONTACT = _env("LISTEN_CONTACT", convert=_cast_to_string, fail=False)
-SIGNAL_TIMEOUT = _env("SIGNAL_TIMEOUT", convert=_cast_to_int, default=10)
-TWITTER_API_KEY = _env("TWITTER_API_KEY", convert=_cast_to_string)
-TWITTER_API_SECRET = _env("TWITTER_API_SECRET", convert=_cast_to_string)
-TWITTER_ACCESS_TOKEN = _env("TWITTER_ACCESS_TOKEN", convert=_cast_to_string)
-TWITTER_TOKEN_SECRET = _env("TWITTER_TOKEN_SECRET", convert=_cast_to_string)
-TWEET_THREAD_MAX = _env("TWEET_THREAD_MAX", convert=_cast_to_int, default=9)
-TRUSTED_TWEETERS = _env("TRUSTED_TWEETERS", convert=_cast_to_set, default={})
-SEND_HASHTAGS = _env("SEND_HASHTAGS", convert=_cast_to_list, default=[])
-RECEIVE_HASHTAGS = _env("RECEIVE_HASHTAGS", convert=_format_hashtags, default=[])
-SIGNAL_MESSAGE_HEADERS = _env(
-    "SIGNAL_MESSAGE_HEADERS", convert=_cast_to_set, default={}
+TWITTER_TO_SIGNAL_BATCH_WINDOW: float
+_setting(
+    "TWITTER_TO_SIGNAL_BATCH_WINDOW", convert=_cast_to_float, fail=False, default=2
 )
-AUTOSCAN_STATE_FILE_PATH = _env(
+TWITTER_TO_SIGNAL_BATCH_SIZE: int
+_setting("TWITTER_TO_SIGNAL_BATCH_SIZE", convert=_cast_to_int, fail=False, default=5)
+AUTOSCAN_STATE_FILE_PATH: Path
+_setting(
     "AUTOSCAN_STATE_FILE_PATH",
     convert=_cast_to_path,
     default="signal_scanner_bot/.autoscanner-state-file",
 )
 
+RECORD_FILE: Optional[Path]
+_setting("RECORD_FILE", convert=_cast_to_optional_path, fail=False, default="")
+METRICS_HOST: str
+_setting("METRICS_HOST", convert=_cast_to_string, fail=False, default="127.0.0.1")
+METRICS_PORT: int
+_setting("METRICS_PORT", convert=_cast_to_int, fail=False, default=0)
+
 ################################################################################
 # Comradely Reminder Environment Variables
 ################################################################################
-COMRADELY_CONTACT = _env("COMRADELY_CONTACT", convert=_cast_to_string, fail=False)
-COMRADELY_MESSAGE = _env("COMRADELY_MESSAGE", convert=_cast_to_string, fail=False)
-COMRADELY_TIME = _env(
+COMRADELY_CONTACT: str
+_setting("COMRADELY_CONTACT", convert=_cast_to_string, fail=False)
+COMRADELY_MESSAGE: str
+_setting("COMRADELY_MESSAGE", convert=_cast_to_string, fail=False)
+COMRADELY_TIME: time
+_setting(
     "COMRADELY_TIME",
     convert=_cast_to_time,
     fail=False,
@@ -198,51 +372,86 @@ COMRADELY_TIME = _env(
 ################################################################################
 # SWAT Alert Environment Variables
 ################################################################################
-OPENMHZ_URL = _env("OPENMHZ_URL", convert=_cast_to_string, fail=False)
-RADIO_CHASER_URL = _env("RADIO_CHASER_URL", convert=_cast_to_string, fail=False)
-RADIO_MONITOR_UNITS = _env("RADIO_MONITOR_UNITS", convert=_cast_to_set, fail=False)
-RADIO_MONITOR_CONTACT = _env(
-    "RADIO_MONITOR_CONTACT", convert=_cast_to_string, fail=False
+OPENMHZ_URL: str
+_setting("OPENMHZ_URL", convert=_cast_to_string, fail=False)
+RADIO_CHASER_URL: str
+_setting("RADIO_CHASER_URL", convert=_cast_to_string, fail=False)
+RADIO_MONITOR_UNITS: Set[str]
+_setting("RADIO_MONITOR_UNITS", convert=_cast_to_set, fail=False)
+RADIO_MONITOR_CONTACT: str
+_setting("RADIO_MONITOR_CONTACT", convert=_cast_to_string, fail=False)
+RADIO_MONITOR_LOOKBACK: int
+_setting("RADIO_MONITOR_LOOKBACK", convert=_cast_to_lookback, fail=False, default=45)
+RADIO_MONITOR_ACTIVE_INTERVAL: int
+_setting("RADIO_MONITOR_ACTIVE_INTERVAL", convert=_cast_to_int, fail=False, default=20)
+RADIO_MONITOR_QUIET_INTERVAL: int
+_setting("RADIO_MONITOR_QUIET_INTERVAL", convert=_cast_to_int, fail=False, default=120)
+RADIO_MONITOR_FEEDS_FILE: Optional[Path]
+_setting(
+    "RADIO_MONITOR_FEEDS_FILE", convert=_cast_to_optional_path, fail=False, default=""
 )
-RADIO_MONITOR_LOOKBACK = _env(
-    "RADIO_MONITOR_LOOKBACK", convert=_cast_to_int, fail=False, default=45
+RADIO_MONITOR_CURSOR_FILE: Optional[Path]
+_setting(
+    "RADIO_MONITOR_CURSOR_FILE", convert=_cast_to_optional_path, fail=False, default=""
 )
-RADIO_AUDIO_CHUNK_SIZE = _env(
-    "RADIO_AUDIO_CHUNK_SIZE", convert=_cast_to_int, fail=False, default=10
+RADIO_AUDIO_CHUNK_SIZE: int
+_setting("RADIO_AUDIO_CHUNK_SIZE", convert=_cast_to_int, fail=False, default=65536)
+RADIO_AUDIO_MAX_SIZE: int
+_setting("RADIO_AUDIO_MAX_SIZE", convert=_cast_to_int, fail=False, default=10 * 2**20)
+RADIO_AUDIO_TIMEOUT: int
+_setting("RADIO_AUDIO_TIMEOUT", convert=_cast_to_int, fail=False, default=30)
+RADIO_AUDIO_DIR: Optional[Path]
+_setting("RADIO_AUDIO_DIR", convert=_cast_to_optional_path, fail=False, default="")
+RADIO_CHASER_CONCURRENCY: int
+_setting("RADIO_CHASER_CONCURRENCY", convert=_cast_to_int, fail=False, default=5)
+RADIO_CHASER_BATCH_SIZE: int
+_setting("RADIO_CHASER_BATCH_SIZE", convert=_cast_to_int, fail=False, default=100)
+RADIO_CHASER_CACHE_SIZE: int
+_setting("RADIO_CHASER_CACHE_SIZE", convert=_cast_to_int, fail=False, default=10000)
+RADIO_CHASER_CACHE_TTL: int
+_setting("RADIO_CHASER_CACHE_TTL", convert=_cast_to_int, fail=False, default=21600)
+RADIO_CHASER_CACHE_FILE: Optional[Path]
+_setting(
+    "RADIO_CHASER_CACHE_FILE", convert=_cast_to_optional_path, fail=False, default=""
 )
-RADIO_CHASER_BACKOFF = _env(
-    "RRADIO_CHASER_BACKOFF", convert=_cast_to_int, fail=False, default=10800
+RADIO_CHASER_CACHE_SAVE_INTERVAL: float
+_setting(
+    "RADIO_CHASER_CACHE_SAVE_INTERVAL", convert=_cast_to_float, fail=False, default=60
+)
+RADIO_CHASER_BACKOFF: int
+_setting(
+    "RADIO_CHASER_BACKOFF",
+    key="RRADIO_CHASER_BACKOFF",
+    convert=_cast_to_int,
+    fail=False,
+    default=10800,
 )
-
-# Check to make sure the lookback interval is greater than or equal to 45 seconds
-if RADIO_MONITOR_LOOKBACK < 45:
-    log.warning(
-        f"The minimum value for the lookback time is 45 seconds. Time of {RADIO_MONITOR_LOOKBACK}"
-        " second(s) is less than 45 seconds and will be set to 45 seconds automatically."
-    )
-    RADIO_MONITOR_LOOKBACK = 45
-
-# Checking to ensure user ids are in the proper format, raise error if not.
-for tweeter in TRUSTED_TWEETERS:
-    if tweeter[0] == "@":
-        raise ValueError(
-            "TRUSTER_TWEETERS must be user IDs and not handles. Please visit http://gettwitterid.com/"
-            " to find the user ID of a user's handle."
-        )
 
 ################################################################################
 # Environment State Variables
 ################################################################################
-STATE = _State(AUTOSCAN_STATE_FILE_PATH)
-TWITTER_TO_SIGNAL_QUEUE: Queue = Queue(maxsize=10000)  # shooting from the hip here...
+STATE: _State
+_RESOURCES["STATE"] = lambda: _State(_load("AUTOSCAN_STATE_FILE_PATH"))
 
 ################################################################################
 # Peony Twitter Event Stream client
 ################################################################################
-API_KEYS = {
-    "consumer_key": TWITTER_API_KEY,
-    "consumer_secret": TWITTER_API_SECRET,
-    "access_token": TWITTER_ACCESS_TOKEN,
-    "access_token_secret": TWITTER_TOKEN_SECRET,
+API_KEYS: Dict[str, str]
+_RESOURCES["API_KEYS"] = lambda: {
+    "consumer_key": _load("TWITTER_API_KEY"),
+    "consumer_secret": _load("TWITTER_API_SECRET"),
+    "access_token": _load("TWITTER_ACCESS_TOKEN"),
+    "access_token_secret": _load("TWITTER_TOKEN_SECRET"),
 }
-CLIENT = peony.PeonyClient(**API_KEYS)
+
+
+def _create_client() -> "peony.PeonyClient":
+    # Peony (and aiohttp with it) is slow to import, so only pay for it when
+    # something actually talks to Twitter
+    import peony
+
+    return peony.PeonyClient(**_load("API_KEYS"))
+
+
+CLIENT: "peony.PeonyClient"
+_RESOURCES["CLIENT"] = _create_client
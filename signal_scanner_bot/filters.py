@@ -1,8 +1,109 @@
-from datetime import datetime, timedelta
-from typing import Callable, Dict, List
+import logging
+import time
+from typing import Callable, Dict, Generic, List, TypeVar
 
-from . import env
-from .signal import message_timestamp
+from . import env, metrics
+
+
+log = logging.getLogger(__name__)
+
+
+################################################################################
+# Constants
+################################################################################
+D = TypeVar("D")
+NOT_RECENT_MILLISECONDS = 5 * 60 * 1000
+# How many messages to run through a pipeline between reorderings of its filters
+REORDER_INTERVAL = 100
+
+
+################################################################################
+# Filter Pipeline
+################################################################################
+class FilterStats:
+    """Counters for a single filter within a pipeline."""
+
+    __slots__ = ("evaluations", "rejections", "seconds")
+
+    def __init__(self):
+        self.evaluations = 0
+        self.rejections = 0
+        self.seconds = 0.0
+
+    @property
+    def rejection_rate(self) -> float:
+        return self.rejections / self.evaluations if self.evaluations else 0.0
+
+
+class FilterPipeline(Generic[D]):
+    """
+    A list of filters compiled into a single predicate.
+
+    Calling the pipeline returns True if the data passes every filter (they
+    all come back False). Since any one filter rejecting is enough, the order
+    they run in doesn't change the result, so every REORDER_INTERVAL messages
+    the filters are reordered to put the ones that reject the most messages
+    for the least time first. That only holds if every filter copes with any
+    data on its own, without relying on an earlier filter having rejected
+    data it can't handle.
+    """
+
+    def __init__(self, name: str, filters: List[Callable[[D], bool]]):
+        self.name = name
+        self.filters = list(filters)
+        self.stats: Dict[str, FilterStats] = {
+            filter_.__name__: FilterStats() for filter_ in self.filters
+        }
+        self._calls = 0
+        for filter_name, stats in self.stats.items():
+            labels = {"pipeline": name, "filter": filter_name}
+            metrics.FILTER_EVALUATIONS.labels(
+                **labels
+            ).function = lambda stats=stats: stats.evaluations
+            metrics.FILTER_REJECTIONS.labels(
+                **labels
+            ).function = lambda stats=stats: stats.rejections
+            metrics.FILTER_SECONDS.labels(
+                **labels
+            ).function = lambda stats=stats: stats.seconds
+
+    def __call__(self, data: D) -> bool:
+        self._calls += 1
+        if self._calls % REORDER_INTERVAL == 0:
+            self._reorder()
+
+        debug = log.isEnabledFor(logging.DEBUG)
+        for filter_ in self.filters:
+            stats = self.stats[filter_.__name__]
+            start = time.perf_counter()
+            rejected = filter_(data)
+            stats.seconds += time.perf_counter() - start
+            stats.evaluations += 1
+            if debug:
+                log.debug("%s=%s", filter_.__name__, rejected)
+            if rejected:
+                stats.rejections += 1
+                return False
+        return True
+
+    def _reorder(self) -> None:
+        def score(filter_: Callable[[D], bool]) -> float:
+            stats = self.stats[filter_.__name__]
+            if not stats.evaluations:
+                return 0.0
+            # Rejections per second spent running the filter
+            return stats.rejections / max(stats.seconds, 1e-9)
+
+        # sorted is stable, so filters with the same score keep their order
+        self.filters = sorted(self.filters, key=score, reverse=True)
+
+    def summary(self) -> str:
+        return f"{self.name} filters: " + ", ".join(
+            f"{name} (evaluated={stats.evaluations} rejected={stats.rejections}"
+            f" rate={stats.rejection_rate:.0%}"
+            f" time={stats.seconds * 1000:.1f}ms)"
+            for name, stats in self.stats.items()
+        )
 
 
 ################################################################################
@@ -27,18 +128,23 @@ def _f_wrong_group(data: Dict) -> bool:
 
 
 def _f_not_recent(data: Dict) -> bool:
-    # Message is not within the last 5 minutes
-    timestamp = message_timestamp(data)
-    delta = datetime.now() - timestamp
-    return delta > timedelta(minutes=5)
+    # Message is not within the last 5 minutes. Signal timestamps are
+    # milliseconds since the epoch, so compare them as-is. Anything without a
+    # timestamp can't be recent.
+    if (timestamp_milliseconds := data.get("timestamp")) is None:
+        return True
+    return time.time() * 1000 - timestamp_milliseconds > NOT_RECENT_MILLISECONDS
 
 
-SIGNAL_FILTERS: List[Callable[[Dict], bool]] = [
-    _f_no_data,
-    _f_no_group,
-    _f_wrong_group,
-    _f_not_recent,
-]
+SIGNAL_FILTERS: FilterPipeline[Dict] = FilterPipeline(
+    "signal",
+    [
+        _f_no_data,
+        _f_no_group,
+        _f_wrong_group,
+        _f_not_recent,
+    ],
+)
 
 
 ################################################################################
@@ -47,9 +153,12 @@ SIGNAL_FILTERS: List[Callable[[Dict], bool]] = [
 def _f_retweet_text(status: Dict) -> bool:
     # Status text starts with "RT @"
     # Twitter uses that to identify a retweet
-    return status["text"].startswith("RT @")
+    return status.get("text", "").startswith("RT @")
 
 
-TWITTER_FILTERS: List[Callable[[Dict], bool]] = [
-    _f_retweet_text,
-]
+TWITTER_FILTERS: FilterPipeline[Dict] = FilterPipeline(
+    "twitter",
+    [
+        _f_retweet_text,
+    ],
+)
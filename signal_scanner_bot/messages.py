@@ -1,17 +1,25 @@
+import asyncio
 import logging
+import os
 import pathlib
 import re
+import tempfile
+from datetime import datetime, timezone
 from textwrap import dedent
-from typing import Callable, Dict, List, TypeVar
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
 
 import aiofiles
 import aiohttp
-import peony
 
-from . import env, signal, twitter
+from . import env, metrics, signal, twitter
+from .dispatcher import Priority
 from .filters import SIGNAL_FILTERS, TWITTER_FILTERS
 
 
+if TYPE_CHECKING:
+    import peony
+
+
 log = logging.getLogger(__name__)
 
 
@@ -19,33 +27,50 @@ log = logging.getLogger(__name__)
 # Constants
 ################################################################################
 NON_ALPHA_NUMERIC = re.compile(r"[\W]+")
-D = TypeVar("D")
 
 
 ################################################################################
-# Private Functions
+# Classes
 ################################################################################
-def _pass_filters(data: D, filters: List[Callable[[D], bool]]) -> bool:
+class HeaderMatcher:
     """
-    Given a certain data object, run all of the filters against that object.
-    If the data passes all of the filters (they all come back False),
-    this function returns True.
+    Case-insensitive prefix matcher for scanner message headers.
+
+    The headers are compiled into a single anchored regex, longest first so
+    that a more specific header (e.g. "DISPATCH NORTH") wins over one it
+    starts with (e.g. "DISPATCH").
     """
-    for filter_ in filters:
-        filt_value = filter_(data)
-        log.debug(f"{filter_}={filt_value}")
-        if filt_value:
-            return False
-    return True
-
-
-def _is_scanner_message(message: str) -> bool:
-    """Check if a string starts with any of the header prefixes."""
-    return any(
-        [message.upper().startswith(header) for header in env.SIGNAL_MESSAGE_HEADERS]
-    )
 
+    def __init__(self, headers: Iterable[str]):
+        self.headers = {header.upper(): header for header in headers}
+        alternatives = sorted(self.headers, key=len, reverse=True)
+        self._pattern = (
+            re.compile("|".join(map(re.escape, alternatives)), re.IGNORECASE)
+            if alternatives
+            else None
+        )
+
+    def match(self, message: str) -> Optional[str]:
+        """Return the header a message starts with, if any."""
+        if self._pattern is None or not (match := self._pattern.match(message)):
+            return None
+        return self.headers.get(match.group().upper())
 
+
+def _create_scanner_headers() -> HeaderMatcher:
+    return HeaderMatcher(env.SIGNAL_MESSAGE_HEADERS)
+
+
+# Created on first use, see env.lazy_resources
+SCANNER_HEADERS: HeaderMatcher
+__getattr__ = _load = env.lazy_resources(
+    globals(), SCANNER_HEADERS=_create_scanner_headers
+)
+
+
+################################################################################
+# Private Functions
+################################################################################
 def _condense_command(message: str) -> str:
     """Remove any non alphanumeric characters from a string."""
     return NON_ALPHA_NUMERIC.sub("", message).upper()
@@ -99,7 +124,7 @@ def _format_retweet_text(status: Dict) -> str:
 ################################################################################
 # Public Functions
 ################################################################################
-async def process_signal_message(blob: Dict, client: peony.PeonyClient) -> None:
+async def process_signal_message(blob: Dict, client: "peony.PeonyClient") -> None:
     """
     Process a signal message.
 
@@ -114,17 +139,29 @@ async def process_signal_message(blob: Dict, client: peony.PeonyClient) -> None:
         "dataMessage" not in envelope and "receiptMessage" not in envelope
     ):
         log.error(f"Malformed message: {blob}")
+        metrics.ERRORS.labels(source="signal_message").inc()
 
     data = envelope.get("dataMessage") or {}
-    if not _pass_filters(data, SIGNAL_FILTERS):
+    if not SIGNAL_FILTERS(data):
         return
     message = data["message"]
 
     # Signal-to-twitter
-    if _is_scanner_message(message):
+    if (header := _load("SCANNER_HEADERS").match(message)) is not None:
         timestamp = signal.message_timestamp(data)
-        log.info(f"{timestamp.isoformat()}: '{message}'")
-        await twitter.send_tweet(message, client)
+        log.info(f"{timestamp.isoformat()}: [{header}] '{message}'")
+        received = signal.received_timestamp(envelope)
+        # Queued rather than awaited so posting never holds up receiving
+        twitter.send_tweet(
+            message,
+            client,
+            hashtags=env.SIGNAL_HEADER_HASHTAGS.get(header.upper()),
+            priority=Priority.HIGH,
+            coalesce=True,
+            on_posted=lambda: metrics.SIGNAL_TO_TWEET_LATENCY.observe(
+                max((datetime.now() - received).total_seconds(), 0)
+            ),
+        )
         return
 
     # Check if twitter-to-signal should be on/off
@@ -132,7 +169,7 @@ async def process_signal_message(blob: Dict, client: peony.PeonyClient) -> None:
     notice = env.STATE.update_listening_status(condensed)
     if notice:
         log.info(notice)
-        signal.send_message(notice, env.LISTEN_CONTACT)
+        await signal.send_message(notice, env.LISTEN_CONTACT, wait=False)
 
 
 async def process_twitter_message(status: Dict) -> None:
@@ -143,7 +180,7 @@ async def process_twitter_message(status: Dict) -> None:
     hashtags and send it as a signal message to the listening group.
     """
     log.info(f"STATUS RECEIVED ({status['id']}) {status['text']}")
-    if not _pass_filters(status, TWITTER_FILTERS):
+    if not TWITTER_FILTERS(status):
         return None
 
     if hasattr(status, "quoted_status"):
@@ -153,7 +190,13 @@ async def process_twitter_message(status: Dict) -> None:
 
     # On the off chance a message is an empty string just skip sending
     if message:
-        await env.TWITTER_TO_SIGNAL_QUEUE.put(message)
+        await signal.send_message(
+            message,
+            env.LISTEN_CONTACT,
+            priority=Priority.LOW,
+            coalesce=True,
+            wait=False,
+        )
 
 
 async def send_comradely_reminder() -> None:
@@ -161,29 +204,84 @@ async def send_comradely_reminder() -> None:
     if not (env.COMRADELY_CONTACT and env.COMRADELY_MESSAGE):
         return
     log.info("Sending comradely message")
-    signal.send_message(env.COMRADELY_MESSAGE, env.COMRADELY_CONTACT)
+    await signal.send_message(env.COMRADELY_MESSAGE, env.COMRADELY_CONTACT)
 
 
-async def send_radio_monitor_alert(message: str, audio_url: str) -> None:
-    """Send a SWAT alert."""
-    if not env.RADIO_MONITOR_CONTACT:
-        return
-    log.info("Sending SWAT alert")
-    pathlib.Path("/audio").mkdir(exist_ok=True)
-    local_path_file = pathlib.Path("/audio/" + audio_url.split("/")[-1])
+async def _download_audio(
+    audio_url: str, session: aiohttp.ClientSession
+) -> pathlib.Path:
+    """
+    Stream an audio file into a temporary file, giving up if it's larger than
+    RADIO_AUDIO_MAX_SIZE or takes longer than RADIO_AUDIO_TIMEOUT to download.
+    """
+    suffix = pathlib.PurePosixPath(audio_url.split("?")[0]).suffix
+    fd, name = tempfile.mkstemp(suffix=suffix, dir=env.RADIO_AUDIO_DIR)
+    os.close(fd)
+    local_path_file = pathlib.Path(name)
     log.debug(f"Saving audio file to {local_path_file}")
-    async with aiohttp.ClientSession() as session:
-        async with session.get(audio_url) as response:
+    try:
+        async with session.get(
+            audio_url, timeout=aiohttp.ClientTimeout(total=env.RADIO_AUDIO_TIMEOUT)
+        ) as response:
+            if (response.content_length or 0) > env.RADIO_AUDIO_MAX_SIZE:
+                raise ValueError(
+                    f"Audio file is {response.content_length} bytes, over the"
+                    f" {env.RADIO_AUDIO_MAX_SIZE} byte limit"
+                )
+            size = 0
             async with aiofiles.open(local_path_file, "wb") as file_download:
-                while True:
-                    chunk = await response.content.read(env.RADIO_AUDIO_CHUNK_SIZE)
-                    if not chunk:
-                        break
+                async for chunk in response.content.iter_chunked(
+                    env.RADIO_AUDIO_CHUNK_SIZE
+                ):
+                    size += len(chunk)
+                    if size > env.RADIO_AUDIO_MAX_SIZE:
+                        raise ValueError(
+                            f"Audio file is over the {env.RADIO_AUDIO_MAX_SIZE} byte limit"
+                        )
                     await file_download.write(chunk)
-    log.debug("File successfully downloaded!")
-
-    signal.send_message(message, env.RADIO_MONITOR_CONTACT, attachment=local_path_file)
+    except BaseException:
+        local_path_file.unlink(missing_ok=True)
+        raise
+    log.debug(f"File successfully downloaded! ({size} bytes)")
+    return local_path_file
+
+
+async def send_radio_monitor_alerts(
+    alerts: List[Tuple[str, str, datetime]],
+    session: aiohttp.ClientSession,
+    contact: Optional[str] = None,
+) -> None:
+    """
+    Send SWAT alerts to `contact` (RADIO_MONITOR_CONTACT by default).
 
-    log.debug(f"Deleting audio file at {local_path_file}")
-    local_path_file.unlink(missing_ok=True)
-    log.debug("File successfully deleted!")
+    The audio for every alert is downloaded at the same time (once per call,
+    even if several monitored units were on it), then the alerts are sent in
+    order. If an audio file can't be downloaded the alert goes out without it.
+    """
+    contact = contact or env.RADIO_MONITOR_CONTACT
+    if not contact:
+        return
+    audio_urls = list(dict.fromkeys(audio_url for _, audio_url, _ in alerts))
+    downloads = await asyncio.gather(
+        *(_download_audio(audio_url, session) for audio_url in audio_urls),
+        return_exceptions=True,
+    )
+    audio_files = dict(zip(audio_urls, downloads))
+    try:
+        for message, audio_url, call_time in alerts:
+            log.info("Sending SWAT alert")
+            audio_file = audio_files[audio_url]
+            if isinstance(audio_file, BaseException):
+                log.warning(f"Unable to download {audio_url}: {audio_file!r}")
+                metrics.ERRORS.labels(source="radio_audio").inc()
+                await signal.send_message(f"{message}\n{audio_url}", contact)
+            else:
+                await signal.send_message(message, contact, attachment=audio_file)
+            metrics.RADIO_ALERT_LATENCY.observe(
+                (datetime.now(timezone.utc) - call_time).total_seconds()
+            )
+    finally:
+        for audio_file in audio_files.values():
+            if isinstance(audio_file, pathlib.Path):
+                log.debug(f"Deleting audio file at {audio_file}")
+                audio_file.unlink(missing_ok=True)
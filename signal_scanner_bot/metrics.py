@@ -0,0 +1,368 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+log = logging.getLogger(__name__)
+
+
+################################################################################
+# Constants
+################################################################################
+# Upper bounds in seconds, roughly log-spaced from "instant" to "someone
+# should probably look at this"
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Every metric created with register=True, in the order they were created
+REGISTRY: List["_Metric"] = []
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+################################################################################
+# Helper Functions
+################################################################################
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\""))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+################################################################################
+# Classes
+################################################################################
+class _Metric:
+    """
+    Shared plumbing for labelled metrics. A metric created with `labelnames`
+    only holds children (one per set of label values, see `labels`), while
+    one without is observed directly.
+    """
+
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = (),
+        register: bool = True,
+    ):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        if register:
+            REGISTRY.append(self)
+
+    def labels(self, **labels: str):
+        """Return the child metric for a set of label values."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        if (child := self._children.get(key)) is None:
+            child = self._children[key] = self._child()
+        return child
+
+    def _child(self) -> "_Metric":
+        raise NotImplementedError
+
+    def _samples(self) -> Iterator[Tuple[str, List[Tuple[str, str]], float]]:
+        """Yield (suffix, labels, value) for this metric's own values."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        if self.labelnames:
+            series = [
+                (list(zip(self.labelnames, key)), child)
+                for key, child in self._children.items()
+            ]
+        else:
+            series = [([], self)]
+        for labels, metric in series:
+            for suffix, extra, value in metric._samples():
+                lines.append(
+                    f"{self.name}{suffix}{_format_labels(labels + extra)}"
+                    f" {_format_value(value)}"
+                )
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only goes up, or is read from `function` when rendered."""
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], float]] = None,
+        register: bool = True,
+    ):
+        super().__init__(name, description, labelnames, register)
+        self.function = function
+        self.value = 0.0
+
+    def _child(self) -> "Counter":
+        return Counter(self.name, self.description, register=False)
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def _samples(self):
+        yield "", [], self.function() if self.function else self.value
+
+
+class Gauge(Counter):
+    """A value that can go up and down, usually read from `function`."""
+
+    kind = "gauge"
+
+    def _child(self) -> "Gauge":
+        return Gauge(self.name, self.description, register=False)
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram(_Metric):
+    """Bucketed histogram of observed values, Prometheus style."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        labelnames: Sequence[str] = (),
+        register: bool = True,
+    ):
+        super().__init__(name, description, labelnames, register)
+        self.buckets = sorted(buckets)
+        # One extra slot for values above the largest bucket (+Inf)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.description, self.buckets, register=False)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe how long the body of a `with` block takes."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls into."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def summary(self) -> str:
+        mean = self.sum / self.count if self.count else 0.0
+        return (
+            f"{self.name}: count={self.count} mean={mean:.3f}s"
+            f" p50<={self.quantile(0.5)}s p99<={self.quantile(0.99)}s"
+        )
+
+    def _samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            cumulative += count
+            yield "_bucket", [("le", _format_value(bound))], cumulative
+        yield "_sum", [], self.sum
+        yield "_count", [], self.count
+
+
+################################################################################
+# Public Functions
+################################################################################
+def render() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        try:
+            lines.extend(metric.render())
+        except Exception as err:
+            log.warning(f"Unable to render metric {metric.name}: {err!r}")
+    return "\n".join(lines) + "\n"
+
+
+async def serve(host: str, port: int) -> None:
+    """Serve the metrics at /metrics until cancelled."""
+    # Only the bot itself needs the web server, so don't make every import of
+    # this module pay for aiohttp
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        response = web.Response(text=render())
+        response.headers["Content-Type"] = CONTENT_TYPE
+        return response
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        log.info(f"Serving metrics on http://{host}:{port}/metrics")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+################################################################################
+# Metrics
+################################################################################
+SIGNAL_RECEIVE_LATENCY = Histogram(
+    "signal_receive_latency_seconds",
+    "Time from Signal's server receiving a message to the bot dispatching it",
+)
+SIGNAL_TO_TWEET_LATENCY = Histogram(
+    "signal_to_tweet_latency_seconds",
+    "Time from Signal's server receiving a scanner message to its tweets being sent",
+)
+RADIO_ALERT_LATENCY = Histogram(
+    "radio_alert_latency_seconds",
+    "Time from a monitored unit's OpenMHz call to its Signal alert being sent",
+)
+SIGNAL_CLI_DURATION = Histogram(
+    "signal_cli_duration_seconds",
+    "Time taken by signal-cli commands, one-shot or through the daemon",
+    labelnames=("mode", "command"),
+)
+TWEET_SEND_DURATION = Histogram(
+    "tweet_send_duration_seconds",
+    "Time taken to send a tweet or tweet thread",
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time taken by requests to OpenMHz and RadioChaser",
+    labelnames=("service",),
+)
+RADIO_POLL_LAG = Histogram(
+    "radio_poll_lag_seconds",
+    "How long after it was due each OpenMHz poll started",
+    labelnames=("feed",),
+)
+TWITTER_STREAM_RECONNECT_LATENCY = Histogram(
+    "twitter_stream_reconnect_latency_seconds",
+    "Time from losing the Twitter stream to being connected again",
+)
+TWITTER_STREAM_RECONNECTS = Counter(
+    "twitter_stream_reconnects_total", "Times the Twitter stream has reconnected"
+)
+TWITTER_STREAM_STALLS = Counter(
+    "twitter_stream_stalls_total",
+    "Times the Twitter stream was found to be stalled and reopened",
+)
+TWITTER_STREAM_GAPS = Counter(
+    "twitter_stream_gaps_total", "Catch-up passes that found tweets the stream missed"
+)
+TWITTER_STREAM_MISSED = Counter(
+    "twitter_stream_missed_total", "Tweets the stream missed, found by catching up"
+)
+TWITTER_STREAM_DUPLICATES = Counter(
+    "twitter_stream_duplicates_total", "Tweets seen more than once and skipped"
+)
+ERRORS = Counter(
+    "errors_total",
+    "Errors encountered, by where they happened",
+    labelnames=("source",),
+)
+IDENTITY_TRUSTS = Counter(
+    "signal_identity_trusts_total",
+    "Untrusted Signal identities the bot tried to trust, by result",
+    labelnames=("result",),
+)
+FILTER_EVALUATIONS = Counter(
+    "filter_evaluations_total",
+    "Messages checked by each filter",
+    labelnames=("pipeline", "filter"),
+)
+FILTER_REJECTIONS = Counter(
+    "filter_rejections_total",
+    "Messages rejected by each filter",
+    labelnames=("pipeline", "filter"),
+)
+FILTER_SECONDS = Counter(
+    "filter_seconds_total",
+    "Time spent running each filter",
+    labelnames=("pipeline", "filter"),
+)
+# The following are read from the objects they describe when rendered, see
+# where their `function` is set
+SIGNAL_QUEUE_DEPTH = Gauge(
+    "signal_queue_depth", "Outbound Signal messages waiting to be sent"
+)
+SIGNAL_MESSAGES_SENT = Counter(
+    "signal_messages_sent_total", "Outbound Signal messages sent"
+)
+SIGNAL_MESSAGES_FAILED = Counter(
+    "signal_messages_failed_total",
+    "Outbound Signal messages that failed to send, retries and all",
+)
+SIGNAL_MESSAGES_RETRIED = Counter(
+    "signal_messages_retried_total", "Outbound Signal message sends tried again"
+)
+SIGNAL_MESSAGES_DROPPED = Counter(
+    "signal_messages_dropped_total",
+    "Outbound Signal messages dropped because the dispatcher was full",
+)
+SIGNAL_DAEMON_RESTARTS = Counter(
+    "signal_daemon_restarts_total", "Times the signal-cli daemon has been restarted"
+)
+TWEET_QUEUE_DEPTH = Gauge("tweet_queue_depth", "Tweet threads waiting to be posted")
+TWEETS_POSTED = Counter("tweets_posted_total", "Tweet threads posted")
+TWEETS_FAILED = Counter("tweets_failed_total", "Tweet threads that failed to post")
+TWEETS_DROPPED = Counter(
+    "tweets_dropped_total", "Tweet threads dropped because the queue was full"
+)
+TWEET_RETRIES = Counter(
+    "tweet_retries_total", "Tweets retried after a transient Twitter error"
+)
+TWEET_RATE_LIMITED = Counter(
+    "tweet_rate_limited_total", "Tweets refused because of Twitter's rate limits"
+)
+OFFICER_CACHE_HITS = Counter(
+    "officer_cache_hits_total", "Radio IDs found in the officer cache"
+)
+OFFICER_CACHE_MISSES = Counter(
+    "officer_cache_misses_total", "Radio IDs looked up in RadioChaser"
+)
+OFFICER_CACHE_SIZE = Gauge("officer_cache_size", "Entries in the officer cache")
+RADIO_POLL_INTERVAL = Gauge(
+    "radio_poll_interval_seconds",
+    "Current interval between OpenMHz polls",
+    labelnames=("feed",),
+)
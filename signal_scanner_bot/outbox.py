@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import ujson
+
+
+log = logging.getLogger(__name__)
+
+
+################################################################################
+# Constants
+################################################################################
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+
+################################################################################
+# Classes
+################################################################################
+class Outbox:
+    """
+    SQLite-backed record of outbound messages that haven't been sent yet, so
+    they can be sent after a restart or crash.
+
+    Adding and acknowledging messages only touches memory. The changes are
+    written to disk together, at most every `commit_interval` seconds, so the
+    cost of a commit is shared by every message in that window and the send
+    path never waits on the disk. A message acknowledged before its window is
+    committed never touches the disk at all. Changes that fail to commit are
+    kept for the next one. At most `max_messages` are kept, the oldest being
+    dropped past that.
+
+    The database is opened by `open`, off the event loop, or on first use.
+    """
+
+    def __init__(
+        self, path: Path, commit_interval: float = 0.1, max_messages: int = 10000
+    ):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.max_messages = max_messages
+        self._db: Optional[sqlite3.Connection] = None
+        self._open_lock = threading.Lock()
+        self._next_id = 1
+        self._recovered: List[Tuple[int, str, Dict]] = []
+        self._inserts: Dict[int, Tuple[str, str, float]] = {}
+        self._deletes: Set[int] = set()
+        self._dirty = asyncio.Event()
+        self._committer: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        """Open the database and read what the last run left, in a thread."""
+        if self._db is None:
+            await asyncio.to_thread(self._open)
+
+    def _open(self) -> sqlite3.Connection:
+        # Opened from a thread by open(), but also on first use if that hasn't
+        # happened yet, so make sure only one of them does it
+        with self._open_lock:
+            if self._db is None:
+                # Only ever used by one thread at a time, see _commit
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute(SCHEMA)
+                rows = db.execute(
+                    "SELECT id, kind, payload FROM outbox ORDER BY id"
+                ).fetchall()
+                self._recovered = [
+                    (row_id, kind, ujson.loads(payload))
+                    for row_id, kind, payload in rows
+                ]
+                if rows:
+                    self._next_id = rows[-1][0] + 1
+                    log.info(f"{len(rows)} unsent message(s) found in {self.path}")
+                self._db = db
+        return self._db
+
+    def recover(self, kind: str) -> List[Tuple[int, Dict]]:
+        """
+        Hand over the messages of a kind left unsent by the last run, with
+        their IDs for acknowledging them once they're sent.
+        """
+        self._open()
+        recovered = [
+            (row_id, payload) for row_id, k, payload in self._recovered if k == kind
+        ]
+        self._recovered = [row for row in self._recovered if row[1] != kind]
+        return recovered
+
+    def add(self, kind: str, payload: Dict) -> int:
+        """Record a message to be sent, returning its ID."""
+        self._open()
+        row_id = self._next_id
+        self._next_id += 1
+        self._inserts[row_id] = (kind, ujson.dumps(payload), time.time())
+        self._schedule_commit()
+        return row_id
+
+    def ack(self, row_id: int) -> None:
+        """Forget a message that has been sent (or is never going to be)."""
+        if self._inserts.pop(row_id, None) is None:
+            self._deletes.add(row_id)
+            self._schedule_commit()
+
+    async def run(self) -> None:
+        """Commit changes in batches as they come in."""
+        while True:
+            await self._dirty.wait()
+            # Give other messages in this burst a chance to join the commit
+            await asyncio.sleep(self.commit_interval)
+            self._dirty.clear()
+            inserts, deletes = self._take_changes()
+            try:
+                await asyncio.to_thread(self._commit, inserts, deletes)
+            except sqlite3.Error as err:
+                log.error(f"Unable to write to outbox {self.path}: {err}")
+                self._restore_changes(inserts, deletes)
+
+    def close(self) -> None:
+        """Write out any outstanding changes and close the database."""
+        if self._committer is not None:
+            self._committer.cancel()
+            self._committer = None
+        if self._db is not None:
+            self._commit(*self._take_changes())
+            self._db.close()
+            self._db = None
+
+    def _schedule_commit(self) -> None:
+        self._dirty.set()
+        if self._committer is None or self._committer.done():
+            self._committer = asyncio.get_running_loop().create_task(self.run())
+
+    def _take_changes(self) -> Tuple[Dict[int, Tuple[str, str, float]], Set[int]]:
+        inserts, deletes = self._inserts, self._deletes
+        self._inserts, self._deletes = {}, set()
+        return inserts, deletes
+
+    def _restore_changes(
+        self, inserts: Dict[int, Tuple[str, str, float]], deletes: Set[int]
+    ) -> None:
+        """Put back changes that failed to commit, for the next commit to retry."""
+        # Messages acknowledged in the meantime needn't be written after all
+        acked = self._deletes & inserts.keys()
+        self._deletes -= acked
+        self._deletes |= deletes
+        self._inserts = {
+            **{row_id: row for row_id, row in inserts.items() if row_id not in acked},
+            **self._inserts,
+        }
+
+    def _commit(
+        self, inserts: Dict[int, Tuple[str, str, float]], deletes: Set[int]
+    ) -> None:
+        if not (inserts or deletes):
+            return
+        db = self._open()
+        with db:
+            db.executemany(
+                "INSERT INTO outbox (id, kind, payload, created) VALUES (?, ?, ?, ?)",
+                [(row_id, *row) for row_id, row in inserts.items()],
+            )
+            db.executemany(
+                "DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in deletes]
+            )
+            # Keep disk use bounded if messages pile up faster than they're sent
+            dropped = db.execute(
+                "DELETE FROM outbox WHERE id <= ("
+                " SELECT id FROM outbox ORDER BY id DESC LIMIT 1 OFFSET ?"
+                ")",
+                (self.max_messages,),
+            ).rowcount
+        if dropped:
+            log.warning(f"Outbox full, dropped the {dropped} oldest unsent message(s)")
@@ -1,92 +1,596 @@
+import asyncio
 import logging
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import aiohttp
 import backoff
 import pytz
+import ujson
 
-from . import env
+from . import env, metrics
+from .cache import TTLCache
 
 
 log = logging.getLogger(__name__)
 
 
-def _convert_to_timestr(in_time: str) -> str:
-    # Convert time string to datetime after converting it into proper ISO format
-    # Add timezone awareness (source is in UTC) then output in specified TZ and
-    # 12 hour format
-    time_dt = datetime.fromisoformat(in_time.replace("Z", "+00:00"))
-    time_dt_tz = time_dt.replace(tzinfo=pytz.utc)
-    return time_dt_tz.astimezone(env.DEFAULT_TZ).strftime("%Y-%m-%d, %I:%M:%S %Z")
+################################################################################
+# Constants
+################################################################################
+# How many of the most recently processed call IDs to remember
+SEEN_CALLS_MAX = 1000
+# Don't let a cursor saved before a long outage send us back through hours of
+# stale calls
+MAX_CURSOR_AGE = timedelta(hours=1)
+# How far before the last successful poll to look back, for calls that show up
+# on OpenMHz a little after they happen
+POLL_OVERLAP = timedelta(seconds=30)
+# How much longer the poll interval gets after each poll without monitored units
+QUIET_BACKOFF = 1.5
+# How many unit descriptions to remember the matching unit for
+UNIT_CACHE_MAX = 10000
+
+
+################################################################################
+# Helper Functions
+################################################################################
+def _trie_pattern(words: Iterable[str]) -> str:
+    """
+    Build a regex matching any of `words`, factored into a trie so that words
+    sharing a prefix share its match, preferring the longest word.
+    """
+    trie: Dict[str, Dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        # Marks the end of a word
+        node[""] = {}
+
+    def _node_pattern(node: Dict[str, Dict]) -> str:
+        branches = [
+            re.escape(char) + _node_pattern(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # A word ends here, so the longer ones carrying on from it are optional
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return _node_pattern(trie)
+
+
+################################################################################
+# Classes
+################################################################################
+class CallCursor:
+    """
+    Track which OpenMHz calls have already been processed.
+
+    Each poll asks for calls from a little (POLL_OVERLAP) before the last
+    successful poll, so calls OpenMHz only publishes after a later one are
+    still picked up. That means most calls come back more than once, so the
+    IDs of the most recent calls are kept to skip the ones already processed.
+    The cursor is the latest call time seen, only used when there's no
+    successful poll to go on. It's saved off the event loop after each poll
+    that finds calls, and `close` writes out whatever's left at shutdown.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_seen: int = SEEN_CALLS_MAX):
+        self.path = path
+        self.max_seen = max_seen
+        self.cursor: Optional[datetime] = None
+        self.polled: Optional[datetime] = None
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        # Bumped on every change, so a slow save can't overwrite a newer one
+        self._version = 0
+        self._saved_version = 0
+        self._write_lock = threading.Lock()
+        self._saver: Optional[asyncio.Task] = None
+        if self.path:
+            _CURSORS.add(self)
+            if self.path.is_file():
+                self.load()
+
+    def lookback_time(self, lookback: Optional[float] = None) -> datetime:
+        """
+        Time to ask OpenMHz for calls newer than, going back `lookback` seconds
+        (RADIO_MONITOR_LOOKBACK by default) when there's nothing to go on.
+        """
+        now = datetime.now(pytz.utc)
+        if last := self.polled or self.cursor:
+            return max(last - POLL_OVERLAP, now - MAX_CURSOR_AGE)
+        if lookback is None:
+            lookback = env.RADIO_MONITOR_LOOKBACK
+        return now - timedelta(seconds=lookback)
+
+    def new_calls(self, calls: List[Dict]) -> List[Dict]:
+        """Filter out the calls that have already been processed."""
+        return [call for call in calls if _call_id(call) not in self._seen]
+
+    def mark(self, calls: List[Dict], polled: Optional[datetime] = None) -> None:
+        """
+        Record calls as processed and move the cursor past them, along with when
+        the poll that found them was made.
+        """
+        if polled is not None:
+            self.polled = polled
+        for call in calls:
+            self._seen[_call_id(call)] = None
+            call_time = _parse_call_time(call["time"])
+            if self.cursor is None or call_time > self.cursor:
+                self.cursor = call_time
+        while len(self._seen) > self.max_seen:
+            self._seen.popitem(last=False)
+        if calls:
+            self.schedule_save()
+
+    def load(self) -> None:
+        assert self.path is not None
+        try:
+            state = ujson.loads(self.path.read_text())
+        except ValueError as err:
+            log.warning(f"Ignoring unreadable call cursor file {self.path}: {err}")
+            return
+        if state.get("cursor"):
+            self.cursor = datetime.fromisoformat(state["cursor"])
+        if state.get("polled"):
+            self.polled = datetime.fromisoformat(state["polled"])
+        self._seen = OrderedDict(
+            (call_id, None) for call_id in state.get("seen", [])[-self.max_seen :]
+        )
+
+    def schedule_save(self) -> None:
+        """Have the cursor written to disk, off the event loop."""
+        if not self.path:
+            return
+        self._version += 1
+        if self._saver is None or self._saver.done():
+            self._saver = asyncio.get_running_loop().create_task(self._save_soon())
+
+    async def _save_soon(self) -> None:
+        # Changes made while a save is being written go out with the next one
+        while self._saved_version < self._version:
+            try:
+                await asyncio.to_thread(self._write, self._version, self._state())
+            except OSError as err:
+                log.error(f"Unable to save call cursor to {self.path}: {err}")
+                return
+
+    def close(self) -> None:
+        """Write out any changes still waiting to be saved."""
+        if self._saver is not None:
+            self._saver.cancel()
+            self._saver = None
+        if self.path and self._saved_version < self._version:
+            self._write(self._version, self._state())
+
+    def _state(self) -> Dict[str, Any]:
+        return {
+            "cursor": self.cursor.isoformat() if self.cursor else None,
+            "polled": self.polled.isoformat() if self.polled else None,
+            "seen": list(self._seen),
+        }
+
+    def _write(self, version: int, state: Dict[str, Any]) -> None:
+        assert self.path is not None
+        with self._write_lock:
+            if version <= self._saved_version:
+                return
+            temp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+            temp_path.write_text(ujson.dumps(state))
+            os.replace(temp_path, self.path)
+            self._saved_version = version
+
+
+class UnitMatcher:
+    """
+    Case-insensitive matcher for the monitored units in a unit description.
+
+    The units are compiled into a single regex shaped like a trie of the
+    (lowercased) units, so each position in a description is checked against
+    all of them at once rather than one after another. The longest unit
+    matching at a position wins, so a more specific unit (e.g. "SWAT TEAM 2")
+    beats one it starts with (e.g. "SWAT"). Officers from the same unit share
+    a description, so the result for each description is cached.
+    """
+
+    def __init__(self, units: Iterable[str], max_cached: int = UNIT_CACHE_MAX):
+        self.units = {unit.lower(): unit for unit in units if unit}
+        self.max_cached = max_cached
+        self._pattern = (
+            re.compile(_trie_pattern(self.units), re.IGNORECASE) if self.units else None
+        )
+        self._cache: Dict[str, Optional[str]] = {}
+
+    def match(self, description: str) -> Optional[str]:
+        """Return the monitored unit found in a unit description, if any."""
+        try:
+            return self._cache[description]
+        except KeyError:
+            pass
+        unit = None
+        if self._pattern is not None and (match := self._pattern.search(description)):
+            unit = self.units.get(match.group().lower(), match.group())
+        if len(self._cache) >= self.max_cached:
+            self._cache.clear()
+        self._cache[description] = unit
+        return unit
+
+
+class PollScheduler:
+    """
+    Schedule radio polls at a fixed rate that follows recent activity.
+
+    Each poll is due one interval after the previous one was due, not after it
+    finished, so the time spent processing calls and sending alerts doesn't
+    push the cadence back. A poll that finds monitored units drops the
+    interval to `active_interval`, and every quiet one stretches it by
+    QUIET_BACKOFF up to `quiet_interval`. If polling falls more than a whole
+    interval behind, the missed polls are skipped rather than run back to back.
+    """
+
+    def __init__(self, interval: float, active_interval: float, quiet_interval: float):
+        self.interval = interval
+        self.active_interval = active_interval
+        self.quiet_interval = quiet_interval
+        self.due: Optional[float] = None
+
+    async def wait(self) -> float:
+        """Sleep until the next poll is due, returning how late it is."""
+        if self.due is None:
+            self.due = time.monotonic()
+        if (delay := self.due - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        lag = max(time.monotonic() - self.due, 0)
+        if lag >= self.interval:
+            log.warning(f"Radio polling is {lag:.1f}s behind, skipping missed polls")
+            self.due = time.monotonic()
+        return lag
+
+    def done(self, active: bool) -> None:
+        """Schedule the next poll, given whether this one found monitored units."""
+        if active:
+            self.interval = self.active_interval
+        else:
+            self.interval = min(self.interval * QUIET_BACKOFF, self.quiet_interval)
+        assert self.due is not None
+        self.due += self.interval
+
+
+class RadioPoll(NamedTuple):
+    """The result of polling a feed, see `check_radio_calls`."""
+
+    feed: "RadioFeed"
+    calls: List[Dict]
+    polled: datetime
+    alerts: List[Tuple[str, str, datetime]]
+
+    def done(self) -> None:
+        """Mark the poll's calls as processed."""
+        self.feed.cursor.mark(self.calls, polled=self.polled)
+
+
+class RadioFeed:
+    """
+    An OpenMHz feed to monitor, with its own monitored units, Signal contact
+    and polling cadence, and its own cursor through the feed's calls.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        units: UnitMatcher,
+        contact: str,
+        interval: float,
+        active_interval: float,
+        quiet_interval: float,
+        cursor_path: Optional[Path] = None,
+    ):
+        self.name = name
+        self.url = url
+        self.units = units
+        self.contact = contact
+        self.lookback = interval
+        self.cursor = CallCursor(path=cursor_path)
+        self.scheduler = PollScheduler(interval, active_interval, quiet_interval)
+
+    def __repr__(self) -> str:
+        return f"RadioFeed({self.name!r})"
+
 
+################################################################################
+# Shared State
+################################################################################
+# Radio ID -> the task looking it up in RadioChaser, so feeds polling at the
+# same time don't ask about the same radios twice
+_LOOKUPS: Dict[str, asyncio.Task] = {}
+# Every call cursor with a file to save to, see close_cursors
+_CURSORS: "weakref.WeakSet[CallCursor]" = weakref.WeakSet()
 
-def _calculate_lookback_time() -> str:
+
+def close_cursors() -> None:
+    """Write out every call cursor's unsaved changes, for shutting down."""
+    for cursor in list(_CURSORS):
+        cursor.close()
+
+
+def _create_officer_cache() -> TTLCache:
+    metrics.OFFICER_CACHE_HITS.function = lambda: _load("OFFICER_CACHE").hits
+    metrics.OFFICER_CACHE_MISSES.function = lambda: _load("OFFICER_CACHE").misses
+    metrics.OFFICER_CACHE_SIZE.function = lambda: len(_load("OFFICER_CACHE"))
+    return TTLCache(
+        maxsize=env.RADIO_CHASER_CACHE_SIZE,
+        ttl=env.RADIO_CHASER_CACHE_TTL,
+        path=env.RADIO_CHASER_CACHE_FILE,
+        save_interval=env.RADIO_CHASER_CACHE_SAVE_INTERVAL,
+    )
+
+
+# Radio ID -> officer record, shared across polls. Created on first use, see
+# env.lazy_resources
+OFFICER_CACHE: TTLCache
+__getattr__ = _load = env.lazy_resources(globals(), OFFICER_CACHE=_create_officer_cache)
+
+
+################################################################################
+# Functions
+################################################################################
+def load_feeds() -> List[RadioFeed]:
+    """
+    Load the OpenMHz feeds to monitor from RADIO_MONITOR_FEEDS_FILE, taking any
+    settings a feed leaves out from the RADIO_MONITOR_* ones. Without the file,
+    those settings describe the one feed. Raises ValueError, naming the feed,
+    for settings it can't use.
+    """
+    defaults = {
+        "url": env.OPENMHZ_URL,
+        "units": env.RADIO_MONITOR_UNITS,
+        "contact": env.RADIO_MONITOR_CONTACT,
+        "interval": env.RADIO_MONITOR_LOOKBACK,
+        "active_interval": env.RADIO_MONITOR_ACTIVE_INTERVAL,
+        "quiet_interval": env.RADIO_MONITOR_QUIET_INTERVAL,
+    }
+    if not env.RADIO_MONITOR_FEEDS_FILE:
+        configs = [{"name": "default"}]
+    else:
+        configs = ujson.loads(env.RADIO_MONITOR_FEEDS_FILE.read_text())
+        if not isinstance(configs, list) or not all(
+            isinstance(config, dict) for config in configs
+        ):
+            raise ValueError(
+                f"{env.RADIO_MONITOR_FEEDS_FILE} must hold a list of radio feeds"
+            )
+
+    # Feeds watching for the same units share a matcher, and its cache
+    matchers: Dict[FrozenSet[str], UnitMatcher] = {}
+    feeds: Dict[str, RadioFeed] = {}
+    for index, config in enumerate(configs):
+        name = str(config.get("name") or index)
+        if name in feeds:
+            raise ValueError(f"More than one radio feed is named {name}")
+        settings: Dict[str, Any] = {
+            **defaults,
+            **{key: config[key] for key in defaults if key in config},
+        }
+        _check_feed_settings(name, settings)
+        units = frozenset(settings.pop("units"))
+        if units not in matchers:
+            matchers[units] = UnitMatcher(units)
+        feeds[name] = RadioFeed(
+            name,
+            units=matchers[units],
+            cursor_path=_feed_cursor_path(name)
+            if env.RADIO_MONITOR_FEEDS_FILE
+            else env.RADIO_MONITOR_CURSOR_FILE,
+            **settings,
+        )
+    return list(feeds.values())
+
+
+def _check_feed_settings(name: str, settings: Dict[str, Any]) -> None:
+    if not settings["url"]:
+        raise ValueError(f"Radio feed {name} has no OpenMHz URL")
+    for key in ("url", "contact"):
+        if not isinstance(settings[key], str):
+            raise ValueError(f"Radio feed {name}'s {key} must be a string")
+    # A lone string would otherwise be taken as a set of single letters
+    units = settings["units"]
+    if not isinstance(units, (list, set)) or not all(
+        isinstance(unit, str) for unit in units
+    ):
+        raise ValueError(f"Radio feed {name}'s units must be a list of strings")
+    for key in ("interval", "active_interval", "quiet_interval"):
+        value = settings[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Radio feed {name}'s {key} must be a number")
+
+
+def _feed_cursor_path(name: str) -> Optional[Path]:
+    # Each feed keeps its cursor next to RADIO_MONITOR_CURSOR_FILE, e.g.
+    # radio-monitor-cursor-kcers1b.json
+    path = env.RADIO_MONITOR_CURSOR_FILE
+    if not path:
+        return None
+    return path.with_name(f"{path.stem}-{name}{path.suffix}")
+
+
+def _call_id(call: Dict) -> str:
+    return call.get("_id") or call["url"]
+
+
+def _parse_call_time(in_time: str) -> datetime:
+    return datetime.fromisoformat(in_time.replace("Z", "+00:00")).replace(
+        tzinfo=pytz.utc
+    )
+
+
+def _convert_to_timestr(call_time: datetime) -> str:
+    # Output the (UTC) call time in the specified TZ and 12 hour format
+    return call_time.astimezone(env.DEFAULT_TZ).strftime("%Y-%m-%d, %I:%M:%S %Z")
+
+
+def _calculate_lookback_time(time: datetime) -> str:
     # Because time.timestamp() gives us time in the format 1633987202.136147 and
     # we want it in the format 1633987202136 we need to do some str manipulation.
-    # First we get the current time in UTC, subtract a time delta equal to the
-    # specified number of seconds defined in the RADIO_MONITOR_LOOKBACK, split
-    # that timestamp on the decimal, then rejoin the str with the first three
-    # numbers after the decimal.
-    time = datetime.now(pytz.utc) - timedelta(seconds=(env.RADIO_MONITOR_LOOKBACK))
-    time_stamp_array = str(time.timestamp()).split(".")
+    # We take the timestamp of the time to look back to, split it on the
+    # decimal, then rejoin the str with the first three numbers after the
+    # decimal.
+    time_stamp_array = f"{time.timestamp():.6f}".split(".")
     return time_stamp_array[0] + time_stamp_array[1][:3]
 
 
-async def get_openmhz_calls() -> Dict:
-    lookback_time = _calculate_lookback_time()
-    log.debug(f"Lookback is currently set to: {lookback_time}")
-    async with aiohttp.ClientSession(raise_for_status=True) as session:
-        async with session.get(
-            env.OPENMHZ_URL, params={"time": lookback_time}
-        ) as response:
+async def get_openmhz_calls(
+    session: aiohttp.ClientSession, feed: RadioFeed
+) -> List[Dict]:
+    lookback_time = _calculate_lookback_time(feed.cursor.lookback_time(feed.lookback))
+    log.debug(f"Lookback for {feed.name} is currently set to: {lookback_time}")
+    with metrics.HTTP_REQUEST_DURATION.labels(service="openmhz").time():
+        async with session.get(feed.url, params={"time": lookback_time}) as response:
             return (await response.json())["calls"]
 
 
-async def get_pigs(calls: Dict) -> List[Tuple[Dict, str, str]]:
+def _get_radios(call: Dict) -> List[str]:
+    return list({f"7{radio['src']:0>5}" for radio in call["srcList"]})
+
+
+async def _fetch_cops(
+    radios: List[str], session: aiohttp.ClientSession, semaphore: asyncio.Semaphore
+) -> Dict:
+    # Due to requirements from aiohttp library it is required that the radios object be
+    # of the forms:
+    #  * {'key1': 'value1', 'key2': 'value2'}
+    #  * {"key": ["value1", "value2"]}
+    #  * [("key", "value1"), ("key", "value2")]
+    #
+    # more pointedly, it can not be
+    #  * {"key": {"value1", "value2"}}
+    #
+    # because aiohttp will choke on it. See the following link for more details
+    # https://docs.aiohttp.org/en/stable/client_quickstart.html#passing-parameters-in-urls
+    async with semaphore:
+        with metrics.HTTP_REQUEST_DURATION.labels(service="radiochaser").time():
+            async with session.get(
+                env.RADIO_CHASER_URL, params={"radio": radios}
+            ) as response:
+                return await response.json()
+
+
+async def _lookup_cops(radios: Set[str], session: aiohttp.ClientSession) -> Dict:
+    """
+    Look up the officer records for a set of radio IDs, only asking RadioChaser
+    about the IDs that aren't already cached or being looked up for another
+    feed.
+    """
+    cache = _load("OFFICER_CACHE")
+    cops, missing = cache.get_many(radios)
+    log.debug(
+        f"Officer cache: {len(cops)} hit(s), {len(missing)} miss(es)"
+        f" ({cache.hits} hits / {cache.misses} misses total)"
+    )
+    if not missing:
+        return cops
+
+    lookups = {_LOOKUPS[radio] for radio in missing if radio in _LOOKUPS}
+    if to_fetch := [radio for radio in missing if radio not in _LOOKUPS]:
+        lookup = asyncio.create_task(_fetch_missing_cops(to_fetch, session))
+        _LOOKUPS.update(dict.fromkeys(to_fetch, lookup))
+        lookup.add_done_callback(lambda _: _forget_lookups(to_fetch))
+        lookups.add(lookup)
+    # Shielded so one feed giving up doesn't cancel a lookup others are waiting on
+    for fetched in await asyncio.gather(*map(asyncio.shield, lookups)):
+        cops.update(fetched)
+    return cops
+
+
+def _forget_lookups(radios: List[str]) -> None:
+    for radio in radios:
+        _LOOKUPS.pop(radio, None)
+
+
+async def _fetch_missing_cops(
+    missing: List[str], session: aiohttp.ClientSession
+) -> Dict:
+    # Everything missing goes out in as few requests as possible, only split
+    # up to keep the query string a reasonable length. The batches run
+    # concurrently, RADIO_CHASER_CONCURRENCY at a time.
+    missing.sort()
+    batches = [
+        missing[i : i + env.RADIO_CHASER_BATCH_SIZE]
+        for i in range(0, len(missing), env.RADIO_CHASER_BATCH_SIZE)
+    ]
+    semaphore = asyncio.Semaphore(env.RADIO_CHASER_CONCURRENCY)
+    responses = await asyncio.gather(
+        *(_fetch_cops(batch, session, semaphore) for batch in batches)
+    )
+
+    # RadioChaser keys its response by radio ID. IDs it doesn't know about are
+    # cached too, as None, so they aren't asked about again on every poll.
+    fetched: Dict = dict.fromkeys(missing)
+    for response in responses:
+        fetched.update(response)
+    cache = _load("OFFICER_CACHE")
+    cache.update(fetched)
+    cache.schedule_save()
+    return fetched
+
+
+async def get_pigs(
+    calls: List[Dict], session: aiohttp.ClientSession, units: UnitMatcher
+) -> List[Tuple[Dict, datetime, str]]:
+    radios_per_call = [_get_radios(call) for call in calls]
+    all_radios = {radio for radios in radios_per_call for radio in radios}
+    cops = await _lookup_cops(all_radios, session)
+
     interesting_pigs = []
-    for call in calls:
-        time = call["time"]
-        # Due to requirements from aiohttp library it is required that the radios object be
-        # of the forms:
-        #  * {'key1': 'value1', 'key2': 'value2'}
-        #  * {"key": ["value1", "value2"]}
-        #  * [("key", "value1"), ("key", "value2")]
-        #
-        # more pointedly, it can not be
-        #  * {"key": {"value1", "value2"}}
-        #
-        # because aiohttp will choke on it. See the following link for more details
-        # https://docs.aiohttp.org/en/stable/client_quickstart.html#passing-parameters-in-urls
-        radios = {"radio": list({f"7{radio['src']:0>5}" for radio in call["srcList"]})}
-        if not len(radios["radio"]):
-            continue
-        async with aiohttp.ClientSession(raise_for_status=True) as session:
-            async with session.get(env.RADIO_CHASER_URL, params=radios) as response:
-                cops = await response.json()
-        for cop in cops.values():
-            if all(
-                unit.lower() not in cop["unit_description"].lower()
-                for unit in env.RADIO_MONITOR_UNITS
-            ):
+    for call, radios in zip(calls, radios_per_call):
+        call_time = _parse_call_time(call["time"])
+        for radio in radios:
+            if not (cop := cops.get(radio)):
+                continue
+            if not (unit := units.match(cop["unit_description"])):
                 log.debug(f"{cop}\nUnit not found in list of monitored units.")
                 continue
-            log.debug(f"{cop}\nUnit found in list of monitored units.")
-            time_formatted_in_tz = _convert_to_timestr(time)
-            interesting_pigs.append((cop, time_formatted_in_tz, call["url"]))
+            log.debug(f"{cop}\nUnit found in list of monitored units ({unit}).")
+            interesting_pigs.append((cop, call_time, call["url"]))
     return interesting_pigs
 
 
-def format_pigs(pigs: List[Tuple[Dict, str, str]]) -> List[Tuple[str, str]]:
+def format_pigs(
+    pigs: List[Tuple[Dict, datetime, str]]
+) -> List[Tuple[str, str, datetime]]:
     formatted_pigs = []
-    for cop, time, url in pigs:
+    for cop, call_time, url in pigs:
         name, badge, unit_description, time = (
             cop["full_name"],
             cop["badge"],
             cop["unit_description"],
-            time,
+            _convert_to_timestr(call_time),
+        )
+        formatted_pigs.append(
+            (f"{name}\n{badge}\n{unit_description}\n{time}", url, call_time)
         )
-        formatted_pigs.append((f"{name}\n{badge}\n{unit_description}\n{time}", url))
     return formatted_pigs
 
 
@@ -94,12 +598,33 @@ def format_pigs(pigs: List[Tuple[Dict, str, str]]) -> List[Tuple[str, str]]:
     backoff.expo,
     aiohttp.ClientError,
     logger=log,
-    max_time=env.RADIO_CHASER_BACKOFF,
+    # Read when it's first needed rather than on import
+    max_time=lambda: env.RADIO_CHASER_BACKOFF,
 )
-async def check_radio_calls() -> Optional[List[Tuple[str, str]]]:
-    calls = await get_openmhz_calls()
-    pigs = await get_pigs(calls)
-    if not pigs:
-        return None
-    log.debug(f"Interesting pigs found\n{pigs}")
-    return format_pigs(pigs)
+async def check_radio_calls(
+    session: aiohttp.ClientSession, feed: RadioFeed
+) -> RadioPoll:
+    """
+    Poll a feed for new calls and the alerts they call for. The calls are only
+    marked as processed once `RadioPoll.done` is called, after the alerts have
+    gone out, so alerts that fail to send are tried again on the next poll.
+    """
+    polled = datetime.now(pytz.utc)
+    calls = feed.cursor.new_calls(await get_openmhz_calls(session, feed))
+    log.debug(f"{len(calls)} new call(s) on {feed.name} since the last check")
+    pigs = await get_pigs(calls, session, feed.units)
+    if pigs:
+        log.debug(f"Interesting pigs found\n{pigs}")
+    return RadioPoll(feed, calls, polled, format_pigs(pigs))
+
+
+def create_session(feeds: int = 1) -> aiohttp.ClientSession:
+    """
+    Create the HTTP session shared by every OpenMHz and RadioChaser request
+    made over the lifetime of the radio monitor, with room for each of the
+    `feeds` to poll OpenMHz at once.
+    """
+    return aiohttp.ClientSession(
+        raise_for_status=True,
+        connector=aiohttp.TCPConnector(limit=env.RADIO_CHASER_CONCURRENCY + feeds),
+    )
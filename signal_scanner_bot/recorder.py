@@ -0,0 +1,116 @@
+import gzip
+import logging
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, NamedTuple, Optional
+
+import ujson
+
+from . import env
+
+
+log = logging.getLogger(__name__)
+
+
+################################################################################
+# Constants
+################################################################################
+# Compressed output is only flushed to disk this often, so a crash can lose up
+# to this many seconds of the recording
+FLUSH_INTERVAL = 1
+
+
+################################################################################
+# Classes
+################################################################################
+class Record(NamedTuple):
+    time: float
+    source: str
+    data: Any
+
+
+class Recorder:
+    """
+    Append incoming Signal messages and Twitter stream payloads to a gzipped
+    log of JSON lines, each stamped with the time it was received. Does
+    nothing without a path.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.records = 0
+        self._file: Optional[gzip.GzipFile] = None
+        self._last_flush = 0.0
+
+    def record(self, source: str, data: Any) -> None:
+        if not self.path:
+            return
+        if self._file is None:
+            # Appending adds a new gzip member, which readers handle fine
+            self._file = gzip.open(self.path, "ab")
+            log.info(f"Recording incoming messages to {self.path}")
+        now = time.time()
+        line = ujson.dumps({"time": now, "source": source, "data": data})
+        self._file.write(line.encode("utf-8") + b"\n")
+        self.records += 1
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+################################################################################
+# Functions
+################################################################################
+def read_recording(path: Path) -> Iterator[Record]:
+    """
+    Read back a recording. A recording cut short by a crash ends with a
+    partial gzip member, which is read up to where it stops.
+    """
+    with gzip.open(path, "rb") as recording:
+        try:
+            for line in recording:
+                try:
+                    blob = ujson.loads(line)
+                except ValueError:
+                    log.warning(f"Skipping unreadable line in {path}: {line!r}")
+                    continue
+                yield Record(blob["time"], blob["source"], blob["data"])
+        except (EOFError, zlib.error) as err:
+            log.warning(f"{path} ends early, the bot probably stopped abruptly: {err}")
+
+
+def retime_signal_blob(blob: Dict, offset: float) -> Dict:
+    """
+    Return a copy of a recorded signal-cli message with its timestamps moved
+    `offset` seconds later, so a replayed message looks as fresh as it was when
+    it was recorded.
+    """
+    offset_milliseconds = int(offset * 1000)
+    blob = {**blob}
+    envelope = blob["envelope"] = {**(blob.get("envelope") or {})}
+    for key in ["timestamp", "serverReceivedTimestamp", "serverDeliveredTimestamp"]:
+        if key in envelope:
+            envelope[key] += offset_milliseconds
+    if data := envelope.get("dataMessage"):
+        envelope["dataMessage"] = {**data}
+        if "timestamp" in data:
+            envelope["dataMessage"]["timestamp"] += offset_milliseconds
+    return blob
+
+
+################################################################################
+# Shared recorder
+################################################################################
+def _create_recorder() -> Recorder:
+    return Recorder(env.RECORD_FILE)
+
+
+# Created on first use, see env.lazy_resources
+RECORDER: Recorder
+__getattr__ = _load = env.lazy_resources(globals(), RECORDER=_create_recorder)
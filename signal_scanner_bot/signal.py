@@ -1,15 +1,68 @@
+import asyncio
 import logging
+import re
 import subprocess
 import traceback
 from datetime import datetime
-from typing import Dict, List
+from typing import AsyncIterator, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
-from . import env
+from . import env, metrics, signal_daemon
+from .dispatcher import Priority, SignalDispatcher
+from .outbox import Outbox
+from .signal_daemon import (
+    SignalDaemonError,
+    SignalDaemonTimeout,
+    SignalDaemonUnavailable,
+)
 
 
 log = logging.getLogger(__name__)
 
 
+################################################################################
+# Constants
+################################################################################
+# signal-cli holds a lock on the account while it runs, so one-shot calls are
+# made one at a time rather than piling up waiting on each other's lock.
+_CLI_LOCK = asyncio.Lock()
+# Re-trusts under way, by number, so that a burst of failed sends to someone
+# only trusts them once
+_RETRUSTS: Dict[str, "asyncio.Task[Dict[str, bool]]"] = {}
+# A line of one-shot `signal-cli listIdentities` output
+IDENTITY_LINE = re.compile(
+    r"^(?P<number>\+\d+): (?P<trust_level>[A-Z_]+)\b.*"
+    r"Safety Number: (?P<safety_number>[0-9 ]+)"
+)
+# How many identities are trusted at once through the daemon
+TRUST_CONCURRENCY = 8
+# How signal-cli reports sends that failed because of a changed safety number:
+# the daemon's error code and per-recipient result types, and one-shot
+# signal-cli's STDERR
+UNTRUSTED_KEY_ERROR = -4
+UNTRUSTED_RESULTS = {"IDENTITY_FAILURE", "UNTRUSTED_IDENTITY"}
+UNTRUSTED_LINE = re.compile(r"untrusted", re.IGNORECASE)
+PHONE_NUMBER = re.compile(r"\+\d{6,15}")
+
+
+################################################################################
+# Exceptions
+################################################################################
+class UntrustedIdentity(Exception):
+    """
+    Raised for a send that failed for some (or all) of its recipients because
+    their safety numbers have changed. `resend` is whether nobody got it.
+    """
+
+    def __init__(self, numbers: Iterable[str], resend: bool):
+        self.numbers = sorted(set(numbers))
+        self.resend = resend
+        super().__init__(", ".join(self.numbers))
+
+
+class SignalCliError(Exception):
+    """Raised when a one-shot signal-cli call fails."""
+
+
 ################################################################################
 # Private Functions
 ################################################################################
@@ -25,6 +78,43 @@ def _check_group(recipient: str) -> bool:
         raise ValueError(f"Supplied recipient is invalid: {recipient}")
 
 
+def _send_results(result) -> List[Dict]:
+    """Pull the per-recipient results out of a daemon `send` response."""
+    if isinstance(result, dict):
+        return [item for item in result.get("results") or [] if isinstance(item, dict)]
+    return []
+
+
+def _untrusted_numbers(results: List[Dict]) -> List[str]:
+    numbers = []
+    for result in results:
+        if result.get("type") in UNTRUSTED_RESULTS:
+            address = result.get("recipientAddress") or {}
+            if number := address.get("number") or address.get("uuid"):
+                numbers.append(number)
+    return numbers
+
+
+async def _run_signal_cli(*args: str) -> subprocess.CompletedProcess:
+    """Run a one-shot signal-cli command without blocking the event loop."""
+    duration = metrics.SIGNAL_CLI_DURATION.labels(mode="cli", command=args[0])
+    async with _CLI_LOCK:
+        with duration.time():
+            proc = await asyncio.create_subprocess_exec(
+                "signal-cli",
+                "-u",
+                str(env.BOT_NUMBER),
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await proc.communicate()
+    assert proc.returncode is not None
+    return subprocess.CompletedProcess(
+        args, proc.returncode, stdout.decode("utf-8"), stderr.decode("utf-8")
+    )
+
+
 ################################################################################
 # Public Functions
 ################################################################################
@@ -42,79 +132,335 @@ def message_timestamp(data: Dict) -> datetime:
     return dt
 
 
-def list_identities() -> List[str]:
+def received_timestamp(envelope: Dict) -> datetime:
     """
-    Call the signal-cli `listIdentities` command and return the entire
-    result as a list of strings.
+    Extract the time Signal's server received a message from its envelope,
+    falling back to the sender's timestamp for older signal-cli versions.
     """
-    proc = subprocess.run(
-        ["signal-cli", "-u", str(env.BOT_NUMBER), "listIdentities"],
-        capture_output=True,
-        text=True,
+    timestamp_milliseconds = (
+        envelope.get("serverReceivedTimestamp") or envelope.get("timestamp") or 0
     )
+    return datetime.fromtimestamp(timestamp_milliseconds / 1000.0)
+
+
+async def _send_message_cli(message: str, recipient: str, attachment=None) -> None:
+    """Send a Signal message with a one-shot signal-cli `send` call."""
+    group = _check_group(recipient)
+    recipient_args = ["-g", recipient] if group else [recipient]
+
+    attachement_args = ["-a", str(attachment)] if attachment else []
+
+    log.debug("Sending message")
+    proc = await _run_signal_cli(
+        "send", "-m", message, *recipient_args, *attachement_args
+    )
+    if proc.stdout:
+        log.info(f"STDOUT: {proc.stdout}")
     if proc.stderr:
         log.warning(f"STDERR: {proc.stderr}")
-    if proc.stdout:
-        return proc.stdout.split("\n")
+        numbers = [
+            number
+            for line in proc.stderr.splitlines()
+            if UNTRUSTED_LINE.search(line)
+            for number in PHONE_NUMBER.findall(line)
+        ]
+        if numbers:
+            # signal-cli only fails outright when nobody got the message
+            raise UntrustedIdentity(numbers, resend=proc.returncode != 0)
+    if proc.returncode != 0:
+        raise SignalCliError(
+            f"signal-cli send exited with error code {proc.returncode}"
+        )
+
+
+async def _send_message_daemon(message: str, recipient: str, attachment=None) -> None:
+    """Send a Signal message through the signal-cli JSON-RPC daemon."""
+    params: Dict = {"message": message}
+    group = _check_group(recipient)
+    if group:
+        params["groupId"] = recipient
     else:
-        return []
+        params["recipient"] = [recipient]
+    if attachment:
+        params["attachments"] = [str(attachment)]
+
+    log.debug("Sending message through signal-cli daemon")
+    try:
+        result = await signal_daemon.DAEMON.request("send", params)
+    except SignalDaemonError as err:
+        results = _send_results((err.data or {}).get("response"))
+        numbers = _untrusted_numbers(results)
+        if err.code == UNTRUSTED_KEY_ERROR and not numbers and not group:
+            numbers = [recipient]
+        if numbers:
+            raise UntrustedIdentity(numbers, resend=True) from err
+        raise
+    log.info(f"Send result: {result}")
+    results = _send_results(result)
+    if numbers := _untrusted_numbers(results):
+        # Don't send the message again to everyone who did get it
+        resend = all(item.get("type") != "SUCCESS" for item in results)
+        raise UntrustedIdentity(numbers, resend=resend)
 
 
-def trust_identity(phone_number: str, safety_number: str):
-    """Call the signal-cli `trust` command for the provided phone + safety numbers."""
-    proc = subprocess.run(
-        [
+async def _deliver_message(message: str, recipient: str, attachment=None) -> None:
+    """
+    Actually send a Signal message, raising if it couldn't be sent. When it
+    fails because someone's safety number changed, their new identity is
+    trusted and the message sent again.
+    """
+    try:
+        await _deliver_message_once(message, recipient, attachment)
+    except UntrustedIdentity as err:
+        log.warning(f"Untrusted identity sending to {recipient}: {err}")
+        if not await retrust(err.numbers):
+            log.error(f"Unable to trust {err}, message to {recipient} not sent")
+            raise
+        if not err.resend:
+            log.warning(f"Trusted {err}, who missed the message to {recipient}")
+            return
+        log.info(f"Trusted {err}, sending message to {recipient} again")
+        await _deliver_message_once(message, recipient, attachment)
+
+
+async def _deliver_message_once(message: str, recipient: str, attachment=None) -> None:
+    """
+    Messages go through the signal-cli daemon when it's running, otherwise
+    signal-cli is started up just for this message.
+
+    A daemon that times out is still running and holding the account's lock,
+    and may yet send the message, so that's raised for the dispatcher to retry
+    rather than sent again one-shot.
+    """
+    if signal_daemon.DAEMON.running:
+        try:
+            await _send_message_daemon(message, recipient, attachment)
+            return
+        except SignalDaemonUnavailable:
+            log.warning("signal-cli daemon unavailable, falling back to one-shot send")
+    await _send_message_cli(message, recipient, attachment)
+
+
+def _create_dispatcher() -> SignalDispatcher:
+    metrics.SIGNAL_QUEUE_DEPTH.function = lambda: _load("DISPATCHER").qsize()
+    metrics.SIGNAL_MESSAGES_SENT.function = lambda: _load("DISPATCHER").sent
+    metrics.SIGNAL_MESSAGES_FAILED.function = lambda: _load("DISPATCHER").failed
+    metrics.SIGNAL_MESSAGES_RETRIED.function = lambda: _load("DISPATCHER").retried
+    metrics.SIGNAL_MESSAGES_DROPPED.function = lambda: _load("DISPATCHER").dropped
+    return SignalDispatcher(
+        _deliver_message,
+        max_pending=env.SIGNAL_QUEUE_SIZE,
+        concurrency=env.SIGNAL_SEND_CONCURRENCY,
+        overflow=env.SIGNAL_QUEUE_OVERFLOW,
+        coalesce_window=env.TWITTER_TO_SIGNAL_BATCH_WINDOW,
+        coalesce_max=env.TWITTER_TO_SIGNAL_BATCH_SIZE,
+        retries=env.SIGNAL_SEND_RETRIES,
+        retry_delay=env.SIGNAL_SEND_RETRY_DELAY,
+        outbox=Outbox(
+            env.OUTBOX_FILE,
+            commit_interval=env.OUTBOX_COMMIT_INTERVAL,
+            max_messages=env.OUTBOX_MAX_MESSAGES,
+        )
+        if env.OUTBOX_FILE
+        else None,
+    )
+
+
+# All outbound Signal traffic goes through this. Created on first use, see
+# env.lazy_resources
+DISPATCHER: SignalDispatcher
+__getattr__ = _load = env.lazy_resources(globals(), DISPATCHER=_create_dispatcher)
+
+
+async def send_message(
+    message: str,
+    recipient: str,
+    attachment=None,
+    priority: Priority = Priority.NORMAL,
+    coalesce: bool = False,
+    wait: bool = True,
+) -> None:
+    """
+    High level function to send a Signal message to a specified recipient.
+
+    The message is queued on the dispatcher, see SignalDispatcher.send for what
+    the extra arguments do.
+    """
+    await _load("DISPATCHER").send(
+        message,
+        recipient,
+        attachment=attachment,
+        priority=priority,
+        coalesce=coalesce,
+        wait=wait,
+    )
+
+
+################################################################################
+# Identities
+################################################################################
+class Identity(NamedTuple):
+    number: str
+    trust_level: str
+    safety_number: str
+
+
+def parse_identity(line: str) -> Optional[Identity]:
+    """Parse a line of one-shot `signal-cli listIdentities` output."""
+    if match := IDENTITY_LINE.match(line):
+        return Identity(
+            match.group("number"),
+            match.group("trust_level"),
+            match.group("safety_number").strip(),
+        )
+    return None
+
+
+async def _stream_signal_cli(*args: str) -> AsyncIterator[str]:
+    """Run a one-shot signal-cli command, yielding its output line by line."""
+    async with _CLI_LOCK:
+        proc = await asyncio.create_subprocess_exec(
             "signal-cli",
             "-u",
             str(env.BOT_NUMBER),
-            "trust",
-            phone_number,
-            "-v",
-            f'{safety_number.replace(" ", "")}',
-        ],
-        capture_output=False,
-        text=True,
-    )
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=signal_daemon.STREAM_LIMIT,
+        )
+        stderr_task = asyncio.create_task(signal_daemon.log_stderr(proc))
+        try:
+            assert proc.stdout is not None
+            while line := await proc.stdout.readline():
+                yield line.decode("utf-8")
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+            await proc.wait()
+            await stderr_task
+
+
+async def list_identities(number: Optional[str] = None) -> AsyncIterator[Identity]:
+    """
+    Yield the identities signal-cli knows about, or just those of `number`.
+    One-shot signal-cli output is parsed as it comes in rather than once the
+    whole list is done.
+    """
+    if signal_daemon.DAEMON.running:
+        try:
+            result = await signal_daemon.DAEMON.request(
+                "listIdentities", {"number": number} if number else None
+            )
+        except SignalDaemonUnavailable:
+            log.warning("signal-cli daemon unavailable, listing identities one-shot")
+        else:
+            for blob in result or []:
+                yield Identity(
+                    blob.get("number") or blob.get("uuid"),
+                    blob.get("trustLevel"),
+                    blob.get("safetyNumber"),
+                )
+            return
+    async for line in _stream_signal_cli(
+        "listIdentities", *(["-n", number] if number else [])
+    ):
+        if identity := parse_identity(line):
+            yield identity
+
+
+async def trust_identity(phone_number: str, safety_number: str) -> bool:
+    """Trust the identity with the given safety number, returning whether it worked."""
+    safety_number = safety_number.replace(" ", "")
+    if signal_daemon.DAEMON.running:
+        try:
+            await signal_daemon.DAEMON.request(
+                "trust",
+                {"recipient": phone_number, "verifiedSafetyNumber": safety_number},
+            )
+            return True
+        except (SignalDaemonError, SignalDaemonTimeout) as err:
+            log.error(f"Unable to trust {phone_number}: {err}")
+            return False
+        except SignalDaemonUnavailable:
+            log.warning("signal-cli daemon unavailable, trusting one-shot")
+    proc = await _run_signal_cli("trust", phone_number, "-v", safety_number)
     if proc.stderr:
         log.error(f"STDERR: {proc.stderr}")
     if proc.returncode != 0:
         log.error(f"Trust call return code: {proc.returncode}")
+    return proc.returncode == 0
 
 
-def send_message(message: str, recipient: str, attachment=None):
-    """High level function to send a Signal message to a specified recipient."""
-    group = _check_group(recipient)
-    recipient_args = ["-g", recipient] if group else [recipient]
+async def trust_untrusted(numbers: Optional[Iterable[str]] = None) -> Dict[str, bool]:
+    """
+    Trust every untrusted identity, or only those of `numbers`, returning
+    whether each one was trusted.
 
-    attachement_args = ["-a", attachment] if attachment else []
+    Identities are trusted as they're listed, TRUST_CONCURRENCY at a time
+    through the daemon (one-shot signal-cli calls take turns anyway).
+    """
+    wanted = set(numbers) if numbers is not None else None
+    slots = asyncio.Semaphore(TRUST_CONCURRENCY)
 
-    log.debug("Sending message")
-    proc = subprocess.run(
-        [
-            "signal-cli",
-            "-u",
-            str(env.BOT_NUMBER),
-            "send",
-            "-m",
-            message,
-            *recipient_args,
-            *attachement_args,
-        ],
-        capture_output=True,
-        text=True,
+    async def trust(identity: Identity) -> Tuple[str, bool]:
+        async with slots:
+            log.debug(f"Trusting {identity.number}")
+            trusted = await trust_identity(identity.number, identity.safety_number)
+        metrics.IDENTITY_TRUSTS.labels(result="trusted" if trusted else "failed").inc()
+        return identity.number, trusted
+
+    tasks = []
+    listings = (
+        [list_identities()]
+        if wanted is None
+        else [list_identities(number) for number in sorted(wanted)]
     )
-    if proc.stdout:
-        log.info(f"STDOUT: {proc.stdout}")
-    if proc.stderr:
-        log.warning(f"STDERR: {proc.stderr}")
+    for listing in listings:
+        async for identity in listing:
+            if identity.trust_level == "UNTRUSTED" and (
+                wanted is None or identity.number in wanted
+            ):
+                tasks.append(asyncio.create_task(trust(identity)))
+    return dict(await asyncio.gather(*tasks))
+
+
+async def retrust(numbers: Iterable[str]) -> bool:
+    """
+    Trust the new identities of `numbers`, returning whether they're all
+    trusted now. Numbers already being re-trusted share that attempt rather
+    than starting another.
+    """
+    numbers = set(numbers)
+    if new := sorted(numbers - _RETRUSTS.keys()):
+        task = asyncio.create_task(trust_untrusted(new))
+        for number in new:
+            _RETRUSTS[number] = task
+        task.add_done_callback(
+            lambda _: [_RETRUSTS.pop(number, None) for number in new]
+        )
+    results: Dict[str, bool] = {}
+    for task in {_RETRUSTS[number] for number in numbers}:
+        try:
+            results.update(await task)
+        except Exception as err:
+            log.error(f"Unable to re-trust identities: {err!r}")
+            return False
+    # A number with nothing left to trust was trusted some other way
+    return all(results.get(number, True) for number in numbers)
 
 
 ################################################################################
 # Panic?!?!?!?!
 ################################################################################
-def panic(err: Exception) -> None:
+async def panic(err: Exception, wait: bool = True) -> None:
     # We don't really care if this succeeds, particularly if there's an issue
-    # with the signal config
+    # with the signal config. Without `wait` it's only queued, for callers that
+    # can't be held up while it's delivered.
     log.info(f"Panicing, attempting to call home at {env.ADMIN_CONTACT}")
     message = f"BOT FAILURE: {err}\n{traceback.format_exc(limit=4)}"
-    send_message(message, env.ADMIN_CONTACT)
+    try:
+        await send_message(
+            message, env.ADMIN_CONTACT, priority=Priority.HIGH, wait=wait
+        )
+    except Exception as send_err:
+        log.error(f"Unable to call home: {send_err!r}")
@@ -0,0 +1,274 @@
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import ujson
+
+from . import env, metrics
+
+
+log = logging.getLogger(__name__)
+
+
+################################################################################
+# Constants
+################################################################################
+# signal-cli can emit fairly large envelopes (attachment metadata, quotes, etc.)
+# so bump the stream reader limit above asyncio's 64KiB default.
+STREAM_LIMIT = 2**20
+# A daemon that dies within this many seconds of being spawned counts as a
+# failed start. After MAX_START_FAILURES of those in a row we give up and let
+# callers fall back to one-shot signal-cli calls.
+STARTUP_GRACE = 5
+MAX_START_FAILURES = 3
+MAX_RESTART_DELAY = 60
+# How long a request waits for the daemon to reply unless it's told otherwise
+DEFAULT_REQUEST_TIMEOUT = 60
+
+
+################################################################################
+# Exceptions
+################################################################################
+class SignalDaemonUnavailable(Exception):
+    """Raised when a request is made while the daemon is not running."""
+
+
+class SignalDaemonTimeout(Exception):
+    """
+    Raised when the daemon doesn't reply to a request in time. It may still be
+    carrying the request out, so it's not safe to try again one-shot.
+    """
+
+
+class SignalDaemonError(Exception):
+    """An error object returned by the signal-cli JSON-RPC daemon."""
+
+    def __init__(self, error: Dict):
+        self.code = error.get("code")
+        self.data = error.get("data")
+        super().__init__(error.get("message") or str(error))
+
+
+################################################################################
+# Helper Functions
+################################################################################
+async def log_stderr(proc: asyncio.subprocess.Process) -> None:
+    """Log a long-running signal-cli process' STDERR as it comes in."""
+    assert proc.stderr is not None
+    while line := await proc.stderr.readline():
+        if text := line.decode("utf-8", "replace").rstrip():
+            log.warning(f"STDERR: {text}")
+
+
+################################################################################
+# Classes
+################################################################################
+class SignalDaemon:
+    """
+    Manage a single long-lived `signal-cli jsonRpc` process.
+
+    Requests are written to the daemon's STDIN and matched back up to their
+    responses by ID, so any number of coroutines can share the process.
+    Incoming messages arrive as `receive` notifications and are fanned out to
+    every queue handed out by `subscribe`.
+    """
+
+    def __init__(
+        self,
+        command: Optional[List[str]] = None,
+        enabled: bool = True,
+        timeout: float = DEFAULT_REQUEST_TIMEOUT,
+    ):
+        self.command = command
+        self.enabled = enabled
+        self.timeout = timeout
+        # Flipped to False once the daemon has failed to start too many times,
+        # at which point everything should use the one-shot signal-cli path.
+        self.available = enabled
+        self.restarts = 0
+        self._proc: Optional[asyncio.subprocess.Process] = None
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._subscribers: List[asyncio.Queue] = []
+        self._write_lock = asyncio.Lock()
+        self._ready = asyncio.Event()
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    async def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the daemon to be running, returning whether it is."""
+        if not self.available:
+            return False
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.running
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Return a queue that receives the params of every `receive` notification.
+        A None is put on the queue if the daemon gives up for good.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    async def request(
+        self,
+        method: str,
+        params: Optional[Dict] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Send a JSON-RPC request to the daemon and wait for its result, for up
+        to `timeout` seconds (the daemon's timeout by default).
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not self.running:
+            raise SignalDaemonUnavailable("signal-cli daemon is not running")
+        assert self._proc is not None and self._proc.stdin is not None
+
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        payload = {"jsonrpc": "2.0", "method": method, "id": request_id}
+        if params:
+            payload["params"] = params
+        duration = metrics.SIGNAL_CLI_DURATION.labels(mode="daemon", command=method)
+        try:
+            with duration.time():
+                async with self._write_lock:
+                    self._proc.stdin.write(ujson.dumps(payload).encode("utf-8") + b"\n")
+                    await self._proc.stdin.drain()
+                return await asyncio.wait_for(future, timeout)
+        except (BrokenPipeError, ConnectionResetError) as err:
+            raise SignalDaemonUnavailable("signal-cli daemon went away") from err
+        except asyncio.TimeoutError as err:
+            log.warning(f"signal-cli daemon didn't reply to {method} in {timeout}s")
+            raise SignalDaemonTimeout(
+                f"signal-cli daemon didn't reply to {method} in {timeout}s"
+            ) from err
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def run(self) -> None:
+        """Run the daemon, restarting it with an exponential delay when it exits."""
+        if not self.enabled:
+            log.info("signal-cli daemon disabled, using one-shot signal-cli calls")
+            return
+        failures = 0
+        try:
+            while not (self._stopping or env.STATE.STOP_REQUESTED):
+                started = time.monotonic()
+                try:
+                    await self._run_once()
+                except OSError as err:
+                    log.error(f"Unable to start signal-cli daemon: {err}")
+                    break
+                if self._stopping:
+                    break
+
+                if time.monotonic() - started < STARTUP_GRACE:
+                    failures += 1
+                    if failures >= MAX_START_FAILURES:
+                        log.error(
+                            f"signal-cli daemon failed to start {failures} times in a row"
+                        )
+                        break
+                else:
+                    failures = 0
+                delay = min(2**failures, MAX_RESTART_DELAY)
+                log.warning(f"signal-cli daemon exited, restarting in {delay}s")
+                self.restarts += 1
+                await asyncio.sleep(delay)
+        finally:
+            if not self._stopping:
+                log.warning("Falling back to one-shot signal-cli calls")
+                self.available = False
+                for queue in self._subscribers:
+                    queue.put_nowait(None)
+            self._ready.set()
+
+    async def stop(self) -> None:
+        """Stop the daemon and keep it from being restarted."""
+        self._stopping = True
+        if self.running:
+            assert self._proc is not None
+            self._proc.terminate()
+            await self._proc.wait()
+
+    async def _run_once(self) -> None:
+        log.info("Starting signal-cli daemon")
+        command = self.command or ["signal-cli", "-u", str(env.BOT_NUMBER), "jsonRpc"]
+        self._proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT,
+        )
+        self._ready.set()
+        stderr_task = asyncio.create_task(log_stderr(self._proc))
+        try:
+            assert self._proc.stdout is not None
+            while line := await self._proc.stdout.readline():
+                self._dispatch(line)
+        finally:
+            self._ready.clear()
+            if self._proc.returncode is None:
+                self._proc.kill()
+            returncode = await self._proc.wait()
+            await stderr_task
+            log.info(f"signal-cli daemon exited with code {returncode}")
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(
+                        SignalDaemonUnavailable("signal-cli daemon exited")
+                    )
+
+    def _dispatch(self, line: bytes) -> None:
+        try:
+            blob = ujson.loads(line)
+        except ValueError:
+            log.warning(f"Unparseable line from signal-cli daemon: {line!r}")
+            return
+
+        # Responses carry the ID of the request they belong to
+        if "id" in blob:
+            future = self._pending.get(blob["id"])
+            if future is None or future.done():
+                log.debug(f"Response for unknown request: {blob}")
+            elif "error" in blob:
+                future.set_exception(SignalDaemonError(blob["error"]))
+            else:
+                future.set_result(blob.get("result"))
+        # Notifications don't, and the only one we care about is incoming messages
+        elif blob.get("method") == "receive":
+            for queue in self._subscribers:
+                queue.put_nowait(blob.get("params") or {})
+        else:
+            log.debug(f"Unhandled notification from signal-cli daemon: {blob}")
+
+
+################################################################################
+# Shared daemon
+################################################################################
+def _create_daemon() -> SignalDaemon:
+    metrics.SIGNAL_DAEMON_RESTARTS.function = lambda: _load("DAEMON").restarts
+    return SignalDaemon(enabled=env.SIGNAL_DAEMON, timeout=env.SIGNAL_DAEMON_TIMEOUT)
+
+
+# Created on first use, see env.lazy_resources
+DAEMON: SignalDaemon
+__getattr__ = _load = env.lazy_resources(globals(), DAEMON=_create_daemon)
@@ -2,12 +2,24 @@
 import asyncio
 import logging
 import subprocess
+import time
 from datetime import date, datetime, timedelta
+from typing import Dict
 
+import aiohttp
 import ujson
-from peony import events
 
-from . import env, messages, radio_monitor_alert, signal
+from . import (
+    env,
+    filters,
+    messages,
+    metrics,
+    radio_monitor_alert,
+    recorder,
+    signal,
+    signal_daemon,
+)
+from .twitter_stream import TwitterStream
 
 
 log = logging.getLogger(__name__)
@@ -23,85 +35,148 @@ def _filter_hashtags(data, filter_hashtag_list):
     return False
 
 
+async def process_twitter_data(data) -> None:
+    """Process a tweet from the stream, if we're listening and it's wanted."""
+    recorder.RECORDER.record("twitter", data)
+    if (
+        env.STATE.LISTENING
+        and _filter_hashtags(data, env.RECEIVE_HASHTAGS)
+        and data["user"]["id_str"] in env.TRUSTED_TWEETERS
+    ):
+        await messages.process_twitter_message(data)
+
+
 async def twitter_to_queue():
     log.info("Starting Twitter Event Stream")
-    stream_obj = env.CLIENT.stream.statuses.filter.post(
-        follow=",".join(env.TRUSTED_TWEETERS)
+    stream = TwitterStream(
+        env.CLIENT,
+        env.TRUSTED_TWEETERS,
+        process_twitter_data,
+        stall_timeout=env.TWITTER_STREAM_STALL_TIMEOUT,
     )
-    async with stream_obj as stream:
-        async for data in stream:
-            if events.on_connect(data):
-                log.info("Connected to the stream")
-            elif events.on_tweet(data) and env.STATE.LISTENING:
-                if (
-                    _filter_hashtags(data, env.RECEIVE_HASHTAGS)
-                    and data["user"]["id_str"] in env.TRUSTED_TWEETERS
-                ):
-                    await messages.process_twitter_message(data)
+    await stream.run()
 
 
 ################################################################################
-# Queue-to-Signal
+# Signal-to-Twitter
 ################################################################################
-async def queue_to_signal():
-    """Run the queue-to-signal loop. Flushes the entire queue on each call."""
+async def process_signal_blob(blob) -> None:
+    """Process a message from signal-cli."""
+    recorder.RECORDER.record("signal", blob)
+    envelope = blob.get("envelope") or {}
+    if envelope:
+        latency = max(
+            (datetime.now() - signal.received_timestamp(envelope)).total_seconds(), 0
+        )
+        log.debug(f"Signal message dispatched {latency:.3f}s after it was received")
+        metrics.SIGNAL_RECEIVE_LATENCY.observe(latency)
+        if metrics.SIGNAL_RECEIVE_LATENCY.count % 100 == 0:
+            log.info(metrics.SIGNAL_RECEIVE_LATENCY.summary())
+            log.info(filters.SIGNAL_FILTERS.summary())
+    try:
+        await messages.process_signal_message(blob, env.CLIENT)
+    except Exception:
+        log.error(f"Malformed message: {blob}")
+        metrics.ERRORS.labels(source="signal_message").inc()
+        raise
+
+
+async def _receive_from_daemon() -> None:
+    """Process messages pushed by the signal-cli daemon until it gives up."""
+    queue = signal_daemon.DAEMON.subscribe()
+    try:
+        while (blob := await queue.get()) is not None:
+            await process_signal_blob(blob)
+    finally:
+        signal_daemon.DAEMON.unsubscribe(queue)
+
+
+async def _receive_once(queue: "asyncio.Queue[Dict]") -> int:
+    """
+    Run one signal-cli `receive` of up to SIGNAL_TIMEOUT seconds, queueing
+    messages as they're read, and return its exit code.
+
+    signal-cli holds the account lock while it runs, so receiving takes its
+    turn on the same lock as the one-shot calls in the signal module. Anything
+    waiting on it, sends included, gets to run before the next receive.
+    """
+    async with signal._CLI_LOCK:
+        proc = await asyncio.create_subprocess_exec(
+            "signal-cli",
+            "-u",
+            str(env.BOT_NUMBER),
+            "--output=json",
+            "receive",
+            "-t",
+            str(env.SIGNAL_TIMEOUT),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            limit=signal_daemon.STREAM_LIMIT,
+        )
+        stderr_task = asyncio.create_task(signal_daemon.log_stderr(proc))
+        try:
+            assert proc.stdout is not None
+            while line := await proc.stdout.readline():
+                queue.put_nowait(ujson.loads(line))
+        finally:
+            if proc.returncode is None:
+                log.info("Killing signal-cli")
+                proc.kill()
+            returncode = await proc.wait()
+            await stderr_task
+    return returncode
+
+
+async def _process_signal_queue(queue: "asyncio.Queue[Dict]") -> None:
     while True:
-        log.debug("Trying to empty Twitter to Signal queue.")
-        while not env.TWITTER_TO_SIGNAL_QUEUE.empty():
-            try:
-                log.debug("Emptying Twitter to Signal queue.")
-                message = await env.TWITTER_TO_SIGNAL_QUEUE.get()
-                signal.send_message(message, env.LISTEN_CONTACT)
-                env.TWITTER_TO_SIGNAL_QUEUE.task_done()
-            except asyncio.QueueEmpty:
-                log.debug("Queue is empty breaking out of async loop.")
-            except Exception as err:
-                log.error("Exception occurred, halting queue to signal process")
-                log.exception(err)
-                signal.panic(err)
-                env.STATE.STOP_REQUESTED = True
-                raise
-        await asyncio.sleep(1)
+        await process_signal_blob(await queue.get())
+
+
+async def _receive_from_cli() -> None:
+    """
+    Run signal-cli `receive` over and over, processing messages as they're read
+    rather than once it exits. Processing happens separately from receiving,
+    since replies can't be sent while signal-cli is receiving. When it fails
+    right away it's restarted with an exponential delay.
+    """
+    queue: "asyncio.Queue[Dict]" = asyncio.Queue()
+    processor = asyncio.create_task(_process_signal_queue(queue))
+    failures = 0
+    try:
+        while not env.STATE.STOP_REQUESTED:
+            started = time.monotonic()
+            returncode = await _receive_once(queue)
+            if processor.done():
+                # Processing a message failed, raise that here
+                processor.result()
+            if returncode == 0:
+                failures = 0
+                continue
+            log.warning(f"signal-cli receive exited (error code {returncode})")
+
+            # Only back off when signal-cli keeps falling over right away
+            if time.monotonic() - started < signal_daemon.STARTUP_GRACE:
+                failures += 1
+            else:
+                failures = 0
+            delay = min(2**failures, signal_daemon.MAX_RESTART_DELAY)
+            log.info(f"Restarting signal-cli receive in {delay}s")
+            await asyncio.sleep(delay)
+    finally:
+        processor.cancel()
 
 
-################################################################################
-# Signal-to-Twitter
-################################################################################
 async def signal_to_twitter():
     """Run the signal-to-twitter loop."""
     try:
-        while not env.STATE.STOP_REQUESTED:
-            proc = await asyncio.create_subprocess_shell(
-                f"signal-cli -u {env.BOT_NUMBER} --output=json receive -t {env.SIGNAL_TIMEOUT}",
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            while line := await proc.stdout.readline():
-                line = line.decode("utf-8").rstrip()
-                blob = ujson.loads(line)
-                try:
-                    await messages.process_signal_message(blob, env.CLIENT)
-                except Exception:
-                    log.error(f"Malformed message: {blob}")
-                    raise
-            # Check to see if there's any content in stderr
-            error = (await proc.stderr.read()).decode()
-            for line in error.split("\n"):
-                if line.strip():
-                    log.warning(f"STDERR: {line}")
-            if proc.returncode != 0 and proc.returncode is not None:
-                log.warning(f"Something went wrong (error code {proc.returncode})")
+        if signal_daemon.DAEMON.available:
+            await _receive_from_daemon()
+        # Either the daemon is disabled or it couldn't be started
+        await _receive_from_cli()
     except Exception as err:
-        signal.panic(err)
+        metrics.ERRORS.labels(source="signal_to_twitter").inc()
+        await signal.panic(err)
         raise
-    finally:
-        log.info("Killing signal-cli")
-        try:
-            proc.kill()
-            log.info("signal-cli process killed")
-        except ProcessLookupError:
-            log.warning("Failed to kill process, moving on.")
-            pass
 
 
 ################################################################################
@@ -131,36 +206,93 @@ async def comradely_reminder() -> None:
             await asyncio.sleep(60 * 60)
     except Exception as err:
         log.exception(err)
-        signal.panic(err)
+        metrics.ERRORS.labels(source="comradely_reminder").inc()
+        await signal.panic(err)
         raise
 
 
 ################################################################################
 # SWAT Alert
 ################################################################################
-async def radio_monitor_alert_transport() -> None:
-    """Run the radio monitor alert loop."""
-    # Wait for system to initialize
-    await asyncio.sleep(15)
+async def _monitor_radio_feed(
+    feed: radio_monitor_alert.RadioFeed, session: aiohttp.ClientSession
+) -> None:
+    """
+    Poll one OpenMHz feed for good. A poll that fails is reported and retried
+    on the quiet schedule, so one feed's trouble doesn't stop the others.
+    """
+    scheduler = feed.scheduler
+    metrics.RADIO_POLL_INTERVAL.labels(
+        feed=feed.name
+    ).function = lambda: scheduler.interval
+    failing = False
     while True:
+        lag = await scheduler.wait()
+        metrics.RADIO_POLL_LAG.labels(feed=feed.name).observe(lag)
         try:
-            log.debug("Checking for monitored units' radio activity.")
-            if (
-                radio_monitor_alert_messages := await radio_monitor_alert.check_radio_calls()
-            ):
+            log.debug(f"Checking for monitored units' radio activity on {feed.name}.")
+            poll = await radio_monitor_alert.check_radio_calls(session, feed)
+            if poll.alerts:
                 log.info(
-                    "Radio activity found for monitored units sending alert to group."
+                    f"Radio activity found for monitored units on {feed.name} sending alert to group."
                 )
-                log.debug(f"Monitored units are {env.RADIO_MONITOR_UNITS}")
-                log.debug(f"Alert messages to be sent:\n{radio_monitor_alert_messages}")
-                for message, audio in radio_monitor_alert_messages:
-                    await messages.send_radio_monitor_alert(message, audio)
-            # Wait a minute to poll again
-            log.debug(
-                f"Sleeping for {env.RADIO_MONITOR_LOOKBACK}s before checking for monitored unit alerts again."
-            )
-            await asyncio.sleep(env.RADIO_MONITOR_LOOKBACK)
+                log.debug(f"Monitored units are {sorted(feed.units.units.values())}")
+                log.debug(f"Alert messages to be sent:\n{poll.alerts}")
+                await messages.send_radio_monitor_alerts(
+                    poll.alerts, session, feed.contact
+                )
+            poll.done()
         except Exception as err:
             log.exception(err)
-            signal.panic(err)
-            raise
+            metrics.ERRORS.labels(source="radio_monitor").inc()
+            # Only call home when a feed starts failing, not on every retry
+            if not failing:
+                await signal.panic(err)
+            failing = True
+            scheduler.done(active=False)
+            log.info(f"Retrying {feed.name} in {scheduler.interval:.0f}s.")
+            continue
+        if failing:
+            log.info(f"Radio monitoring on {feed.name} has recovered.")
+        failing = False
+        scheduler.done(active=bool(poll.alerts))
+        log.debug(
+            f"Checking for monitored unit alerts on {feed.name} again in {scheduler.interval:.0f}s."
+        )
+
+
+async def radio_monitor_alert_transport() -> None:
+    """Run the radio monitor alert loop for every OpenMHz feed."""
+    # Wait for system to initialize
+    await asyncio.sleep(15)
+    try:
+        feeds = radio_monitor_alert.load_feeds()
+    except (OSError, ValueError) as err:
+        log.error(f"Unable to load the radio feeds, not monitoring any: {err}")
+        metrics.ERRORS.labels(source="radio_monitor").inc()
+        await signal.panic(err)
+        return
+    log.info(
+        f"Monitoring {len(feeds)} OpenMHz feed(s): {', '.join(f.name for f in feeds)}"
+    )
+    async with radio_monitor_alert.create_session(len(feeds)) as session:
+        tasks = [
+            asyncio.create_task(_monitor_radio_feed(feed, session)) for feed in feeds
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Feeds handle their own errors, this is for the bot shutting down
+            for task in tasks:
+                task.cancel()
+
+
+################################################################################
+# Metrics
+################################################################################
+async def metrics_endpoint() -> None:
+    """Serve the Prometheus metrics endpoint, if it's been given a port."""
+    if not env.METRICS_PORT:
+        log.info("METRICS_PORT not set, not serving metrics")
+        return
+    await metrics.serve(env.METRICS_HOST, env.METRICS_PORT)
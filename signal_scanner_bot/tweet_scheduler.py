@@ -0,0 +1,266 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+
+from . import env, metrics
+from .dispatcher import Priority
+
+
+log = logging.getLogger(__name__)
+
+
+################################################################################
+# Constants
+################################################################################
+# Peony is slow to import and only needed once something talks to Twitter, so
+# its errors are looked up on first use, see env.lazy_resources
+def _rate_limit_errors() -> Tuple[type, ...]:
+    """Errors that mean we're over a posting limit, which only waiting out helps."""
+    from peony import exceptions
+
+    return (exceptions.HTTPTooManyRequests, exceptions.StatusLimit)
+
+
+def _transient_errors() -> Tuple[type, ...]:
+    """Errors that are worth trying again straight away (give or take a backoff)."""
+    from peony import exceptions
+
+    return (
+        exceptions.HTTPEnhanceYourCalm,
+        exceptions.HTTPInternalServerError,
+        exceptions.HTTPBadGateway,
+        exceptions.HTTPServiceUnavailable,
+        exceptions.HTTPGatewayTimeout,
+        aiohttp.ClientError,
+        asyncio.TimeoutError,
+    )
+
+
+RATE_LIMIT_ERRORS: Tuple[type, ...]
+TRANSIENT_ERRORS: Tuple[type, ...]
+__getattr__ = _load = env.lazy_resources(
+    globals(),
+    RATE_LIMIT_ERRORS=_rate_limit_errors,
+    TRANSIENT_ERRORS=_transient_errors,
+)
+
+
+################################################################################
+# Classes
+################################################################################
+class TweetThread(NamedTuple):
+    tweets: List[str]
+    client: Any
+    on_posted: Optional[Callable[[], None]]
+    chain: Optional[str] = None
+
+
+class _Chain(NamedTuple):
+    tweet_id: int
+    posted: float
+    length: int
+
+
+class TweetScheduler:
+    """
+    Owns all outbound tweets.
+
+    Threads are queued and posted one at a time, most urgent first, by a
+    worker of their own, so nothing that queues a tweet waits on Twitter.
+    Twitter's rate limit headers are tracked, and a thread that won't fit in
+    what's left of the current window waits for the next one rather than
+    being cut off halfway. Transient errors are retried up to `retries` times
+    with jittered exponential backoff, resuming a thread where it stopped.
+    Threads that still fail are handed to `on_error`, which holds up the
+    threads behind them until it returns.
+
+    Threads posted with the same `chain` within `reply_window` seconds of the
+    last one are posted as replies to it, up to `reply_max` tweets in a chain,
+    so a busy night reads as one conversation.
+    """
+
+    def __init__(
+        self,
+        on_error: Callable[[Exception], Awaitable[None]],
+        max_pending: int = 100,
+        retries: int = 5,
+        retry_base: float = 1,
+        retry_max: float = 60,
+        rate_limit_wait: float = 900,
+        reply_window: float = 0,
+        reply_max: int = 25,
+    ):
+        self.on_error = on_error
+        self.max_pending = max_pending
+        self.retries = retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.rate_limit_wait = rate_limit_wait
+        self.reply_window = reply_window
+        self.reply_max = reply_max
+        self.posted = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.rate_limited = 0
+        # From the last response's headers, None when unknown
+        self.remaining: Optional[int] = None
+        self.reset: Optional[float] = None
+        self._queue: List[Tuple[int, int, TweetThread]] = []
+        self._seq = itertools.count()
+        self._chains: Dict[str, _Chain] = {}
+        self._changed = asyncio.Event()
+        self._busy = False
+        self._worker: Optional[asyncio.Task] = None
+
+    def qsize(self) -> int:
+        """Return how many threads are waiting to be posted."""
+        return len(self._queue)
+
+    def post(
+        self,
+        tweets: List[str],
+        client,
+        priority: Priority = Priority.NORMAL,
+        on_posted: Optional[Callable[[], None]] = None,
+        chain: Optional[str] = None,
+    ) -> bool:
+        """
+        Queue a thread for posting, returning whether there was room for it.
+        `on_posted` is called once the whole thread is up.
+        """
+        self._ensure_worker()
+        if len(self._queue) >= self.max_pending:
+            self.dropped += 1
+            log.warning("Tweet queue full, dropping new tweet")
+            return False
+        heapq.heappush(
+            self._queue,
+            (priority, next(self._seq), TweetThread(tweets, client, on_posted, chain)),
+        )
+        self._changed.set()
+        return True
+
+    async def drain(self) -> None:
+        """Wait until every queued thread has been posted (or has failed)."""
+        while self._queue or self._busy:
+            await asyncio.sleep(0.01)
+
+    async def run(self) -> None:
+        """Post queued threads in order."""
+        while True:
+            if not self._queue:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+            _, _, thread = heapq.heappop(self._queue)
+            self._busy = True
+            try:
+                with metrics.TWEET_SEND_DURATION.time():
+                    await self._post_thread(thread)
+            except Exception as err:
+                self.failed += 1
+                await self.on_error(err)
+            else:
+                self.posted += 1
+                if thread.on_posted is not None:
+                    thread.on_posted()
+            finally:
+                self._busy = False
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and not self._worker.done():
+            return
+        if self._worker is not None and not self._worker.cancelled():
+            log.error(f"Tweet scheduler stopped: {self._worker.exception()!r}")
+        self._worker = asyncio.create_task(self.run())
+
+    async def _post_thread(self, thread: TweetThread) -> None:
+        await self._wait_for_capacity(len(thread.tweets))
+        tweet_id, length = None, 0
+        if (
+            thread.chain is not None
+            and (chain := self._chains.get(thread.chain)) is not None
+            and time.monotonic() - chain.posted <= self.reply_window
+            and chain.length + len(thread.tweets) <= self.reply_max
+        ):
+            tweet_id, length = chain.tweet_id, chain.length
+        for tweet in thread.tweets:
+            # Every tweet after the first is a reply to the one before it
+            params = (
+                {}
+                if tweet_id is None
+                else {
+                    "in_reply_to_status_id": tweet_id,
+                    "auto_populate_reply_metadata": True,
+                }
+            )
+            status = await self._post_tweet(thread.client, tweet, params)
+            tweet_id = status.id
+            length += 1
+        if thread.chain is not None and tweet_id is not None:
+            self._chains[thread.chain] = _Chain(tweet_id, time.monotonic(), length)
+
+    async def _post_tweet(self, client, tweet: str, params: dict):
+        attempt = 0
+        while True:
+            try:
+                status = await client.api.statuses.update.post(status=tweet, **params)
+            except _load("RATE_LIMIT_ERRORS") as err:
+                self.rate_limited += 1
+                self._note_rate_limit(getattr(err.response, "headers", None))
+                # Without a usable reset time, fall back to a typical window
+                if self.reset is None or self.reset <= time.time():
+                    self.reset = time.time() + self.rate_limit_wait
+                self.remaining = 0
+                log.warning(f"Twitter rate limit hit: {err}")
+                await self._wait_for_capacity(1)
+            except _load("TRANSIENT_ERRORS") as err:
+                if attempt >= self.retries:
+                    raise
+                # Full jitter, so retries don't all land at once
+                delay = random.uniform(
+                    0, min(self.retry_max, self.retry_base * 2**attempt)
+                )
+                attempt += 1
+                self.retried += 1
+                log.warning(
+                    f"Twitter error, retrying in {delay:.1f}s"
+                    f" ({attempt}/{self.retries}): {err!r}"
+                )
+                await asyncio.sleep(delay)
+            else:
+                self._note_rate_limit(getattr(status, "headers", None))
+                return status
+
+    def _note_rate_limit(self, headers) -> None:
+        if not headers:
+            return
+        headers = {name.lower(): value for name, value in headers.items()}
+        try:
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset = float(headers["x-rate-limit-reset"])
+        except (KeyError, ValueError):
+            return
+        self.remaining, self.reset = remaining, reset
+
+    async def _wait_for_capacity(self, needed: int) -> None:
+        if self.remaining is None or self.reset is None or self.remaining >= needed:
+            if self.remaining is not None:
+                self.remaining -= needed
+            return
+        delay = self.reset - time.time()
+        if delay > 0:
+            log.warning(
+                f"{self.remaining} tweet(s) left in the rate limit window, waiting"
+                f" {delay:.0f}s for it to reset ({len(self._queue)} thread(s) queued)"
+            )
+            await asyncio.sleep(delay)
+        # Don't know what the new window looks like until the next response
+        self.remaining = self.reset = None
@@ -1,10 +1,16 @@
+import asyncio
 import logging
+import re
 from textwrap import dedent
-from typing import List
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple, Optional
 
-import peony
+from . import env, metrics, signal
+from .dispatcher import Priority
+from .tweet_scheduler import TweetScheduler
 
-from . import env, signal
+
+if TYPE_CHECKING:
+    import peony
 
 
 log = logging.getLogger(__name__)
@@ -17,57 +23,158 @@ log = logging.getLogger(__name__)
 # TWEET_THREAD_MAX sets the maximum tweet thrad length
 # TWEET_PADDING calculates the padding necessary based on TWEET_THREAD_MAX. This
 # is done by converting the int to str, getting the number of digits,
-# multiplying the digits by two, and adding
+# multiplying the digits by two, and adding. It's worked out on first use, see
+# _tweet_padding
 ################################################################################
 TWEET_MAX_SIZE = 280
-TWEET_PADDING = 2 * len(str(env.TWEET_THREAD_MAX)) + 2
+TWEET_PADDING: int
+TWEET_CONTINUED = " ..."
+
+################################################################################
+# Twitter's weighted character counting
+################################################################################
+# Twitter counts every URL as TWEET_URL_LENGTH characters no matter how long it
+# actually is. Characters in TWEET_LIGHT_RANGES (mostly Latin script and
+# punctuation) count as 1 and everything else counts as 2, see
+# https://developer.twitter.com/en/docs/counting-characters
+################################################################################
+TWEET_URL_LENGTH = 23
+URL_PATTERN = re.compile(r"https?://\S+", re.IGNORECASE)
+TWEET_LIGHT_RANGES = (
+    (0x0000, 0x10FF),
+    (0x2000, 0x200D),
+    (0x2010, 0x201F),
+    (0x2032, 0x2037),
+)
+ZERO_WIDTH_JOINER = 0x200D
+TWEET_EMOJI_MODIFIERS = frozenset([ZERO_WIDTH_JOINER, 0xFE0F, *range(0x1F3FB, 0x1F400)])
 
 
 ################################################################################
 # Private functions
 ################################################################################
+def _char_weight(code: int) -> int:
+    for start, end in TWEET_LIGHT_RANGES:
+        if start <= code <= end:
+            return 1
+    return 2
+
+
+def _weighted_text_length(text: str) -> int:
+    """Weighted length of text that doesn't contain any URLs."""
+    # Fast path for the usual case of plain Latin text
+    if text.isascii() or max(map(ord, text)) <= TWEET_LIGHT_RANGES[0][1]:
+        return len(text)
+    length = 0
+    joined = False
+    for char in text:
+        code = ord(char)
+        # Emoji modifiers and anything glued onto an emoji with a zero width
+        # joiner are part of the emoji they follow, which only counts once
+        if code in TWEET_EMOJI_MODIFIERS or (joined and _is_emoji(code)):
+            joined = code == ZERO_WIDTH_JOINER
+            continue
+        joined = False
+        length += _char_weight(code)
+    return length
+
+
+def _is_emoji(code: int) -> bool:
+    return code >= 0x1F000 or 0x2600 <= code <= 0x27BF
+
+
+def _weighted_length(text: str) -> int:
+    """
+    Length of text the way Twitter counts it: URLs are always
+    TWEET_URL_LENGTH, most Latin characters count as 1 and everything else
+    (CJK, emoji, etc.) counts as 2.
+    """
+    if "://" not in text:
+        return _weighted_text_length(text)
+    length = 0
+    position = 0
+    for match in URL_PATTERN.finditer(text):
+        length += _weighted_text_length(text[position : match.start()])
+        length += TWEET_URL_LENGTH
+        position = match.end()
+    return length + _weighted_text_length(text[position:])
+
+
+def _split_word(word: str, first_limit: int, limit: int) -> List[str]:
+    """
+    Break up a single word that's too long to fit in one tweet. The first
+    piece fills whatever room is left in the current tweet. URLs in the word
+    are kept whole and weighted as TWEET_URL_LENGTH, like _weighted_length.
+    """
+    urls = {match.start(): match.end() for match in URL_PATTERN.finditer(word)}
+    pieces: List[str] = []
+    start = 0
+    length = 0
+    current_limit = first_limit
+    index = 0
+    while index < len(word):
+        if index in urls:
+            end, weight = urls[index], TWEET_URL_LENGTH
+        else:
+            end, weight = index + 1, _char_weight(ord(word[index]))
+        if length + weight > current_limit:
+            pieces.append(word[start:index])
+            start, length, current_limit = index, 0, limit
+        length += weight
+        index = end
+    pieces.append(word[start:])
+    return pieces
+
+
 def _create_tweet_thread(message: str, hashtags: str) -> List[str]:
     """
     Take in a string of variable length and build a list of unformatted tweet
     messages of the proper length.
     """
-    # Split tweet into word list, create empty list to store serialized tweets
-    # index to track last position
-    tweet_word_list = message.split(" ")
+    # Every tweet but the last gets an ellipsis, and every tweet gets its
+    # number in the thread (which TWEET_PADDING accounts for). The first
+    # tweet also has to leave room for the hashtags.
+    limit = TWEET_MAX_SIZE - _load("TWEET_PADDING") - _weighted_length(TWEET_CONTINUED)
+    first_limit = limit - _weighted_length(_format_tweet_message([""], hashtags)[0])
+
     tweet_list: List[str] = []
-    base_index = 0
-
-    # For loop through word list and enumerate the index because we'll need
-    # it but don't actually care about the list value so send to null
-    for index in range(len(tweet_word_list)):
-
-        # Check if it is the first tweet, which will contain hashtags and
-        # timestamp. If not first it will only contain the text plus ellipses
-        # and for the final one drop the ellipses
-        if len(tweet_list) == 0:
-            sub_tweet = " ".join(tweet_word_list[base_index:index]) + " ..." + hashtags
-        elif index < len(tweet_word_list):
-            sub_tweet = " ".join(tweet_word_list[base_index:index]) + " ..."
-        elif index == len(tweet_word_list):
-            sub_tweet = " ".join(tweet_word_list[base_index:index])
-
-        # When length of tweet reaches >280 chars save to list and set
-        # base index for next tweet
-        # noinspection PyUnboundLocalVariable
-        if len(sub_tweet) > TWEET_MAX_SIZE - TWEET_PADDING:
-            last_index = index - 1
-            tweet_list.append(" ".join(tweet_word_list[base_index:last_index]) + " ...")
-            base_index = index - 1
+    current: List[str] = []
+    length = 0
+    for word in message.split(" "):
+        word_length = _weighted_length(word)
+        current_limit = limit if tweet_list else first_limit
+        space = 1 if current else 0
+        if word_length > current_limit:
+            # The word won't fit in a tweet on its own, so split it up,
+            # filling out the current tweet first
+            room = current_limit - length - space
+            first, *pieces = _split_word(word, max(room, 0), limit)
+            if first:
+                current.append(first)
+            if not pieces:
+                # Splitting it up the way Twitter counts it, it fit after all
+                length += space + _weighted_length(first)
+                continue
+            tweet_list.append(" ".join(current) + TWEET_CONTINUED)
+            for piece in pieces[:-1]:
+                tweet_list.append(piece + TWEET_CONTINUED)
+            current, length = [pieces[-1]], _weighted_length(pieces[-1])
+        elif length + space + word_length > current_limit:
+            # Start a new tweet when the word (plus a space) won't fit
+            tweet_list.append(" ".join(current) + TWEET_CONTINUED)
+            current, length = [word], word_length
+        else:
+            current.append(word)
+            length += space + word_length
 
     # Save the last tweet
-    tweet_list.append(" ".join(tweet_word_list[base_index:]))
-
-    # Append the tweet number / tweet thread length to end of tweet. Again
-    # don't actually care about the list value so sending to null.
-    for index in range(len(tweet_list)):
-        tweet_list[index] += f" {index + 1}/{len(tweet_list)}"
+    tweet_list.append(" ".join(current))
 
-    return tweet_list
+    # Append the tweet number / tweet thread length to end of tweet.
+    return [
+        f"{sub_tweet} {index}/{len(tweet_list)}"
+        for index, sub_tweet in enumerate(tweet_list, start=1)
+    ]
 
 
 def _build_hashtags(hashtags: List[str]) -> str:
@@ -105,42 +212,39 @@ def _format_tweet_message(tweet_list: List[str], hashtags: str) -> List[str]:
     return return_list
 
 
-async def _send_tweet_thread(tweet_list: List[str], client: peony.PeonyClient) -> None:
+async def _tweet_failed(err: Exception) -> None:
     """
-    Take a list of tweet messages and send them as a twitter thread,
-    or, if there is only one object in the list, a single tweet.
+    Report a tweet thread that couldn't be posted to the admin Signal group.
+    The report is only queued, as the scheduler waits on this before posting
+    anything else.
     """
-    tweet_id = None
-    for tweet in tweet_list:
-        # If first tweet send without reply to tweet ID parameter, if part
-        # of a thread send reply using ID of last tweet sent.
-        if tweet_id is None:
-            status_obj = await client.api.statuses.update.post(status=tweet)
-            tweet_id = status_obj.id
-        else:
-            status_obj = await client.api.statuses.update.post(
-                status=tweet,
-                in_reply_to_status_id=tweet_id,
-                auto_populate_reply_metadata=True,
-            )
-            tweet_id = status_obj.id
+    metrics.ERRORS.labels(source="twitter_send").inc()
+    log.warning(f"There was an unexpected error returned from the Twitter API:\n{err}")
+    await signal.panic(err, wait=False)
 
 
-################################################################################
-# Public functions
-################################################################################
-async def send_tweet(tweet: str, client: peony.PeonyClient) -> None:
-    """Build and send tweets from incoming message streams."""
-    # Builds the hashtags that will be sent along with the tweet, if any
-    hashtags = _build_hashtags(env.SEND_HASHTAGS)
-
+def _split_tweet(tweet: str, hashtag_text: str) -> List[str]:
+    """
+    Split a message into the tweets needed to send it, a single tweet if it's
+    short enough.
+    """
     # Check if tweet is longer than 280 minus the defined amount of padding for
     # a tweet. Creates list of tweets to send in a thread or single tweet.
-    if len(tweet + hashtags) >= TWEET_MAX_SIZE - TWEET_PADDING:
-        tweet_list = _create_tweet_thread(tweet, hashtags)
-    else:
-        tweet_list = [tweet]
+    limit = TWEET_MAX_SIZE - _load("TWEET_PADDING")
+    if _weighted_length(tweet + hashtag_text) >= limit:
+        return _create_tweet_thread(tweet, hashtag_text)
+    return [tweet]
+
 
+def _queue_tweet(
+    tweet: str,
+    hashtag_text: str,
+    client: "peony.PeonyClient",
+    priority: Priority,
+    on_posted: Optional[Callable[[], None]],
+    chain: Optional[str] = None,
+) -> None:
+    tweet_list = _split_tweet(tweet, hashtag_text)
     if len(tweet_list) > env.TWEET_THREAD_MAX:
         log.error(
             f"""
@@ -150,13 +254,166 @@ async def send_tweet(tweet: str, client: peony.PeonyClient) -> None:
             """
         )
     else:
-        # Tries to send the tweet thread and sends a panic message to the admin
-        # Signal group if there is an error.
-        try:
-            formatted_tweet_list = _format_tweet_message(tweet_list, hashtags)
-            await _send_tweet_thread(formatted_tweet_list, client)
-        except Exception as err:
-            log.warning(
-                f"There was an unexpected error returned from the Twitter API:\n{err}"
+        # Failures are reported to the admin Signal group by _tweet_failed
+        _load("SCHEDULER").post(
+            _format_tweet_message(tweet_list, hashtag_text),
+            client,
+            priority=priority,
+            on_posted=on_posted,
+            chain=chain,
+        )
+
+
+################################################################################
+# Coalescing
+################################################################################
+class _Burst(NamedTuple):
+    client: "peony.PeonyClient"
+    priority: Priority
+    messages: List[str]
+    callbacks: List[Callable[[], None]]
+    timer: asyncio.TimerHandle
+
+
+class TweetCoalescer:
+    """
+    Holds on to tweets for `window` seconds after the first of a burst (or
+    until `max_messages` have arrived), then queues them as a single thread,
+    one message per line. Tweets with different hashtags are kept apart since
+    a thread only carries one set, and a burst too long for TWEET_THREAD_MAX
+    is split over as few threads as it takes.
+    """
+
+    def __init__(self, window: float = 0, max_messages: int = 1):
+        self.window = window
+        self.max_messages = max_messages
+        self._bursts: Dict[str, _Burst] = {}
+
+    def add(
+        self,
+        tweet: str,
+        hashtag_text: str,
+        client: "peony.PeonyClient",
+        priority: Priority,
+        on_posted: Optional[Callable[[], None]],
+    ) -> None:
+        if (burst := self._bursts.get(hashtag_text)) is None:
+            timer = asyncio.get_running_loop().call_later(
+                self.window, self.flush, hashtag_text
             )
-            signal.panic(err)
+            burst = self._bursts[hashtag_text] = _Burst(client, priority, [], [], timer)
+        burst.messages.append(tweet)
+        if on_posted is not None:
+            burst.callbacks.append(on_posted)
+        if len(burst.messages) >= self.max_messages:
+            self.flush(hashtag_text)
+
+    def flush(self, hashtag_text: str) -> None:
+        """Queue the burst of tweets with the given hashtags."""
+        if (burst := self._bursts.pop(hashtag_text, None)) is None:
+            return
+        burst.timer.cancel()
+        groups: List[List[str]] = []
+        for message in burst.messages:
+            merged = "\n".join(groups[-1] + [message]) if groups else ""
+            if groups and (
+                len(_split_tweet(merged, hashtag_text)) <= env.TWEET_THREAD_MAX
+            ):
+                groups[-1].append(message)
+            else:
+                groups.append([message])
+        if len(burst.messages) > 1:
+            log.info(f"Coalesced {len(burst.messages)} tweets into {len(groups)}")
+
+        callbacks = burst.callbacks
+
+        def posted() -> None:
+            for callback in callbacks:
+                callback()
+
+        for index, group in enumerate(groups):
+            _queue_tweet(
+                "\n".join(group),
+                hashtag_text,
+                burst.client,
+                burst.priority,
+                # Only once the whole burst is up
+                posted if index == len(groups) - 1 else None,
+                chain=hashtag_text,
+            )
+
+    def flush_all(self) -> None:
+        """Queue every burst still waiting for its window to close."""
+        for hashtag_text in list(self._bursts):
+            self.flush(hashtag_text)
+
+
+################################################################################
+# Outbound queue
+################################################################################
+def _create_scheduler() -> TweetScheduler:
+    metrics.TWEET_QUEUE_DEPTH.function = lambda: _load("SCHEDULER").qsize()
+    metrics.TWEETS_POSTED.function = lambda: _load("SCHEDULER").posted
+    metrics.TWEETS_FAILED.function = lambda: _load("SCHEDULER").failed
+    metrics.TWEETS_DROPPED.function = lambda: _load("SCHEDULER").dropped
+    metrics.TWEET_RETRIES.function = lambda: _load("SCHEDULER").retried
+    metrics.TWEET_RATE_LIMITED.function = lambda: _load("SCHEDULER").rate_limited
+    return TweetScheduler(
+        _tweet_failed,
+        max_pending=env.TWEET_QUEUE_SIZE,
+        retries=env.TWEET_RETRIES,
+        rate_limit_wait=env.TWEET_RATE_LIMIT_WAIT,
+        reply_window=env.TWEET_REPLY_WINDOW,
+        reply_max=env.TWEET_REPLY_MAX,
+    )
+
+
+def _create_coalescer() -> TweetCoalescer:
+    return TweetCoalescer(env.TWEET_COALESCE_WINDOW, env.TWEET_COALESCE_MAX)
+
+
+def _tweet_padding() -> int:
+    return 2 * len(str(env.TWEET_THREAD_MAX)) + 2
+
+
+# All outbound tweets go through these. Created on first use, see
+# env.lazy_resources
+SCHEDULER: TweetScheduler
+COALESCER: TweetCoalescer
+__getattr__ = _load = env.lazy_resources(
+    globals(),
+    SCHEDULER=_create_scheduler,
+    COALESCER=_create_coalescer,
+    TWEET_PADDING=_tweet_padding,
+)
+
+
+################################################################################
+# Public functions
+################################################################################
+def send_tweet(
+    tweet: str,
+    client: "peony.PeonyClient",
+    hashtags: Optional[List[str]] = None,
+    priority: Priority = Priority.NORMAL,
+    on_posted: Optional[Callable[[], None]] = None,
+    coalesce: bool = False,
+) -> None:
+    """
+    Build tweets from incoming message streams, tagged with the given hashtags
+    or SEND_HASHTAGS by default, and queue them for posting. See
+    TweetScheduler.post for what the extra arguments do. With `coalesce`,
+    bursts of tweets are merged into threads (see TweetCoalescer) and chained
+    onto the last one as replies when TWEET_REPLY_WINDOW is set.
+    """
+    # Builds the hashtags that will be sent along with the tweet, if any
+    hashtag_text = _build_hashtags(env.SEND_HASHTAGS if hashtags is None else hashtags)
+
+    if not coalesce:
+        _queue_tweet(tweet, hashtag_text, client, priority, on_posted)
+    elif (coalescer := _load("COALESCER")).window > 0 and coalescer.max_messages > 1:
+        coalescer.add(tweet, hashtag_text, client, priority, on_posted)
+    else:
+        _queue_tweet(
+            tweet, hashtag_text, client, priority, on_posted, chain=hashtag_text
+        )
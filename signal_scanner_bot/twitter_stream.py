@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from . import metrics
+
+
+log = logging.getLogger(__name__)
+
+
+################################################################################
+# Constants
+################################################################################
+# A stream that dies sooner than this after being opened counts as failing to
+# connect, which is backed off exponentially up to MAX_RECONNECT_DELAY
+STARTUP_GRACE = 30
+MAX_RECONNECT_DELAY = 320
+# How many tweet IDs are remembered for spotting duplicates
+SEEN_MAX = 1000
+# Most tweets the timeline API returns at once
+CATCH_UP_COUNT = 200
+
+
+################################################################################
+# Exceptions
+################################################################################
+class TwitterStreamStalled(Exception):
+    """Raised when catching up finds tweets the stream should have delivered."""
+
+
+################################################################################
+# Classes
+################################################################################
+class TwitterStream:
+    """
+    Supervises the Twitter filter stream following `follow`, handing every
+    tweet to `handle` once (deduplicated by ID).
+
+    Peony reconnects a dropped stream on its own, and anything it gives up
+    on is reopened here with an exponential delay. Whenever the stream comes
+    back, and whenever it has been quiet for `stall_timeout` seconds, the
+    followed users' timelines are checked for tweets posted since the last
+    one seen. If that turns up anything the stream missed while it claimed
+    to be connected, it's taken to be stalled and reopened.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        follow: Iterable[str],
+        handle: Callable[[Dict], Awaitable[None]],
+        stall_timeout: float = 900,
+    ):
+        self.client = client
+        self.follow = sorted(follow)
+        self.handle = handle
+        self.stall_timeout = stall_timeout
+        self.since_id: Optional[int] = None
+        self._seen: Set[int] = set()
+        self._seen_order: Deque[int] = deque()
+        self._disconnected: Optional[float] = None
+
+    async def run(self) -> None:
+        """Consume the stream until cancelled."""
+        failures = 0
+        while True:
+            started = time.monotonic()
+            try:
+                await self._consume()
+                log.warning("Twitter stream ended")
+            except TwitterStreamStalled as err:
+                log.warning(f"Twitter stream stalled: {err}")
+                metrics.TWITTER_STREAM_STALLS.inc()
+            except Exception as err:
+                log.warning(f"Twitter stream failed: {err!r}")
+                metrics.ERRORS.labels(source="twitter_stream").inc()
+            if self._disconnected is None:
+                self._disconnected = time.monotonic()
+
+            # Only back off when the stream keeps falling over right away
+            if time.monotonic() - started < STARTUP_GRACE:
+                failures += 1
+            else:
+                failures = 0
+            delay = min(2**failures, MAX_RECONNECT_DELAY)
+            log.info(f"Reconnecting to the Twitter stream in {delay}s")
+            await asyncio.sleep(delay)
+
+    async def catch_up(self) -> int:
+        """
+        Handle tweets from the followed users posted since the last one seen,
+        oldest first, returning how many the stream had missed.
+        """
+        if self.since_id is None:
+            # Nothing seen yet, so nothing to have missed
+            return 0
+        tweets: List[Dict] = []
+        for user_id in self.follow:
+            try:
+                timeline = await self.client.api.statuses.user_timeline.get(
+                    user_id=user_id, since_id=self.since_id, count=CATCH_UP_COUNT
+                )
+            except Exception as err:
+                log.warning(f"Unable to catch up on tweets from {user_id}: {err!r}")
+                metrics.ERRORS.labels(source="twitter_catch_up").inc()
+                continue
+            tweets.extend(timeline)
+
+        missed = 0
+        for tweet in sorted(tweets, key=lambda tweet: int(tweet["id"])):
+            if await self._handle_tweet(tweet):
+                missed += 1
+        if missed:
+            log.warning(f"Caught up on {missed} tweet(s) the stream missed")
+            metrics.TWITTER_STREAM_GAPS.inc()
+            metrics.TWITTER_STREAM_MISSED.inc(missed)
+        return missed
+
+    async def _consume(self) -> None:
+        stream_ctx = self.client.stream.statuses.filter.post(
+            follow=",".join(self.follow)
+        )
+        async with stream_ctx as stream:
+            items = stream.__aiter__()
+            # Kept across quiet spells rather than cancelled, so a partly read
+            # line is never lost
+            next_item: Optional[asyncio.Task] = None
+            try:
+                while True:
+                    if next_item is None:
+                        next_item = asyncio.create_task(_next(items))
+                    done, _ = await asyncio.wait(
+                        {next_item}, timeout=self.stall_timeout
+                    )
+                    if not done:
+                        if await self.catch_up():
+                            raise TwitterStreamStalled(
+                                f"no tweets for {self.stall_timeout}s, but some were posted"
+                            )
+                        continue
+                    data = next_item.result()
+                    next_item = None
+                    if data is None:
+                        return
+                    await self._handle_event(data)
+            finally:
+                if next_item is not None:
+                    next_item.cancel()
+
+    async def _handle_event(self, data: Dict) -> None:
+        # Only imported once there's a stream, as Peony is slow to import
+        from peony import events
+
+        if events.on_tweet(data):
+            await self._handle_tweet(data)
+        elif events.on_reconnect(data):
+            log.warning(
+                f"Twitter stream disconnected, Peony is reconnecting in"
+                f" {data.get('reconnecting_in')}s: {data.get('error')!r}"
+            )
+            if self._disconnected is None:
+                self._disconnected = time.monotonic()
+        elif events.on_connect(data) or events.on_restart(data):
+            log.info("Connected to the stream")
+            if self._disconnected is not None:
+                gap = time.monotonic() - self._disconnected
+                self._disconnected = None
+                log.info(f"Twitter stream back after {gap:.1f}s")
+                metrics.TWITTER_STREAM_RECONNECTS.inc()
+                metrics.TWITTER_STREAM_RECONNECT_LATENCY.observe(gap)
+            await self.catch_up()
+
+    async def _handle_tweet(self, tweet: Dict) -> bool:
+        """Handle a tweet unless it's been seen before, returning whether it was new."""
+        tweet_id = int(tweet["id"])
+        if tweet_id in self._seen:
+            metrics.TWITTER_STREAM_DUPLICATES.inc()
+            return False
+        self._seen.add(tweet_id)
+        self._seen_order.append(tweet_id)
+        if len(self._seen_order) > SEEN_MAX:
+            self._seen.discard(self._seen_order.popleft())
+        if self.since_id is None or tweet_id > self.since_id:
+            self.since_id = tweet_id
+        await self.handle(tweet)
+        return True
+
+
+################################################################################
+# Helper Functions
+################################################################################
+async def _next(items) -> Optional[Dict]:
+    try:
+        return await items.__anext__()
+    except StopAsyncIteration:
+        return None
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from signal_scanner_bot import env
+
+
+def run(coro, timeout: float = 20):
+    """Run a test's coroutine, failing it rather than hanging if it gets stuck."""
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+
+@pytest.fixture
+def signal_cli(tmp_path, monkeypatch):
+    """Put the fake signal-cli on the PATH for one-shot calls."""
+    script = tmp_path / "signal-cli"
+    fake = Path(__file__).parent / "fake_signal_cli.py"
+    # Run straight from this interpreter, with no shell in between
+    script.write_text(
+        f"#!{sys.executable}\n"
+        f"import runpy\nrunpy.run_path({str(fake)!r}, run_name='__main__')\n"
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_SIGNAL_CLI_LOCK", str(tmp_path / "account.lock"))
+    # Set straight in the module, as the real setting has no default to fall
+    # back on when monkeypatch reads it first
+    monkeypatch.setitem(vars(env), "BOT_NUMBER", "+15555550100")
+    return script
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+A stand-in for signal-cli that speaks just enough JSON-RPC for the tests and
+benchmarks.
+
+Usage: fake_signal_cli.py jsonRpc [--crash-after N] [--untrusted N]
+           [--receive-count N --receive-rate PER_SECOND --receive-message TEXT]
+       fake_signal_cli.py -u NUMBER [--output=json] receive -t SECONDS
+       fake_signal_cli.py -u NUMBER send -m MESSAGE RECIPIENT
+
+With --receive-count, N incoming messages are pushed at the given rate instead
+of the single "hello". Each is TEXT followed by its index and the (float)
+epoch time it was pushed at, so the receiving end can work out latency.
+
+The daemon fails sends of the message "fail" and never replies to sends of
+"hang".
+
+The one-shot `receive` pushes a single "hello" and then waits out its timeout
+(forever for -1), and `send` succeeds unless the message is "fail".
+
+Like the real thing, the daemon and one-shot calls hold the account's lock
+while they run, here a lock on $FAKE_SIGNAL_CLI_LOCK.
+
+With --untrusted, `listIdentities` lists N untrusted identities (and one
+trusted one) which `trust` trusts given the right safety number, which for
++1555000NNNN is NNNN repeated. Sends to them fail until they're trusted.
+"""
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+
+
+_WRITE_LOCK = threading.Lock()
+# Keeps the account's lock file open, see _lock_account
+_HELD = []
+
+
+def _write(blob):
+    with _WRITE_LOCK:
+        sys.stdout.write(json.dumps(blob) + "\n")
+        sys.stdout.flush()
+
+
+def _envelope(message):
+    now = time.time()
+    return {
+        "envelope": {
+            "source": "+15555550102",
+            "timestamp": int(now * 1000),
+            "serverReceivedTimestamp": int(now * 1000),
+            "dataMessage": {
+                "timestamp": int(now * 1000),
+                "message": message,
+            },
+        },
+        "account": "+15555550100",
+    }
+
+
+def _receive(message):
+    _write({"jsonrpc": "2.0", "method": "receive", "params": _envelope(message)})
+
+
+def _receive_many(count, rate, message):
+    started = time.monotonic()
+    for index in range(count):
+        # Keep to the schedule rather than sleeping a fixed amount each time
+        delay = started + index / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        _receive(f"{message} {index} {time.time():.6f}")
+
+
+def _identities(untrusted):
+    identities = {
+        f"+1555000{index:04}": {
+            "number": f"+1555000{index:04}",
+            "safetyNumber": f"{index:04} " * 15,
+            "trustLevel": "UNTRUSTED",
+        }
+        for index in range(untrusted)
+    }
+    identities["+15555550101"] = {
+        "number": "+15555550101",
+        "safetyNumber": "1234 " * 15,
+        "trustLevel": "TRUSTED_VERIFIED",
+    }
+    return identities
+
+
+def _lock_account():
+    """Wait for and hold the account's lock until the process exits."""
+    lock_path = os.environ.get("FAKE_SIGNAL_CLI_LOCK")
+    if lock_path:
+        lock = open(lock_path, "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _HELD.append(lock)
+
+
+def one_shot(args):
+    _lock_account()
+    if "receive" in args:
+        _write(_envelope("hello"))
+        timeout = _option(args, "-t", float, 5)
+        time.sleep(timeout if timeout >= 0 else 1e9)
+    elif "send" in args:
+        if _option(args, "-m", str) == "fail":
+            sys.stderr.write("Failed to send message\n")
+            sys.exit(1)
+        _write({"timestamp": 1})
+
+
+def _result(request, result=None, error=None):
+    if error is not None:
+        return {"jsonrpc": "2.0", "id": request["id"], "error": error}
+    return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+
+def _untrusted(request, numbers):
+    results = [
+        {"recipientAddress": {"number": number}, "type": "IDENTITY_FAILURE"}
+        for number in numbers
+    ]
+    return _result(
+        request,
+        error={
+            "code": -4,
+            "message": "Failed to send message due to untrusted identities",
+            "data": {"response": {"results": results}},
+        },
+    )
+
+
+def _trust(request, identities):
+    params = request.get("params", {})
+    identity = identities.get(params.get("recipient"))
+    if identity is None:
+        return _result(request, error={"code": -1, "message": "Unknown recipient"})
+    if params.get("verifiedSafetyNumber") != identity["safetyNumber"].replace(" ", ""):
+        return _result(
+            request, error={"code": -1, "message": "Safety number doesn't match"}
+        )
+    identity["trustLevel"] = "TRUSTED_VERIFIED"
+    return _result(request, {})
+
+
+def json_rpc(
+    crash_after=None, receive_count=None, receive_rate=100.0, message="", untrusted=0
+):
+    _lock_account()
+    identities = _identities(untrusted)
+    if receive_count is None:
+        # Push one incoming message as soon as the daemon "connects"
+        _receive("hello")
+    else:
+        threading.Thread(
+            target=_receive_many,
+            args=(receive_count, receive_rate, message),
+            daemon=True,
+        ).start()
+    handled = 0
+    for line in sys.stdin:
+        request = json.loads(line)
+        if request["method"] == "send":
+            params = request.get("params", {})
+            untrusted = [
+                number
+                for number in params.get("recipient", [])
+                if identities.get(number, {}).get("trustLevel") == "UNTRUSTED"
+            ]
+            if untrusted:
+                _write(_untrusted(request, untrusted))
+            elif params.get("message") == "hang":
+                # Never reply, like a wedged daemon
+                pass
+            elif params.get("message") == "fail":
+                _write(
+                    {
+                        "jsonrpc": "2.0",
+                        "id": request["id"],
+                        "error": {"code": -1, "message": "Failed to send message"},
+                    }
+                )
+            else:
+                _write(
+                    {
+                        "jsonrpc": "2.0",
+                        "id": request["id"],
+                        "result": {"timestamp": 1, "params": params},
+                    }
+                )
+        elif request["method"] == "listIdentities":
+            number = request.get("params", {}).get("number")
+            _write(
+                _result(
+                    request,
+                    [
+                        identity
+                        for identity in identities.values()
+                        if number in (None, identity["number"])
+                    ],
+                )
+            )
+        elif request["method"] == "trust":
+            _write(_trust(request, identities))
+        else:
+            _write(
+                {
+                    "jsonrpc": "2.0",
+                    "id": request["id"],
+                    "error": {"code": -32601, "message": "Method not implemented"},
+                }
+            )
+        handled += 1
+        if crash_after is not None and handled >= crash_after:
+            sys.exit(1)
+
+
+def _option(args, name, convert, default=None):
+    return convert(args[args.index(name) + 1]) if name in args else default
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "jsonRpc" in args:
+        json_rpc(
+            _option(args, "--crash-after", int),
+            _option(args, "--receive-count", int),
+            _option(args, "--receive-rate", float, 100.0),
+            _option(args, "--receive-message", str, ""),
+            _option(args, "--untrusted", int, 0),
+        )
+    else:
+        one_shot(args)
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from signal_scanner_bot import cache
+from signal_scanner_bot.cache import TTLCache
+from tests.conftest import run
+
+
+def test_get_many_counts_hits_and_misses():
+    officers = TTLCache(maxsize=10, ttl=60)
+    officers.update({"700001": {"badge": 1}, "700002": None})
+    found, missing = officers.get_many(["700001", "700002", "700003"])
+    assert found == {"700001": {"badge": 1}, "700002": None}
+    assert missing == ["700003"]
+    assert (officers.hits, officers.misses) == (2, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    officers = TTLCache(maxsize=2, ttl=60)
+    officers.update({"a": 1, "b": 2})
+    officers.get_many(["a"])
+    officers.set("c", 3)
+    assert "a" in officers and "c" in officers
+    assert "b" not in officers
+
+
+def test_entries_expire(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+    officers = TTLCache(maxsize=10, ttl=60)
+    officers.set("a", 1)
+    now += 61
+    assert officers.get_many(["a"]) == ({}, ["a"])
+
+
+def test_round_trips_through_disk(tmp_path):
+    path = tmp_path / "officers.json"
+    officers = TTLCache(maxsize=10, ttl=60, path=path)
+    officers.update({"700001": {"badge": 1}})
+    officers.save()
+    assert TTLCache(maxsize=10, ttl=60, path=path).get_many(["700001"])[0] == {
+        "700001": {"badge": 1}
+    }
+
+
+@pytest.mark.parametrize(
+    "contents", ["not json", "{}", "[1]", '[["700001", 1]]', '[["700001", "x", 1]]']
+)
+def test_unreadable_files_are_ignored(tmp_path, contents):
+    path = tmp_path / "officers.json"
+    path.write_text(contents)
+    officers = TTLCache(maxsize=10, ttl=60, path=path)
+    assert officers.get_many(["700001"]) == ({}, ["700001"])
+
+
+def test_saves_are_batched(tmp_path, monkeypatch):
+    path = tmp_path / "officers.json"
+    officers = TTLCache(maxsize=10, ttl=60, path=path, save_interval=0.05)
+    writes = []
+    write = officers._write
+    monkeypatch.setattr(
+        officers, "_write", lambda entries: writes.append(entries) or write(entries)
+    )
+
+    async def scenario():
+        for radio in ["700001", "700002", "700003"]:
+            officers.set(radio, {"badge": radio})
+            officers.schedule_save()
+        # Not written on the spot
+        assert not path.exists()
+        await asyncio.sleep(0.2)
+
+    run(scenario())
+    assert len(writes) == 1
+    found, missing = TTLCache(maxsize=10, ttl=60, path=path).get_many(["700003"])
+    assert found and not missing
+
+
+def test_close_saves_pending_changes(tmp_path):
+    path = tmp_path / "officers.json"
+    officers = TTLCache(maxsize=10, ttl=60, path=path)
+
+    async def scenario():
+        officers.set("700001", {"badge": 1})
+        officers.schedule_save()
+
+    run(scenario())
+    officers.close()
+    assert TTLCache(maxsize=10, ttl=60, path=path).get_many(["700001"])[0] == {
+        "700001": {"badge": 1}
+    }
@@ -0,0 +1,148 @@
+import asyncio
+from typing import List, Tuple
+
+import pytest
+
+from signal_scanner_bot.dispatcher import DispatcherOverflow, Priority, SignalDispatcher
+from tests.conftest import run
+
+
+class _Recorder:
+    """Stand-in for the real Signal send that just records what it was asked to do."""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.sent: List[Tuple[str, str]] = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self, message, recipient, attachment=None):
+        await self.gate.wait()
+        await asyncio.sleep(self.delay)
+        self.sent.append((recipient, message))
+
+
+def test_messages_to_a_recipient_stay_in_order():
+    async def scenario():
+        send = _Recorder(delay=0.001)
+        dispatcher = SignalDispatcher(send, concurrency=4)
+        await asyncio.gather(
+            *(dispatcher.send(f"m{i}", "+1" if i % 2 else "+2") for i in range(20))
+        )
+        return send.sent
+
+    sent = run(scenario())
+    for recipient in ("+1", "+2"):
+        messages = [message for to, message in sent if to == recipient]
+        assert messages == sorted(messages, key=lambda m: int(m[1:]))
+
+
+def test_high_priority_jumps_the_queue():
+    async def scenario():
+        send = _Recorder()
+        send.gate.clear()
+        dispatcher = SignalDispatcher(send, concurrency=1)
+        first = asyncio.create_task(dispatcher.send("first", "+1"))
+        await asyncio.sleep(0.01)
+        # "first" is now in flight and holds the only slot
+        rest = [
+            asyncio.create_task(dispatcher.send(message, "+1", priority=priority))
+            for message, priority in [
+                ("normal", Priority.NORMAL),
+                ("low", Priority.LOW),
+                ("panic", Priority.HIGH),
+            ]
+        ]
+        await asyncio.sleep(0.01)
+        send.gate.set()
+        await asyncio.gather(first, *rest)
+        return [message for _, message in send.sent]
+
+    assert run(scenario()) == ["first", "panic", "normal", "low"]
+
+
+def test_coalesced_messages_are_joined():
+    async def scenario():
+        send = _Recorder()
+        dispatcher = SignalDispatcher(send, coalesce_window=0.05, coalesce_max=3)
+        await asyncio.gather(
+            *(dispatcher.send(f"m{i}", "+1", coalesce=True) for i in range(4))
+        )
+        return send.sent
+
+    assert run(scenario()) == [("+1", "m0\n\nm1\n\nm2"), ("+1", "m3")]
+
+
+def test_drop_oldest_overflow():
+    async def scenario():
+        send = _Recorder()
+        send.gate.clear()
+        dispatcher = SignalDispatcher(send, max_pending=2, concurrency=1)
+        in_flight = asyncio.create_task(dispatcher.send("in flight", "+1"))
+        await asyncio.sleep(0.01)
+        oldest = asyncio.create_task(dispatcher.send("oldest", "+1"))
+        await asyncio.sleep(0)
+        await dispatcher.send("newer", "+1", wait=False)
+        await dispatcher.send("newest", "+1", wait=False)
+        with pytest.raises(DispatcherOverflow):
+            await oldest
+        send.gate.set()
+        await in_flight
+        while dispatcher.qsize():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        return [message for _, message in send.sent], dispatcher.dropped
+
+    sent, dropped = run(scenario())
+    assert sent == ["in flight", "newer", "newest"]
+    assert dropped == 1
+
+
+def test_drop_newest_overflow():
+    async def scenario():
+        send = _Recorder()
+        send.gate.clear()
+        dispatcher = SignalDispatcher(
+            send, max_pending=1, concurrency=1, overflow="drop_newest"
+        )
+        asyncio.create_task(dispatcher.send("in flight", "+1"))
+        await asyncio.sleep(0.01)
+        await dispatcher.send("queued", "+1", wait=False)
+        with pytest.raises(DispatcherOverflow):
+            await dispatcher.send("refused", "+1")
+        send.gate.set()
+
+    run(scenario())
+
+
+def test_failed_sends_retried_in_order():
+    async def scenario():
+        attempts = []
+
+        async def flaky(message, recipient, attachment=None):
+            attempts.append(message)
+            if attempts.count("first") < 3:
+                raise RuntimeError("signal-cli fell over")
+
+        dispatcher = SignalDispatcher(flaky, retries=2, retry_delay=0.01)
+        await asyncio.gather(
+            dispatcher.send("first", "+1"), dispatcher.send("second", "+1")
+        )
+        return attempts, dispatcher.retried
+
+    attempts, retried = run(scenario())
+    assert attempts == ["first", "first", "first", "second"]
+    assert retried == 2
+
+
+def test_send_raises_once_retries_run_out():
+    async def scenario():
+        async def broken(message, recipient, attachment=None):
+            raise RuntimeError("signal-cli fell over")
+
+        dispatcher = SignalDispatcher(broken, retries=1, retry_delay=0.01)
+        with pytest.raises(RuntimeError):
+            await dispatcher.send("doomed", "+1")
+        return dispatcher.failed
+
+    assert run(scenario()) == 1
@@ -0,0 +1,55 @@
+import subprocess
+import sys
+
+import pytest
+
+from signal_scanner_bot import env
+
+
+def _forget(monkeypatch, *names):
+    for name in names:
+        monkeypatch.delitem(vars(env), name, raising=False)
+
+
+def test_settings_load_on_first_use(monkeypatch):
+    _forget(monkeypatch, "TWEET_THREAD_MAX")
+    monkeypatch.setenv("TWEET_THREAD_MAX", "4")
+    assert "TWEET_THREAD_MAX" not in vars(env)
+    assert env.TWEET_THREAD_MAX == 4
+    assert vars(env)["TWEET_THREAD_MAX"] == 4
+
+
+def test_missing_setting_only_fails_when_used(monkeypatch):
+    _forget(monkeypatch, "TWITTER_API_KEY")
+    monkeypatch.delenv("TWITTER_API_KEY", raising=False)
+    with pytest.raises(KeyError):
+        env.TWITTER_API_KEY
+
+
+def test_settings_are_validated(monkeypatch):
+    _forget(monkeypatch, "RADIO_MONITOR_LOOKBACK", "TRUSTED_TWEETERS")
+    monkeypatch.setenv("RADIO_MONITOR_LOOKBACK", "10")
+    monkeypatch.setenv("TRUSTED_TWEETERS", "@someone")
+    assert env.RADIO_MONITOR_LOOKBACK == 45
+    with pytest.raises(ValueError):
+        env.TRUSTED_TWEETERS
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        env.NOT_A_SETTING
+
+
+def test_importing_the_bot_reads_no_settings():
+    # In a fresh interpreter, as other tests will have read settings already
+    code = (
+        "import sys\n"
+        "import signal_scanner_bot.bin.run, signal_scanner_bot.bin.replay\n"
+        "from signal_scanner_bot import env\n"
+        "print(sorted(name for name in env._SETTINGS if name in vars(env)))\n"
+        "print('peony' in sys.modules)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    assert output.split("\n")[:2] == ["[]", "False"]
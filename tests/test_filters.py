@@ -0,0 +1,70 @@
+import time
+
+from signal_scanner_bot import filters, metrics
+from signal_scanner_bot.filters import FilterPipeline
+
+
+def _never(data):
+    return False
+
+
+def _no_message(data):
+    return not data.get("message")
+
+
+def test_pipeline_passes_and_counts():
+    pipeline = FilterPipeline("test", [_never, _no_message])
+    assert pipeline({"message": "hi"})
+    assert not pipeline({})
+    assert pipeline.stats["_never"].evaluations == 2
+    assert pipeline.stats["_no_message"].evaluations == 2
+    assert pipeline.stats["_no_message"].rejections == 1
+
+
+def test_pipeline_moves_rejecting_filters_first(monkeypatch):
+    monkeypatch.setattr(filters, "REORDER_INTERVAL", 10)
+    pipeline = FilterPipeline("test", [_never, _no_message])
+    for _ in range(10):
+        pipeline({})
+    assert pipeline.filters == [_no_message, _never]
+    # Reordering never changes the outcome
+    assert pipeline({"message": "hi"})
+    assert not pipeline({})
+
+
+def test_not_recent():
+    now = time.time() * 1000
+    assert not filters._f_not_recent({"timestamp": now - 60 * 1000})
+    assert filters._f_not_recent({"timestamp": now - 6 * 60 * 1000})
+
+
+def test_not_recent_without_timestamp():
+    assert filters._f_not_recent({})
+
+
+def test_signal_filters_handle_any_order(monkeypatch):
+    monkeypatch.setattr(filters, "REORDER_INTERVAL", 10)
+    monkeypatch.setattr(filters.env, "LISTEN_CONTACT", "group", raising=False)
+    pipeline = FilterPipeline("signal", list(filters.SIGNAL_FILTERS.filters))
+    old = time.time() * 1000 - 10 * 60 * 1000
+    # Old messages in the right group are only rejected by _f_not_recent, so
+    # it gets moved ahead of _f_no_data
+    for _ in range(10):
+        pipeline({"message": "hi", "groupInfo": {"groupId": "group"}, "timestamp": old})
+    assert pipeline.filters[0] is filters._f_not_recent
+    # Receipts and typing notifications carry no message or timestamp
+    assert not pipeline({})
+
+
+def test_filter_stats_are_exported():
+    def _f_slow(data):
+        time.sleep(0.01)
+        return False
+
+    pipeline = FilterPipeline("test_export", [_f_slow])
+    pipeline({})
+    rendered = metrics.render()
+    labels = '{pipeline="test_export",filter="_f_slow"}'
+    assert f"filter_evaluations_total{labels} 1" in rendered
+    seconds = float(rendered.split(f"filter_seconds_total{labels} ")[1].split()[0])
+    assert seconds >= 0.01
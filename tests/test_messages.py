@@ -0,0 +1,94 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from signal_scanner_bot import env, messages
+from signal_scanner_bot.env import _cast_to_header_hashtags
+from signal_scanner_bot.messages import HeaderMatcher
+from tests.conftest import run
+
+
+def test_header_matcher():
+    matcher = HeaderMatcher({"DISPATCH", "DISPATCH NORTH", "RESPONSE"})
+    assert matcher.match("response: all clear") == "RESPONSE"
+    assert matcher.match("Dispatch North: 5th & Pine") == "DISPATCH NORTH"
+    assert matcher.match("DISPATCH: 5th & Pine") == "DISPATCH"
+    assert matcher.match("no header here") is None
+    assert matcher.match("a RESPONSE later on") is None
+
+
+def test_header_matcher_escapes_headers():
+    matcher = HeaderMatcher({"[ALERT]", "A.B"})
+    assert matcher.match("[alert] hello") == "[ALERT]"
+    assert matcher.match("AxB hello") is None
+
+
+def test_header_matcher_empty():
+    assert HeaderMatcher(set()).match("DISPATCH") is None
+
+
+def test_cast_to_header_hashtags():
+    assert _cast_to_header_hashtags("Dispatch North=#North,#Sea;RESPONSE=#R") == {
+        "DISPATCH NORTH": ["#North", "#Sea"],
+        "RESPONSE": ["#R"],
+    }
+    assert _cast_to_header_hashtags("") == {}
+
+
+def _audio_server():
+    async def small(request):
+        return web.Response(body=b"a" * 100)
+
+    async def declared_too_big(request):
+        return web.Response(body=b"a" * 2000)
+
+    async def streamed_too_big(request):
+        # No Content-Length to go on, so the cap has to catch it mid-download
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for _ in range(20):
+            await response.write(b"a" * 100)
+        return response
+
+    async def slow(request):
+        await asyncio.sleep(2)
+        return web.Response(body=b"a")
+
+    app = web.Application()
+    app.router.add_get("/small.m4a", small)
+    app.router.add_get("/declared.m4a", declared_too_big)
+    app.router.add_get("/streamed.m4a", streamed_too_big)
+    app.router.add_get("/slow.m4a", slow)
+    return app
+
+
+def test_download_audio(monkeypatch, tmp_path):
+    monkeypatch.setattr(env, "RADIO_AUDIO_DIR", tmp_path, raising=False)
+    monkeypatch.setattr(env, "RADIO_AUDIO_MAX_SIZE", 1000, raising=False)
+    monkeypatch.setattr(env, "RADIO_AUDIO_TIMEOUT", 1, raising=False)
+    monkeypatch.setattr(env, "RADIO_AUDIO_CHUNK_SIZE", 100, raising=False)
+
+    async def scenario():
+        runner = web.AppRunner(_audio_server())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        url = "http://{}:{}".format(*runner.addresses[0])
+        try:
+            async with aiohttp.ClientSession() as session:
+                downloaded = await messages._download_audio(f"{url}/small.m4a", session)
+                assert downloaded.read_bytes() == b"a" * 100
+                assert downloaded.suffix == ".m4a"
+                downloaded.unlink()
+                for path in ["declared", "streamed"]:
+                    with pytest.raises(ValueError):
+                        await messages._download_audio(f"{url}/{path}.m4a", session)
+                with pytest.raises(asyncio.TimeoutError):
+                    await messages._download_audio(f"{url}/slow.m4a", session)
+        finally:
+            await runner.cleanup()
+
+    run(scenario())
+    # Nothing left behind by the failed downloads
+    assert list(tmp_path.iterdir()) == []
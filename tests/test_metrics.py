@@ -0,0 +1,60 @@
+import asyncio
+import socket
+
+import aiohttp
+
+from signal_scanner_bot import metrics
+
+
+def test_histogram_render():
+    histogram = metrics.Histogram(
+        "test_seconds", "A test", buckets=(0.1, 1), register=False
+    )
+    for value in [0.05, 0.5, 5]:
+        histogram.observe(value)
+    assert histogram.render() == [
+        "# HELP test_seconds A test",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+    ]
+
+
+def test_labelled_counter_render():
+    counter = metrics.Counter(
+        "test_total", "A test", labelnames=("source",), register=False
+    )
+    counter.labels(source="a").inc()
+    counter.labels(source="a").inc()
+    counter.labels(source='say "hi"').function = lambda: 7
+    assert counter.render()[2:] == [
+        'test_total{source="a"} 2.0',
+        'test_total{source="say \\"hi\\""} 7',
+    ]
+
+
+def test_serve():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async def scrape():
+        server = asyncio.create_task(metrics.serve("127.0.0.1", port))
+        try:
+            for _ in range(50):
+                try:
+                    async with aiohttp.ClientSession() as session:
+                        async with session.get(
+                            f"http://127.0.0.1:{port}/metrics"
+                        ) as response:
+                            return await response.text()
+                except aiohttp.ClientConnectionError:
+                    await asyncio.sleep(0.05)
+        finally:
+            server.cancel()
+
+    text = asyncio.run(scrape())
+    assert "# TYPE signal_receive_latency_seconds histogram" in text
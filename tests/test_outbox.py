@@ -0,0 +1,165 @@
+import asyncio
+import sqlite3
+import threading
+
+from signal_scanner_bot.dispatcher import SignalDispatcher
+from signal_scanner_bot.outbox import Outbox
+from tests.conftest import run
+
+
+def test_unacknowledged_messages_survive_a_restart(tmp_path):
+    path = tmp_path / "outbox.sqlite3"
+
+    async def first_run():
+        outbox = Outbox(path, commit_interval=0.01)
+        sent = outbox.add("signal", {"message": "sent"})
+        outbox.add("signal", {"message": "unsent"})
+        outbox.add("tweet", {"message": "other kind"})
+        await asyncio.sleep(0.05)
+        # Acknowledged after it was committed, so it has to be deleted
+        outbox.ack(sent)
+        await asyncio.sleep(0.05)
+        # Crash without closing
+
+    run(first_run())
+    outbox = Outbox(path)
+    assert [payload for _, payload in outbox.recover("signal")] == [
+        {"message": "unsent"}
+    ]
+    assert outbox.recover("signal") == []
+    assert len(outbox.recover("tweet")) == 1
+    # New IDs carry on from the old ones
+    assert outbox._next_id == 4
+    outbox.close()
+
+
+def test_acknowledged_before_commit_never_written(tmp_path):
+    async def scenario():
+        outbox = Outbox(tmp_path / "outbox.sqlite3", commit_interval=0.05)
+        outbox.ack(outbox.add("signal", {"message": "quick"}))
+        await asyncio.sleep(0.1)
+        return outbox._open().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    assert run(scenario()) == 0
+
+
+def test_oldest_messages_dropped_past_limit(tmp_path):
+    path = tmp_path / "outbox.sqlite3"
+
+    async def scenario():
+        outbox = Outbox(path, max_messages=3)
+        for index in range(5):
+            outbox.add("signal", {"index": index})
+        outbox.close()
+
+    run(scenario())
+    recovered = Outbox(path).recover("signal")
+    assert [payload["index"] for _, payload in recovered] == [2, 3, 4]
+
+
+def test_dispatcher_resends_what_the_last_run_left(tmp_path):
+    path = tmp_path / "outbox.sqlite3"
+    sent = []
+
+    async def send(message, recipient, attachment=None):
+        sent.append((recipient, message, attachment))
+
+    async def never_send(message, recipient, attachment=None):
+        await asyncio.Event().wait()
+
+    async def crashed_run():
+        outbox = Outbox(path, commit_interval=0.01)
+        dispatcher = SignalDispatcher(never_send, outbox=outbox)
+        await dispatcher.send(
+            "alert", "+1", attachment=tmp_path / "gone.m4a", wait=False
+        )
+        await dispatcher.send("tweet", "+2", wait=False)
+        await asyncio.sleep(0.05)
+
+    async def next_run():
+        outbox = Outbox(path, commit_interval=0.01)
+        dispatcher = SignalDispatcher(send, outbox=outbox)
+        await dispatcher.start()
+        await dispatcher.drain()
+        await asyncio.sleep(0.05)
+        outbox.close()
+
+    run(crashed_run())
+    run(next_run())
+    assert sorted(sent) == [("+1", "alert", None), ("+2", "tweet", None)]
+    assert Outbox(path).recover("signal") == []
+
+
+def test_failed_messages_stay_in_the_outbox(tmp_path):
+    path = tmp_path / "outbox.sqlite3"
+
+    async def failing_run():
+        async def broken(message, recipient, attachment=None):
+            raise RuntimeError("signal-cli fell over")
+
+        outbox = Outbox(path, commit_interval=0.01)
+        dispatcher = SignalDispatcher(broken, outbox=outbox)
+        await dispatcher.send("unsent", "+1", wait=False)
+        await dispatcher.drain()
+        await asyncio.sleep(0.05)
+        outbox.close()
+
+    run(failing_run())
+    assert [payload["message"] for _, payload in Outbox(path).recover("signal")] == [
+        "unsent"
+    ]
+
+
+def test_failed_commits_are_retried(tmp_path, monkeypatch):
+    path = tmp_path / "outbox.sqlite3"
+
+    async def scenario():
+        outbox = Outbox(path, commit_interval=0.01)
+        commit = outbox._commit
+        failures = []
+
+        def flaky_commit(inserts, deletes):
+            if not failures:
+                failures.append((set(inserts), deletes))
+                raise sqlite3.OperationalError("disk I/O error")
+            commit(inserts, deletes)
+
+        monkeypatch.setattr(outbox, "_commit", flaky_commit)
+        outbox.add("signal", {"message": "kept"})
+        acked = outbox.add("signal", {"message": "acked"})
+        await asyncio.sleep(0.05)
+        # Acknowledged after its commit failed, so it's never written at all
+        outbox.ack(acked)
+        outbox.add("signal", {"message": "later"})
+        await asyncio.sleep(0.05)
+        outbox.close()
+        return failures
+
+    failures = run(scenario())
+    assert failures == [({1, 2}, set())]
+    assert [payload["message"] for _, payload in Outbox(path).recover("signal")] == [
+        "kept",
+        "later",
+    ]
+
+
+def test_dispatcher_opens_the_outbox_in_a_thread(tmp_path, monkeypatch):
+    async def scenario():
+        async def send(message, recipient, attachment=None):
+            pass
+
+        outbox = Outbox(tmp_path / "outbox.sqlite3")
+        dispatcher = SignalDispatcher(send, outbox=outbox)
+        opened_in = []
+        _open = outbox._open
+
+        def open_():
+            opened_in.append(threading.current_thread())
+            return _open()
+
+        monkeypatch.setattr(outbox, "_open", open_)
+        await dispatcher.start()
+        outbox.close()
+        return opened_in[0]
+
+    assert run(scenario()) is not threading.main_thread()
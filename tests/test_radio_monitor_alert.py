@@ -0,0 +1,335 @@
+import asyncio
+import contextlib
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import pytz
+import ujson
+
+from signal_scanner_bot import env, radio_monitor_alert
+from signal_scanner_bot.cache import TTLCache
+from signal_scanner_bot.radio_monitor_alert import (
+    POLL_OVERLAP,
+    CallCursor,
+    PollScheduler,
+    UnitMatcher,
+)
+from tests.conftest import run
+
+
+def _call(call_id, age_seconds=0):
+    time = datetime.now(pytz.utc) - timedelta(seconds=age_seconds)
+    return {
+        "_id": call_id,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+        "url": f"https://example.com/{call_id}.m4a",
+    }
+
+
+def test_calls_are_only_processed_once():
+    cursor = CallCursor()
+    first_poll = [_call("a", 30), _call("b", 10)]
+    assert cursor.new_calls(first_poll) == first_poll
+    cursor.mark(first_poll)
+
+    # The next window overlaps the first
+    second_poll = [_call("b", 10), _call("c", 1)]
+    assert [call["_id"] for call in cursor.new_calls(second_poll)] == ["c"]
+
+
+def test_cursor_moves_to_latest_call():
+    cursor = CallCursor()
+    calls = [_call("a", 30), _call("b", 10)]
+    cursor.mark(calls)
+    assert cursor.lookback_time() == (
+        datetime.fromisoformat(calls[1]["time"].replace("Z", "+00:00")) - POLL_OVERLAP
+    )
+
+
+def test_cursor_survives_restart(tmp_path):
+    path = tmp_path / "cursor.json"
+    calls = [_call("a", 5)]
+
+    async def scenario():
+        CallCursor(path).mark(calls)
+        # Saved in a thread, without waiting for shutdown
+        while not path.exists():
+            await asyncio.sleep(0.01)
+
+    run(scenario())
+    restarted = CallCursor(path)
+    assert restarted.new_calls(calls) == []
+    assert restarted.cursor is not None
+
+
+def test_cursor_saves_stay_off_the_event_loop(tmp_path, monkeypatch):
+    path = tmp_path / "cursor.json"
+    written_in = []
+
+    async def scenario():
+        cursor = CallCursor(path)
+        write = cursor._write
+
+        def record_write(version, state):
+            written_in.append(threading.current_thread())
+            write(version, state)
+
+        monkeypatch.setattr(cursor, "_write", record_write)
+        cursor.mark([_call("a", 5)])
+        while not written_in:
+            await asyncio.sleep(0.01)
+        # Not written yet when the bot shuts down
+        cursor.mark([_call("b", 1)])
+        radio_monitor_alert.close_cursors()
+
+    run(scenario())
+    assert written_in[0] is not threading.main_thread()
+    assert CallCursor(path).new_calls([_call("a"), _call("b")]) == []
+
+
+def test_seen_calls_are_bounded():
+    cursor = CallCursor(max_seen=2)
+    cursor.mark([_call("a", 3), _call("b", 2), _call("c", 1)])
+    assert [call["_id"] for call in cursor.new_calls([_call("a", 3)])] == ["a"]
+
+
+def test_lookback_follows_the_last_poll():
+    cursor = CallCursor()
+    polled = datetime.now(pytz.utc) - timedelta(seconds=5)
+    # Even with a newer call, so calls published late aren't skipped
+    cursor.mark([_call("a", 600), _call("b", 1)], polled=polled)
+    assert cursor.lookback_time() == polled - POLL_OVERLAP
+    cursor.mark([], polled=polled - timedelta(days=1))
+    assert cursor.lookback_time() > datetime.now(pytz.utc) - timedelta(
+        hours=1, seconds=1
+    )
+
+
+def _fake_feed(monkeypatch):
+    """A feed whose OpenMHz calls are published by appending to the list returned."""
+    published = []
+
+    async def get_openmhz_calls(session, feed):
+        since = feed.cursor.lookback_time(feed.lookback)
+        return [
+            call
+            for call in published
+            if radio_monitor_alert._parse_call_time(call["time"]) > since
+        ]
+
+    async def lookup_cops(radios, session):
+        cop = {"full_name": "A", "badge": "1", "unit_description": "SWAT"}
+        return dict.fromkeys(radios, cop)
+
+    monkeypatch.setattr(radio_monitor_alert, "get_openmhz_calls", get_openmhz_calls)
+    monkeypatch.setattr(radio_monitor_alert, "_lookup_cops", lookup_cops)
+    feed = radio_monitor_alert.RadioFeed(
+        "test", "https://openmhz", UnitMatcher({"SWAT"}), "group", 45, 20, 120
+    )
+    return feed, published
+
+
+def _radio_call(call_id, age_seconds):
+    return {**_call(call_id, age_seconds), "srcList": [{"src": 1}]}
+
+
+def test_late_published_calls_still_alert(monkeypatch):
+    feed, published = _fake_feed(monkeypatch)
+
+    async def scenario():
+        published.append(_radio_call("newer", 2))
+        first = await radio_monitor_alert.check_radio_calls(None, feed)
+        first.done()
+        # Published after the last poll, but made before the newest call seen
+        published.append(_radio_call("late", 10))
+        return first, await radio_monitor_alert.check_radio_calls(None, feed)
+
+    first, second = asyncio.run(scenario())
+    assert [call["_id"] for call in first.calls] == ["newer"]
+    assert [call["_id"] for call in second.calls] == ["late"]
+    assert len(second.alerts) == 1
+
+
+def test_calls_only_marked_once_alerts_are_sent(monkeypatch):
+    feed, published = _fake_feed(monkeypatch)
+    published.append(_radio_call("a", 2))
+
+    async def scenario():
+        # Sending the first poll's alerts failed, so it was never marked done
+        await radio_monitor_alert.check_radio_calls(None, feed)
+        retry = await radio_monitor_alert.check_radio_calls(None, feed)
+        retry.done()
+        return retry, await radio_monitor_alert.check_radio_calls(None, feed)
+
+    retry, after = asyncio.run(scenario())
+    assert len(retry.alerts) == 1
+    assert after.calls == [] and after.alerts == []
+
+
+def test_polls_run_at_a_fixed_adaptive_rate():
+    async def scenario():
+        scheduler = PollScheduler(0.04, active_interval=0.02, quiet_interval=0.09)
+        starts = []
+        for active in (False, True, False, False, False):
+            await scheduler.wait()
+            starts.append(time.monotonic())
+            # Processing time doesn't push the next poll back
+            await asyncio.sleep(0.01)
+            scheduler.done(active)
+            intervals.append(scheduler.interval)
+        return [later - earlier for earlier, later in zip(starts, starts[1:])]
+
+    intervals = []
+    gaps = asyncio.run(scenario())
+    assert intervals == [0.06, 0.02, 0.03, 0.045, 0.0675]
+    for gap, interval in zip(gaps, intervals):
+        assert interval - 0.005 <= gap < interval + 0.02
+
+
+def test_unit_matcher():
+    matcher = UnitMatcher({"SWAT", "SWAT Team 2", "Community Response Group"})
+    assert matcher.match("WEST PCT - SWAT TEAM 2") == "SWAT Team 2"
+    assert matcher.match("Swat Team 1") == "SWAT"
+    assert (
+        matcher.match("COMMUNITY RESPONSE GROUP - NORTH") == "Community Response Group"
+    )
+    assert matcher.match("Patrol") is None
+    # Cached either way
+    assert matcher._cache == {
+        "WEST PCT - SWAT TEAM 2": "SWAT Team 2",
+        "Swat Team 1": "SWAT",
+        "COMMUNITY RESPONSE GROUP - NORTH": "Community Response Group",
+        "Patrol": None,
+    }
+    assert UnitMatcher(set()).match("SWAT") is None
+
+
+def test_unit_matcher_escapes_units():
+    matcher = UnitMatcher({"K9 (East)", "A.B", "A.BC"})
+    assert matcher.match("k9 (east) squad") == "K9 (East)"
+    assert matcher.match("Unit a.bc") == "A.BC"
+    assert matcher.match("Unit a.b") == "A.B"
+    assert matcher.match("K9 East") is None
+    assert matcher.match("AxB") is None
+
+
+def test_feeds_fill_in_missing_settings(monkeypatch, tmp_path):
+    feeds_file = tmp_path / "feeds.json"
+    feeds_file.write_text(
+        ujson.dumps(
+            [
+                {"name": "north", "url": "https://openmhz/north", "contact": "group1"},
+                {"name": "south", "url": "https://openmhz/south", "units": ["K9"]},
+                {"name": "east", "url": "https://openmhz/east", "interval": 90},
+            ]
+        )
+    )
+    for name, value in {
+        "RADIO_MONITOR_FEEDS_FILE": feeds_file,
+        "RADIO_MONITOR_CURSOR_FILE": tmp_path / "cursor.json",
+        "RADIO_MONITOR_UNITS": {"SWAT"},
+        "RADIO_MONITOR_CONTACT": "group0",
+        "RADIO_MONITOR_LOOKBACK": 45,
+    }.items():
+        monkeypatch.setattr(env, name, value, raising=False)
+
+    north, south, east = radio_monitor_alert.load_feeds()
+    assert (north.contact, south.contact) == ("group1", "group0")
+    assert south.units.match("K9 Unit") == "K9"
+    assert north.units.match("K9 Unit") is None
+    # Feeds watching the same units share a matcher
+    assert north.units is east.units
+    assert (north.scheduler.interval, east.scheduler.interval) == (45, 90)
+    assert north.cursor.path == tmp_path / "cursor-north.json"
+
+
+def test_feeds_need_unique_names(monkeypatch, tmp_path):
+    feeds_file = tmp_path / "feeds.json"
+    feeds_file.write_text(ujson.dumps([{"name": "a", "url": "x"}] * 2))
+    monkeypatch.setattr(env, "RADIO_MONITOR_FEEDS_FILE", feeds_file, raising=False)
+    with pytest.raises(ValueError):
+        radio_monitor_alert.load_feeds()
+
+
+@pytest.mark.parametrize(
+    "config, problem",
+    [
+        ({"units": "SWAT"}, "units"),
+        ({"units": ["SWAT", 1]}, "units"),
+        ({"contact": ["group"]}, "contact"),
+        ({"url": 1}, "url"),
+        ({"interval": "soon"}, "interval"),
+    ],
+)
+def test_feed_settings_are_checked(monkeypatch, tmp_path, config, problem):
+    feeds_file = tmp_path / "feeds.json"
+    feeds_file.write_text(ujson.dumps([{"name": "bad", "url": "x", **config}]))
+    monkeypatch.setattr(env, "RADIO_MONITOR_FEEDS_FILE", feeds_file, raising=False)
+    with pytest.raises(ValueError, match=f"bad's {problem}"):
+        radio_monitor_alert.load_feeds()
+
+
+def test_feeds_share_officer_lookups(monkeypatch):
+    requested = []
+
+    async def fetch_cops(radios, session, semaphore):
+        requested.extend(radios)
+        await asyncio.sleep(0.01)
+        return {radio: {"unit_description": "SWAT"} for radio in radios}
+
+    monkeypatch.setattr(radio_monitor_alert, "_fetch_cops", fetch_cops)
+    monkeypatch.setattr(radio_monitor_alert, "OFFICER_CACHE", TTLCache(100, 60))
+
+    async def scenario():
+        return await asyncio.gather(
+            radio_monitor_alert._lookup_cops({"1", "2"}, None),
+            radio_monitor_alert._lookup_cops({"2", "3"}, None),
+        )
+
+    first, second = asyncio.run(scenario())
+    assert sorted(requested) == ["1", "2", "3"]
+    assert {"1", "2"} <= set(first) and {"2", "3"} <= set(second)
+
+
+class _RadioChaser:
+    """Stand-in session for RadioChaser that tracks how many requests overlap."""
+
+    def __init__(self):
+        self.in_flight = self.max_in_flight = 0
+
+    @contextlib.asynccontextmanager
+    async def get(self, url, params):
+        radios = params["radio"]
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Later radios answer first
+            await asyncio.sleep(0.05 - int(radios[0][1:]) / 1000)
+            yield SimpleNamespace(json=lambda: _cops(radios))
+        finally:
+            self.in_flight -= 1
+
+
+async def _cops(radios):
+    return {radio: {"full_name": radio, "unit_description": "SWAT"} for radio in radios}
+
+
+def test_get_pigs_keeps_order_and_concurrency_limit(monkeypatch):
+    monkeypatch.setattr(env, "RADIO_CHASER_URL", "https://radiochaser", raising=False)
+    monkeypatch.setattr(env, "RADIO_CHASER_BATCH_SIZE", 1, raising=False)
+    monkeypatch.setattr(env, "RADIO_CHASER_CONCURRENCY", 2, raising=False)
+    monkeypatch.setattr(radio_monitor_alert, "OFFICER_CACHE", TTLCache(100, 60))
+    session = _RadioChaser()
+    calls = [{**_call(f"call{src}"), "srcList": [{"src": src}]} for src in range(1, 9)]
+
+    pigs = asyncio.run(
+        radio_monitor_alert.get_pigs(calls, session, UnitMatcher({"SWAT"}))
+    )
+    assert [cop["full_name"] for cop, _, _ in pigs] == [
+        f"7{src:0>5}" for src in range(1, 9)
+    ]
+    assert [url for _, _, url in pigs] == [call["url"] for call in calls]
+    assert session.max_in_flight == 2
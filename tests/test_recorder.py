@@ -0,0 +1,68 @@
+import gzip
+
+from signal_scanner_bot.recorder import Recorder, read_recording, retime_signal_blob
+
+
+def _blob(message, timestamp=1000):
+    return {
+        "envelope": {
+            "timestamp": timestamp,
+            "serverReceivedTimestamp": timestamp,
+            "dataMessage": {"timestamp": timestamp, "message": message},
+        }
+    }
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "recording.jsonl.gz"
+    first = Recorder(path)
+    first.record("signal", _blob("one"))
+    first.close()
+    # Recording again appends rather than starting over
+    second = Recorder(path)
+    second.record("twitter", {"id": 1, "text": "two"})
+    second.close()
+
+    records = list(read_recording(path))
+    assert [(record.source, record.data) for record in records] == [
+        ("signal", _blob("one")),
+        ("twitter", {"id": 1, "text": "two"}),
+    ]
+    assert records[0].time <= records[1].time
+
+
+def test_truncated_recording(tmp_path):
+    path = tmp_path / "recording.jsonl.gz"
+    recorder = Recorder(path)
+    for index in range(100):
+        recorder.record("twitter", {"id": index})
+    recorder.close()
+    data = path.read_bytes()
+    path.write_bytes(data[: len(data) - 10])
+
+    # Everything up to the cut is still readable
+    records = list(read_recording(path))
+    assert [record.data["id"] for record in records] == list(range(len(records)))
+
+
+def test_disabled_recorder(tmp_path):
+    Recorder().record("signal", _blob("ignored"))
+    assert not list(tmp_path.iterdir())
+
+
+def test_retime_signal_blob():
+    blob = _blob("hello", timestamp=1000)
+    retimed = retime_signal_blob(blob, 2.5)
+    assert retimed["envelope"]["timestamp"] == 3500
+    assert retimed["envelope"]["serverReceivedTimestamp"] == 3500
+    assert retimed["envelope"]["dataMessage"] == {"timestamp": 3500, "message": "hello"}
+    # The recording itself is left alone
+    assert blob == _blob("hello", timestamp=1000)
+
+
+def test_gzip_members_are_standard(tmp_path):
+    path = tmp_path / "recording.jsonl.gz"
+    recorder = Recorder(path)
+    recorder.record("twitter", {"id": 1})
+    recorder.close()
+    assert gzip.decompress(path.read_bytes()).count(b"\n") == 1
@@ -0,0 +1,151 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+from signal_scanner_bot import signal, signal_daemon
+from signal_scanner_bot.signal_daemon import (
+    SignalDaemon,
+    SignalDaemonError,
+    SignalDaemonTimeout,
+)
+from tests.conftest import run
+
+
+FAKE_SIGNAL_CLI = [sys.executable, str(Path(__file__).parent / "fake_signal_cli.py")]
+
+
+def test_parse_identity():
+    line = (
+        "+15555550123: UNTRUSTED Added: 2021-01-01T00:00:00Z Fingerprint: 05 ab cd"
+        " Safety Number: 12345 67890 12345\n"
+    )
+    assert signal.parse_identity(line) == signal.Identity(
+        "+15555550123", "UNTRUSTED", "12345 67890 12345"
+    )
+    assert signal.parse_identity("INFO some log line\n") is None
+
+
+def test_trust_untrusted_over_the_daemon(monkeypatch):
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc", "--untrusted", "20"])
+        monkeypatch.setattr(signal_daemon, "DAEMON", daemon)
+        runner = asyncio.create_task(daemon.run())
+        assert await daemon.wait_ready(5)
+        try:
+            only = await signal.trust_untrusted(["+15550000003", "+15555550101"])
+            rest = await signal.trust_untrusted()
+            remaining = [
+                identity
+                async for identity in signal.list_identities()
+                if identity.trust_level == "UNTRUSTED"
+            ]
+        finally:
+            await daemon.stop()
+            await runner
+        return only, rest, remaining
+
+    only, rest, remaining = run(scenario())
+    # Already trusted numbers are left alone
+    assert only == {"+15550000003": True}
+    assert len(rest) == 19 and all(rest.values())
+    assert remaining == []
+
+
+def test_untrusted_send_retrusts_once_and_resends(monkeypatch):
+    sent = []
+
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc", "--untrusted", "3"])
+        monkeypatch.setattr(signal_daemon, "DAEMON", daemon)
+        trusts = []
+        trust_identity = signal.trust_identity
+
+        async def counting_trust_identity(number, safety_number):
+            trusts.append(number)
+            return await trust_identity(number, safety_number)
+
+        async def recording_send(message, recipient, attachment=None):
+            await send_daemon(message, recipient, attachment)
+            sent.append((recipient, message))
+
+        send_daemon = signal._send_message_daemon
+        monkeypatch.setattr(signal, "trust_identity", counting_trust_identity)
+        monkeypatch.setattr(signal, "_send_message_daemon", recording_send)
+        runner = asyncio.create_task(daemon.run())
+        assert await daemon.wait_ready(5)
+        try:
+            # A burst of messages to someone whose safety number just changed
+            await asyncio.gather(
+                *(signal._deliver_message(f"m{i}", "+15550000001") for i in range(5))
+            )
+        finally:
+            await daemon.stop()
+            await runner
+        return trusts
+
+    trusts = run(scenario())
+    assert trusts == ["+15550000001"]
+    assert sorted(sent) == [("+15550000001", f"m{i}") for i in range(5)]
+
+
+def test_send_failures_raise(signal_cli, monkeypatch):
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc"])
+        monkeypatch.setattr(signal_daemon, "DAEMON", daemon)
+        # No daemon running, so this goes through a one-shot signal-cli
+        with pytest.raises(signal.SignalCliError):
+            await signal._deliver_message("fail", "+15555550101")
+        runner = asyncio.create_task(daemon.run())
+        assert await daemon.wait_ready(5)
+        try:
+            with pytest.raises(SignalDaemonError):
+                await signal._deliver_message("fail", "+15555550101")
+        finally:
+            await daemon.stop()
+            await runner
+
+    run(scenario())
+
+
+def test_send_raises_when_the_daemon_never_replies(signal_cli, monkeypatch):
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc"], timeout=0.5)
+        monkeypatch.setattr(signal_daemon, "DAEMON", daemon)
+        runner = asyncio.create_task(daemon.run())
+        assert await daemon.wait_ready(5)
+        try:
+            # Not sent again one-shot, which would wait on the account's lock
+            # for as long as the daemon holds it
+            with pytest.raises(SignalDaemonTimeout):
+                await signal._deliver_message("hang", "+15555550101")
+            await signal._deliver_message("hi", "+15555550101")
+        finally:
+            await daemon.stop()
+            await runner
+
+    run(scenario())
+
+
+def test_one_shot_calls_dont_block_the_event_loop(signal_cli):
+    async def scenario():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        # The fake signal-cli receives for the whole second
+        proc = await signal._run_signal_cli("receive", "-t", "1")
+        ticker.cancel()
+        return proc, ticks
+
+    proc, ticks = run(scenario())
+    assert proc.returncode == 0
+    assert "hello" in proc.stdout
+    # The loop kept running the whole time, not just once signal-cli was done
+    assert ticks >= 50
@@ -0,0 +1,133 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+from signal_scanner_bot import signal_daemon
+from signal_scanner_bot.signal_daemon import (
+    SignalDaemon,
+    SignalDaemonError,
+    SignalDaemonTimeout,
+    SignalDaemonUnavailable,
+)
+from tests.conftest import run
+
+
+FAKE_SIGNAL_CLI = [sys.executable, str(Path(__file__).parent / "fake_signal_cli.py")]
+
+
+def test_request_round_trip():
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc"])
+        runner = asyncio.create_task(daemon.run())
+        assert await daemon.wait_ready(5)
+        results = await asyncio.gather(
+            *(daemon.request("send", {"message": f"m{i}"}) for i in range(10))
+        )
+        await daemon.stop()
+        await runner
+        return results
+
+    results = run(scenario())
+    assert [result["params"]["message"] for result in results] == [
+        f"m{i}" for i in range(10)
+    ]
+
+
+def test_error_response_raises():
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc"])
+        runner = asyncio.create_task(daemon.run())
+        await daemon.wait_ready(5)
+        try:
+            with pytest.raises(SignalDaemonError):
+                await daemon.request("send", {"message": "fail"})
+        finally:
+            await daemon.stop()
+            await runner
+
+    run(scenario())
+
+
+def test_request_times_out_when_the_daemon_never_replies():
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc"], timeout=0.5)
+        runner = asyncio.create_task(daemon.run())
+        await daemon.wait_ready(5)
+        try:
+            with pytest.raises(SignalDaemonTimeout):
+                await daemon.request("send", {"message": "hang"})
+            # Later requests aren't held up by it
+            assert await daemon.request("send", {"message": "hi"})
+        finally:
+            await daemon.stop()
+            await runner
+
+    run(scenario())
+
+
+def test_receive_notifications_are_fanned_out():
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc"])
+        queue = daemon.subscribe()
+        runner = asyncio.create_task(daemon.run())
+        blob = await queue.get()
+        await daemon.stop()
+        await runner
+        return blob
+
+    blob = run(scenario())
+    assert blob["envelope"]["dataMessage"]["message"] == "hello"
+
+
+def test_receive_stream_in_order():
+    async def scenario():
+        daemon = SignalDaemon(
+            FAKE_SIGNAL_CLI
+            + ["jsonRpc", "--receive-count", "20", "--receive-message", "DISPATCH"]
+        )
+        queue = daemon.subscribe()
+        runner = asyncio.create_task(daemon.run())
+        blobs = [await queue.get() for _ in range(20)]
+        await daemon.stop()
+        await runner
+        return blobs
+
+    messages = [blob["envelope"]["dataMessage"]["message"] for blob in run(scenario())]
+    assert [message.split()[:2] for message in messages] == [
+        ["DISPATCH", str(index)] for index in range(20)
+    ]
+
+
+def test_restarts_after_exit(monkeypatch):
+    monkeypatch.setattr(signal_daemon, "STARTUP_GRACE", 0)
+
+    async def scenario():
+        daemon = SignalDaemon(FAKE_SIGNAL_CLI + ["jsonRpc", "--crash-after", "1"])
+        runner = asyncio.create_task(daemon.run())
+        await daemon.wait_ready(5)
+        await daemon.request("send", {"message": "first"})
+        # Wait for the crash to be noticed and the daemon to come back up
+        while daemon.restarts == 0 or not daemon.running:
+            await asyncio.sleep(0.05)
+        result = await daemon.request("send", {"message": "second"})
+        await daemon.stop()
+        await runner
+        return result
+
+    assert run(scenario())["params"]["message"] == "second"
+
+
+def test_unavailable_when_daemon_cannot_start():
+    async def scenario():
+        daemon = SignalDaemon(["/nonexistent/signal-cli", "jsonRpc"])
+        queue = daemon.subscribe()
+        await daemon.run()
+        assert not daemon.available
+        assert not await daemon.wait_ready(1)
+        assert await queue.get() is None
+        with pytest.raises(SignalDaemonUnavailable):
+            await daemon.request("send", {"message": "hello"})
+
+    run(scenario())
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytz
+
+from signal_scanner_bot import (
+    env,
+    radio_monitor_alert,
+    signal,
+    signal_daemon,
+    transport,
+)
+from signal_scanner_bot.radio_monitor_alert import UnitMatcher
+from tests.conftest import run
+
+
+def test_sends_run_between_cli_receives(signal_cli, monkeypatch):
+    monkeypatch.setattr(env, "SIGNAL_TIMEOUT", 1, raising=False)
+    received = []
+
+    async def process_signal_blob(blob):
+        received.append(blob)
+
+    monkeypatch.setattr(transport, "process_signal_blob", process_signal_blob)
+
+    async def scenario():
+        receiver = asyncio.create_task(transport._receive_from_cli())
+        while not received:
+            await asyncio.sleep(0.05)
+        # signal-cli is receiving now, holding the account until it's done
+        await asyncio.wait_for(signal._send_message_cli("hi", "+15555550101"), 5)
+        receiver.cancel()
+
+    run(scenario())
+    assert received[0]["envelope"]["dataMessage"]["message"] == "hello"
+
+
+def test_cli_receive_restarts_with_backoff(monkeypatch):
+    monkeypatch.setattr(signal_daemon, "STARTUP_GRACE", 0.1)
+    monkeypatch.setattr(signal_daemon, "MAX_RESTART_DELAY", 4)
+    state = SimpleNamespace(STOP_REQUESTED=False)
+    monkeypatch.setattr(env, "STATE", state, raising=False)
+    # How long each receive runs before exiting, and its exit code
+    runs = [(0, 1), (0, 1), (0, 1), (0.2, 1), (0, 1), (0.2, 0)]
+    sleep = asyncio.sleep
+    delays = []
+
+    async def receive_once(queue):
+        duration, returncode = runs.pop(0)
+        await sleep(duration)
+        state.STOP_REQUESTED = not runs
+        return returncode
+
+    async def record_delay(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(transport, "_receive_once", receive_once)
+    monkeypatch.setattr(asyncio, "sleep", record_delay)
+    run(transport._receive_from_cli())
+    # Doubling while it keeps failing right away, up to the limit, and starting
+    # over once it's stayed up past the grace period
+    assert delays == [2, 4, 4, 1, 2]
+
+
+def test_failing_radio_feed_leaves_the_others_running(monkeypatch):
+    feeds = [
+        radio_monitor_alert.RadioFeed(
+            name, "https://openmhz", UnitMatcher({"SWAT"}), "group", 0.01, 0.01, 0.05
+        )
+        for name in ("broken", "working")
+    ]
+    polls = {"broken": 0, "working": 0}
+    panics = []
+
+    async def check_radio_calls(session, feed):
+        polls[feed.name] += 1
+        if feed.name == "broken":
+            raise RuntimeError("OpenMHz is down")
+        return radio_monitor_alert.RadioPoll(feed, [], datetime.now(pytz.utc), [])
+
+    async def panic(err):
+        panics.append(err)
+
+    monkeypatch.setattr(radio_monitor_alert, "check_radio_calls", check_radio_calls)
+    monkeypatch.setattr(signal, "panic", panic)
+
+    async def scenario():
+        tasks = [
+            asyncio.create_task(transport._monitor_radio_feed(feed, None))
+            for feed in feeds
+        ]
+        while polls["working"] < 5 or polls["broken"] < 3:
+            await asyncio.sleep(0.01)
+            for task in tasks:
+                assert not task.done()
+        for task in tasks:
+            task.cancel()
+
+    run(scenario())
+    # Called home once, not on every retry
+    assert len(panics) == 1
+
+
+def test_bad_radio_feeds_call_home(monkeypatch):
+    panics = []
+
+    def load_feeds():
+        raise ValueError("Radio feed bad's units must be a list of strings")
+
+    async def panic(err):
+        panics.append(err)
+
+    async def no_wait(delay):
+        pass
+
+    monkeypatch.setattr(radio_monitor_alert, "load_feeds", load_feeds)
+    monkeypatch.setattr(signal, "panic", panic)
+    monkeypatch.setattr(asyncio, "sleep", no_wait)
+    run(transport.radio_monitor_alert_transport())
+    assert [str(err) for err in panics] == [
+        "Radio feed bad's units must be a list of strings"
+    ]
@@ -0,0 +1,209 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from peony import exceptions
+
+from signal_scanner_bot import env, signal, twitter
+from signal_scanner_bot.dispatcher import Priority, SignalDispatcher
+from signal_scanner_bot.tweet_scheduler import TweetScheduler
+from tests.conftest import run
+
+
+class _Client:
+    """Stand-in Peony client that records posts and fails on request."""
+
+    def __init__(self, failures=None, remaining=None, reset=None):
+        self.posts = []
+        # Call number to the error raised by that call
+        self.failures = failures or {}
+        self.calls = 0
+        self.remaining = remaining
+        self.reset = reset
+        self.api = SimpleNamespace(
+            statuses=SimpleNamespace(update=SimpleNamespace(post=self._post))
+        )
+
+    async def _post(self, status, **params):
+        self.calls += 1
+        if self.calls in self.failures:
+            raise self.failures[self.calls]
+        self.posts.append((status, params.get("in_reply_to_status_id"), time.time()))
+        headers = {}
+        if self.remaining is not None:
+            self.remaining -= 1
+            headers = {
+                "X-Rate-Limit-Remaining": str(self.remaining),
+                "X-Rate-Limit-Reset": str(self.reset),
+            }
+        return SimpleNamespace(id=len(self.posts), headers=headers)
+
+
+async def _no_errors(err):
+    raise AssertionError(f"Unexpected failure: {err!r}")
+
+
+def test_threads_posted_in_priority_order_as_replies():
+    async def scenario():
+        client = _Client()
+        scheduler = TweetScheduler(_no_errors)
+        posted = []
+        scheduler.post(["a1", "a2"], client, on_posted=lambda: posted.append("a"))
+        scheduler.post(["low"], client, priority=Priority.LOW)
+        scheduler.post(["scanner"], client, priority=Priority.HIGH)
+        await scheduler.drain()
+        return client.posts, posted
+
+    posts, posted = run(scenario())
+    assert [(status, reply_to) for status, reply_to, _ in posts] == [
+        ("scanner", None),
+        ("a1", None),
+        ("a2", 2),
+        ("low", None),
+    ]
+    assert posted == ["a"]
+
+
+def test_waits_for_the_rate_limit_window():
+    async def scenario():
+        # Room for one more tweet in a window that resets in half a second
+        reset = time.time() + 0.5
+        client = _Client(remaining=2, reset=reset)
+        scheduler = TweetScheduler(_no_errors)
+        scheduler.post(["first"], client)
+        scheduler.post(["second 1", "second 2"], client)
+        await scheduler.drain()
+        return client.posts, reset
+
+    posts, reset = run(scenario())
+    assert [status for status, _, _ in posts] == ["first", "second 1", "second 2"]
+    # The whole second thread waited for the window instead of being split
+    assert posts[1][2] >= reset
+
+
+def test_transient_errors_retried_mid_thread():
+    async def scenario():
+        client = _Client(
+            failures={2: exceptions.HTTPServiceUnavailable(message="down")}
+        )
+        scheduler = TweetScheduler(_no_errors, retry_base=0.01)
+        scheduler.post(["one", "two"], client)
+        await scheduler.drain()
+        return client.posts, scheduler.retried
+
+    posts, retried = run(scenario())
+    assert [(status, reply_to) for status, reply_to, _ in posts] == [
+        ("one", None),
+        ("two", 1),
+    ]
+    assert retried == 1
+
+
+def test_gives_up_after_retries():
+    async def scenario():
+        errors = []
+
+        async def on_error(err):
+            errors.append(err)
+
+        client = _Client(
+            failures={
+                n: exceptions.HTTPBadGateway(message="bad gateway") for n in (1, 2, 3)
+            }
+        )
+        scheduler = TweetScheduler(on_error, retries=2, retry_base=0.01)
+        scheduler.post(["doomed"], client)
+        scheduler.post(["fine"], client)
+        await scheduler.drain()
+        return client.posts, errors
+
+    posts, errors = run(scenario())
+    assert [status for status, _, _ in posts] == ["fine"]
+    assert len(errors) == 1
+
+
+def test_chained_threads_reply_to_the_last_one():
+    async def scenario():
+        client = _Client()
+        scheduler = TweetScheduler(_no_errors, reply_window=60, reply_max=3)
+        for tweets in (["a"], ["b1", "b2"], ["c"]):
+            scheduler.post(tweets, client, chain="#Scanner")
+        scheduler.post(["unchained"], client)
+        await scheduler.drain()
+        return client.posts
+
+    posts = run(scenario())
+    assert [(status, reply_to) for status, reply_to, _ in posts] == [
+        ("a", None),
+        ("b1", 1),
+        ("b2", 2),
+        # The chain would be too long, so a new one starts
+        ("c", None),
+        ("unchained", None),
+    ]
+
+
+def test_bursts_coalesced_into_one_thread(monkeypatch):
+    async def scenario():
+        client = _Client()
+        monkeypatch.setattr(twitter, "SCHEDULER", TweetScheduler(_no_errors))
+        monkeypatch.setattr(twitter, "COALESCER", twitter.TweetCoalescer(0.05, 3))
+        posted = []
+        for index in range(4):
+            twitter.send_tweet(
+                f"DISPATCH {index}",
+                client,
+                hashtags=["#A"],
+                coalesce=True,
+                on_posted=lambda: posted.append(index),
+            )
+        twitter.send_tweet("other", client, hashtags=["#B"], coalesce=True)
+        await asyncio.sleep(0.1)
+        await twitter.SCHEDULER.drain()
+        return client.posts, posted
+
+    posts, posted = run(scenario())
+    statuses = [status.split("\n\n")[0].strip() for status, _, _ in posts]
+    # The first three fill a burst, the rest go out once the window is up
+    assert statuses == ["DISPATCH 0\nDISPATCH 1\nDISPATCH 2", "DISPATCH 3", "other"]
+    assert len(posted) == 4
+
+
+def test_flushing_every_burst(monkeypatch):
+    async def scenario():
+        client = _Client()
+        monkeypatch.setattr(twitter, "SCHEDULER", TweetScheduler(_no_errors))
+        monkeypatch.setattr(twitter, "COALESCER", twitter.TweetCoalescer(60, 10))
+        for hashtag in ["#A", "#B"]:
+            twitter.send_tweet("DISPATCH", client, hashtags=[hashtag], coalesce=True)
+        # Long before the window would close
+        twitter.COALESCER.flush_all()
+        await twitter.SCHEDULER.drain()
+        return client.posts
+
+    assert len(run(scenario())) == 2
+
+
+def test_failures_are_reported_without_waiting_for_delivery(monkeypatch):
+    alerts = []
+
+    async def scenario():
+        async def undeliverable(message, recipient, attachment=None):
+            alerts.append(message)
+            await asyncio.Event().wait()
+
+        dispatcher = SignalDispatcher(undeliverable)
+        monkeypatch.setattr(signal, "DISPATCHER", dispatcher)
+        monkeypatch.setitem(vars(env), "ADMIN_CONTACT", "+15555550101")
+        client = _Client(failures={1: RuntimeError("boom")})
+        scheduler = TweetScheduler(twitter._tweet_failed)
+        scheduler.post(["doomed"], client)
+        scheduler.post(["fine"], client)
+        # The alert about the first thread never goes out, which mustn't hold
+        # up the second
+        await asyncio.wait_for(scheduler.drain(), 5)
+        return client.posts
+
+    posts = run(scenario())
+    assert [status for status, _, _ in posts] == ["fine"]
+    assert len(alerts) == 1 and alerts[0].startswith("BOT FAILURE: boom")
@@ -0,0 +1,76 @@
+import re
+
+import pytest
+
+from signal_scanner_bot import twitter
+
+
+hypothesis = pytest.importorskip("hypothesis")
+from hypothesis import given  # noqa: E402
+from hypothesis import strategies as st  # noqa: E402
+
+
+HASHTAGS = "#ScannerBot #Seattle"
+NUMBERING = re.compile(r" \d+/\d+$")
+# Latin words, CJK, emoji (with ZWJ sequences) and URLs, joined by spaces and
+# the odd newline
+WORDS = st.one_of(
+    st.text(alphabet="abcdefghijklmnopqrstuvwxyz.,!?", min_size=1, max_size=12),
+    st.text(alphabet="abc", min_size=250, max_size=700),
+    st.text(alphabet="警察局车", min_size=1, max_size=6),
+    st.sampled_from(["👮", "🚓", "👩‍👩‍👧", "👍🏽", "❤️"]),
+    st.builds(lambda path: f"https://example.com/{path}", st.text("abc", max_size=80)),
+    # Long words with a URL stuck on the end
+    st.builds(
+        lambda word, path: f"{word}https://example.com/{path}",
+        st.text(alphabet="abc", min_size=200, max_size=300),
+        st.text("abc", max_size=20),
+    ),
+)
+MESSAGES = st.lists(WORDS, min_size=1, max_size=400).map(" ".join)
+
+
+def _contents(tweet: str) -> str:
+    tweet = NUMBERING.sub("", tweet)
+    return tweet[: -len(twitter.TWEET_CONTINUED)] if tweet.endswith(" ...") else tweet
+
+
+@given(MESSAGES)
+def test_thread_tweets_fit(message):
+    thread = twitter._format_tweet_message(
+        twitter._create_tweet_thread(message, HASHTAGS), HASHTAGS
+    )
+    for tweet in thread:
+        # Threads longer than TWEET_THREAD_MAX are never sent, so only the space
+        # TWEET_PADDING sets aside for the numbering is guaranteed
+        numbering = NUMBERING.search(tweet.rstrip("\n" + HASHTAGS)).group()
+        length = twitter._weighted_length(tweet) - len(numbering)
+        assert length + twitter.TWEET_PADDING <= twitter.TWEET_MAX_SIZE
+
+
+@given(MESSAGES)
+def test_thread_keeps_the_whole_message(message):
+    thread = twitter._create_tweet_thread(message, HASHTAGS)
+    assert all(NUMBERING.search(tweet) for tweet in thread)
+    # Words may have been split across tweets, but nothing is lost or reordered
+    rebuilt = "".join(_contents(tweet) for tweet in thread)
+    assert rebuilt.replace(" ", "") == message.replace(" ", "")
+
+
+def test_thread_with_url_on_the_limit():
+    # The URL only takes the word over the limit because of its weighting
+    message = "a" * 241 + "http://x" + " bye"
+    thread = twitter._create_tweet_thread(message, "#A #B")
+    rebuilt = "".join(_contents(tweet) for tweet in thread)
+    assert rebuilt.replace(" ", "") == message.replace(" ", "")
+    # The URL isn't broken up
+    assert any("http://x" in tweet for tweet in thread)
+    for tweet in twitter._format_tweet_message(thread, "#A #B"):
+        assert twitter._weighted_length(tweet) <= twitter.TWEET_MAX_SIZE
+
+
+def test_weighted_length():
+    assert twitter._weighted_length("hello") == 5
+    assert twitter._weighted_length("警察") == 4
+    assert twitter._weighted_length("👩‍👩‍👧") == 2
+    assert twitter._weighted_length("see https://example.com/" + "a" * 100) == 27
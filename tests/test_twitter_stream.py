@@ -0,0 +1,101 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+from signal_scanner_bot import twitter_stream
+from signal_scanner_bot.twitter_stream import TwitterStream
+from tests.conftest import run
+
+
+def _tweet(tweet_id):
+    return {"id": tweet_id, "text": f"tweet {tweet_id}", "user": {"id_str": "1"}}
+
+
+class _Client:
+    """
+    Stand-in Peony client. Each time the stream is opened it plays the next
+    script of events, a script ending in None staying open (and quiet) forever.
+    """
+
+    def __init__(self, scripts, timeline):
+        self.scripts = list(scripts)
+        self.timeline = timeline
+        self.opened = 0
+        self.stream = SimpleNamespace(
+            statuses=SimpleNamespace(filter=SimpleNamespace(post=self._filter))
+        )
+        self.api = SimpleNamespace(
+            statuses=SimpleNamespace(user_timeline=SimpleNamespace(get=self._get))
+        )
+
+    async def _get(self, user_id, since_id, count):
+        return [tweet for tweet in self.timeline if tweet["id"] > since_id]
+
+    @contextlib.asynccontextmanager
+    async def _filter(self, **params):
+        self.opened += 1
+        yield self._events(self.scripts.pop(0) if self.scripts else [None])
+
+    async def _events(self, script):
+        for event in script:
+            if event is None:
+                await asyncio.Event().wait()
+            yield event
+
+
+def _consume(client, stall_timeout=900):
+    handled = []
+
+    async def handle(tweet):
+        handled.append(tweet["id"])
+
+    async def scenario():
+        stream = TwitterStream(client, ["1"], handle, stall_timeout=stall_timeout)
+        task = asyncio.create_task(stream.run())
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    run(scenario())
+    return handled
+
+
+def test_catches_up_after_peony_reconnects(monkeypatch):
+    monkeypatch.setattr(twitter_stream, "MAX_RECONNECT_DELAY", 0)
+    client = _Client(
+        [
+            [
+                {"connected": True},
+                _tweet(1),
+                {"reconnecting_in": 0, "error": None},
+                {"stream_restart": True},
+                # Already caught up on, so skipped
+                _tweet(3),
+                _tweet(4),
+                None,
+            ]
+        ],
+        # 2 and 3 were posted while the stream was down
+        timeline=[_tweet(1), _tweet(2), _tweet(3)],
+    )
+    assert _consume(client) == [1, 2, 3, 4]
+    assert client.opened == 1
+
+
+def test_reopens_a_stream_that_ends(monkeypatch):
+    monkeypatch.setattr(twitter_stream, "MAX_RECONNECT_DELAY", 0)
+    client = _Client(
+        [[{"connected": True}, _tweet(1)], [{"connected": True}, _tweet(2), None]],
+        timeline=[_tweet(1), _tweet(2)],
+    )
+    # 2 is caught up on as soon as the stream is back
+    assert _consume(client) == [1, 2]
+    assert client.opened == 2
+
+
+def test_quiet_stream_with_missed_tweets_is_reopened(monkeypatch):
+    monkeypatch.setattr(twitter_stream, "MAX_RECONNECT_DELAY", 0)
+    client = _Client(
+        [[{"connected": True}, _tweet(1), None]], timeline=[_tweet(1), _tweet(2)]
+    )
+    assert _consume(client, stall_timeout=0.05) == [1, 2]
+    assert client.opened >= 2